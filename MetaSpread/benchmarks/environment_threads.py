@@ -0,0 +1,52 @@
+import numpy as np
+import tempfile
+import time
+import os
+import sys
+from metaspread.cancermodel import CancerModel
+from metaspread.configs import SimulationConfig
+
+# Measures how the MMP2 and ECM update of CancerModel.calculate_environment scales
+# with the amount of threads, for 3 to 10 sites of 201x201 grid points.
+# Usage, from the folder with the simulations_configs.csv:
+#     python benchmarks/environment_threads.py [max-threads] [steps]
+
+def benchmark_environment(grids_number, environment_workers, environment_tiles=1, steps=50, gridsize=201):
+    """
+    Returns the mean time in seconds of one call of calculate_environment
+    """
+    config = SimulationConfig.from_csv("simulations_configs.csv").replace(
+        gridsize=gridsize,
+        grids_number=grids_number,
+        extravasation_probs=[1] + [0]*(grids_number-2),
+        secondary_sites_vessels=[10]*(grids_number-1))
+    with tempfile.TemporaryDirectory() as folder:
+        model = CancerModel(
+            number_of_initial_cells=0,
+            width=gridsize,
+            height=gridsize,
+            grids_number=grids_number,
+            max_steps=steps,
+            data_collection_period=steps,
+            new_simulation_folder=folder,
+            seed=0,
+            environment_workers=environment_workers,
+            environment_tiles=environment_tiles,
+            config=config)
+        generator = np.random.default_rng(0)
+        for i in range(grids_number):
+            model.mmp2[i][0] = generator.random((gridsize, gridsize))
+        model.calculate_environment(model.mmp2, model.ecm)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.calculate_environment(model.mmp2, model.ecm)
+        return (time.perf_counter() - start)/steps
+
+if __name__ == "__main__":
+    max_threads = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    threads = [1] + [workers for workers in [2, 4, 8, 16, 32, 64] if workers <= max_threads]
+    print("sites " + " ".join(f"{workers:>9} thr" for workers in threads) + "   speedup")
+    for grids_number in [3, 5, 10]:
+        times = [benchmark_environment(grids_number, workers, environment_tiles=max(1, workers//grids_number), steps=steps) for workers in threads]
+        print(f"{grids_number:>5} " + " ".join(f"{1000*seconds:>10.2f}ms" for seconds in times) + f"   {times[0]/min(times):.2f}x")
@@ -0,0 +1,145 @@
+import numpy as np
+import concurrent.futures
+import multiprocessing
+import subprocess
+import platform
+import tempfile
+import resource
+import json
+import time
+import sys
+import os
+from datetime import datetime
+from metaspread.cancermodel import CancerModel
+from metaspread.configs import SimulationConfig
+
+# Benchmarks of the simulation core in canned scenarios. Every scenario runs in its
+# own process, so its peak memory is not mixed with the ones of the other scenarios,
+# and its results are appended as one json line to benchmarks/results.jsonl, so the
+# results of different versions and engines can be compared.
+# Usage, from the folder with the simulations_configs.csv:
+#     python benchmarks/suite.py [scenarios] [engines] [steps]
+# for example: python benchmarks/suite.py small,default agents,arrays 20
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+# values of the simulations_configs.csv replaced in every scenario
+SCENARIOS = {
+    "small": {"gridsize": 51, "number_of_initial_cells": 100},
+    "default": {"gridsize": 201, "number_of_initial_cells": 388, "grids_number": 3},
+    "stress": {
+        "gridsize": 401,
+        "number_of_initial_cells": 50000,
+        "grids_number": 10,
+        "extravasation_probs": [0.5] + [0.0625]*8,
+        "secondary_sites_vessels": [10]*9,
+        # enough grid points for the initial cells, with the vessels around them
+        "n_center_points_for_tumor": 12600,
+        "n_center_points_for_Vessels": 16000},
+}
+
+# phases of the profiler of the model reported by the benchmark
+PHASES = ["environment", "movement probabilities", "movement", "data collection", "cells data writer", "fields writer", "vasculature writer", "checkpoint writer"]
+
+def get_peak_rss_megabytes():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux gives it in kilobytes and macOS in bytes
+    return peak_rss / 2**20 if sys.platform == "darwin" else peak_rss / 2**10
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_scenario(scenario, engine="agents", steps=20, data_collection_period=5, seed=0):
+    """
+    Runs steps steps of a scenario and measures its throughput.
+
+    The time of every phase of CancerModel.step (the environment, the movement of
+    the cells, that is CancerCell.move for the agents engine, and the collection and
+    output of the data) is taken from the profiler of the model. As the cells only
+    proliferate every doubling time, proliferate is timed separately at the end.
+
+    Returns:
+        dict with the results of the benchmark
+    """
+    config = SimulationConfig.from_csv("simulations_configs.csv").replace(**SCENARIOS[scenario])
+    with tempfile.TemporaryDirectory() as folder:
+        for subfolder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+            os.makedirs(os.path.join(folder, subfolder))
+        start = time.perf_counter()
+        model = CancerModel(
+            number_of_initial_cells=config.number_of_initial_cells,
+            width=config.gridsize,
+            height=config.gridsize,
+            grids_number=config.grids_number,
+            max_steps=steps,
+            data_collection_period=data_collection_period,
+            new_simulation_folder=folder,
+            seed=seed,
+            engine=engine,
+            config=config)
+        setup_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.step()
+        steps_time = time.perf_counter() - start
+        proliferate_times = {}
+        for cell_type in ["mesenchymal", "epithelial"]:
+            start = time.perf_counter()
+            model.proliferate(cell_type)
+            proliferate_times[cell_type] = time.perf_counter() - start
+        profiler = model.profiler
+        return {
+            "Scenario": scenario,
+            "Engine": engine,
+            "Steps": steps,
+            "Data collection period": data_collection_period,
+            "Grid size": config.gridsize,
+            "Grids": config.grids_number,
+            "Initial cells": config.number_of_initial_cells,
+            "Setup time (s)": setup_time,
+            "Steps per second": steps / steps_time,
+            "Step time (ms)": 1000 * steps_time / steps,
+            "Phase time per call (ms)": {phase: 1000 * profiler.times[phase] / profiler.calls[phase] for phase in PHASES if phase in profiler.times},
+            "Proliferate time (ms)": {cell_type: 1000 * seconds for cell_type, seconds in proliferate_times.items()},
+            "Counters": dict(profiler.counters),
+            "Peak RSS (MB)": get_peak_rss_megabytes()}
+
+def run_suite(scenarios=("small", "default"), engines=("agents", "arrays"), steps=20, results_file=RESULTS_FILE):
+    """
+    Runs every scenario with every engine, each one in a new process, and appends
+    the results to results_file
+
+    Returns:
+        list with the results of every run
+    """
+    context = {
+        "Date": datetime.now().isoformat(timespec="seconds"),
+        "Commit": get_git_commit(),
+        "Python": platform.python_version(),
+        "Numpy": np.__version__,
+        "Machine": platform.machine(),
+        "CPUs": os.cpu_count()}
+    all_results = []
+    for scenario in scenarios:
+        for engine in engines:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = {**context, **executor.submit(run_scenario, scenario, engine, steps).result()}
+            print(f"{scenario:>8} {engine:>7}: {results['Steps per second']:8.2f} steps/s, "
+                  f"environment {results['Phase time per call (ms)'].get('environment', 0):8.2f} ms, "
+                  f"movement {results['Phase time per call (ms)'].get('movement', 0):8.2f} ms, "
+                  f"peak RSS {results['Peak RSS (MB)']:8.1f} MB")
+            with open(results_file, "a") as f:
+                f.write(json.dumps(results) + "\n")
+            all_results.append(results)
+    return all_results
+
+if __name__ == "__main__":
+    scenarios = sys.argv[1].split(",") if len(sys.argv) > 1 else ["small", "default"]
+    engines = sys.argv[2].split(",") if len(sys.argv) > 2 else ["agents", "arrays"]
+    steps = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{scenario}'! Use one of {list(SCENARIOS)}.")
+    run_suite(scenarios, engines, steps)
@@ -5,6 +5,10 @@ import metaspread.simrunner as simrunner
 import metaspread.datagenerator as datagenerator
 import metaspread.graphgenerator as graphgenerator
 import metaspread.videogenerator as videogenerator
+import metaspread.fieldstore as fieldstore
+import metaspread.cellstore as cellstore
+import metaspread.ensemble as ensemble
+import metaspread.sweep as sweep
 
 if __name__ == "__main__":
     # simple checks for misspellings in the arguments
@@ -28,7 +32,16 @@ if __name__ == "__main__":
         else:
             raise Exception("Incorrent amount of or unrecognized arguments!")
     elif len(sys.argv) == 3:
-        raise Exception("Incorrent amount of or unrecognized arguments!")
+        if sys.argv[1] == "convert":
+            # converts the .csv files of a simulation made with older versions to the binary formats
+            simulation_folder = os.path.join("Simulations",sys.argv[2])
+            fieldstore.convert_simulation_fields(simulation_folder)
+            cellstore.convert_cells_data(simulation_folder)
+        elif sys.argv[1] == "sweep":
+            # runs the sweep described in a json file
+            sweep.run_sweep_file(sys.argv[2])
+        else:
+            raise Exception("Incorrent amount of or unrecognized arguments!")
     elif len(sys.argv) == 4:
         if sys.argv[1] == "run":
             total_steps     = int(sys.argv[2])
@@ -50,6 +63,11 @@ if __name__ == "__main__":
             total_steps     = int(sys.argv[3])
             interval_steps  = int(sys.argv[4])
             simrunner.run_simulation(total_steps, interval_steps, simulation_folder)
+        elif sys.argv[1] == "ensemble":
+            replicates      = int(sys.argv[2])
+            total_steps     = int(sys.argv[3])
+            interval_steps  = int(sys.argv[4])
+            ensemble.run_ensemble(replicates, total_steps, interval_steps)
         elif sys.argv[1] == "postprocess" and sys.argv[2] == "graphics":
             simulation_folder = sys.argv[3]
             amount_of_pictures = int(sys.argv[4])
@@ -59,7 +77,20 @@ if __name__ == "__main__":
             frame_rate = int(sys.argv[4])
             videogenerator.generate_videos(simulation_folder, frame_rate)
     elif len(sys.argv) == 6:
-        if sys.argv[1] == "postprocess" and sys.argv[2] == "all":
+        if sys.argv[1] == "run":
+            # updates the environment of the sites in environment-workers threads, splitting each site in environment-tiles blocks
+            total_steps         = int(sys.argv[2])
+            interval_steps      = int(sys.argv[3])
+            environment_workers = int(sys.argv[4])
+            environment_tiles   = int(sys.argv[5])
+            simrunner.run_simulation(1, total_steps, interval_steps, environment_workers=environment_workers, environment_tiles=environment_tiles)
+        elif sys.argv[1] == "ensemble":
+            replicates      = int(sys.argv[2])
+            total_steps     = int(sys.argv[3])
+            interval_steps  = int(sys.argv[4])
+            master_seed     = int(sys.argv[5])
+            ensemble.run_ensemble(replicates, total_steps, interval_steps, master_seed=master_seed)
+        elif sys.argv[1] == "postprocess" and sys.argv[2] == "all":
                 simulation_folder  = sys.argv[3]
                 amount_of_pictures = int(sys.argv[4])
                 frame_rate = int(sys.argv[5])
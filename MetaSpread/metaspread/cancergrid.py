@@ -0,0 +1,43 @@
+import mesa
+
+# Index of each phenotype in the first axis of the occupancy arrays
+PHENOTYPE_CODES = {"mesenchymal": 0, "epithelial": 1}
+
+class CancerGrid(mesa.space.MultiGrid):
+    """
+    MultiGrid that keeps count of the cancer cells of each phenotype in every grid point.
+
+    The counts are stored in the occupancy array given at creation, which is
+    updated every time a cell is placed, moved or removed from the grid, so
+    they never have to be recounted from the contents of the grid points.
+
+    Attributes:
+    ---------------
+    occupancy: numpy array
+        (2, width, height) integer array, where occupancy[0] holds the amount of
+        mesenchymal cells and occupancy[1] the amount of epithelial cells
+    """
+
+    def __init__(self, width, height, torus, occupancy):
+        super().__init__(width, height, torus)
+        self.occupancy = occupancy
+
+    def place_agent(self, agent, pos):
+        x, y = pos
+        is_new_in_position = agent.pos is None or agent not in self._grid[x][y]
+        super().place_agent(agent, pos)
+        if is_new_in_position and agent.agent_type == "cell":
+            self.occupancy[PHENOTYPE_CODES[agent.phenotype], x, y] += 1
+
+    def remove_agent(self, agent):
+        x, y = agent.pos
+        super().remove_agent(agent)
+        if agent.agent_type == "cell":
+            self.occupancy[PHENOTYPE_CODES[agent.phenotype], x, y] -= 1
+
+    def count_cells(self, pos):
+        """
+        Returns the amount of cancer cells, of any phenotype, in the grid point pos
+        """
+        x, y = pos
+        return int(self.occupancy[0, x, y]) + int(self.occupancy[1, x, y])
@@ -2,22 +2,42 @@ import mesa
 import matplotlib.pyplot as plt
 import numpy as np
 import warnings
+import concurrent.futures
 warnings.simplefilter(action='ignore', category=FutureWarning)
 import pandas as pd
 import os
 import json
 import ast
+import re
 from metaspread.cancercell import CancerCell
 from metaspread.vessel import Vessel
+from metaspread.cancergrid import CancerGrid, PHENOTYPE_CODES
+from metaspread.cellpopulation import CellPopulation, PHENOTYPE_NAMES
+from metaspread.vasculature import Vasculature
+from metaspread.fieldstore import save_field, load_field, list_field_files
+from metaspread.cellstore import CellsDataCollector, append_cells_data, read_cells_data_records, records_to_dataframe, CELLS_DATA_FILE, CELLS_DATA_DTYPE, AGENT_TYPE_CODES, NO_PHENOTYPE
+from metaspread.checkpoint import save_checkpoint, load_checkpoint, get_checkpoint_path
 from metaspread.quasicircle import find_quasi_circle
+from metaspread.profiler import StepProfiler
 from matplotlib import pyplot as plt
 from matplotlib import cm
 # from Classes.configs import *
-import metaspread.configs
+from metaspread.configs import SimulationConfig
 # import pickle
 
+# folders of a simulation with the files saved at every data collection step,
+# whose names end with the step, as in Vasculature-{step}step.json
+STEP_FILES_FOLDERS = ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]
 
-def get_cluster_survival_probability(cluster):
+def get_file_step(file_name):
+    """
+    Returns the step in the name of a file saved at a data collection step, or None if it has none
+    """
+    match = re.search(r'-(\d+)step', file_name)
+    return int(match.group(1)) if match else None
+
+
+def get_cluster_survival_probability(cluster, config):
     """
     Takes in a tuple representing a cluster, returns the survival probabiltiy.
     
@@ -25,6 +45,7 @@ def get_cluster_survival_probability(cluster):
         Cluster: a tuple representing the cancer cells cluster, where the first 
         element corresponds to the amount of Mesenchymal cells, and the second
         corresponds to the amount of Epithelial cells.
+        config: SimulationConfig with the survival probabilities
     Returns:
         The corresponding survival probability, according to if its a songle-cell
         cluster or a multi-cellular one.
@@ -34,9 +55,9 @@ def get_cluster_survival_probability(cluster):
     if cluster[1] < 0:
         raise Exception(f"Error! Epithelial cells are negative: {cluster[1]}")
     if sum(cluster) == 1:
-        return (single_cell_survival)
+        return (config.single_cell_survival)
     elif sum(cluster) > 1:
-        return (cluster_survival)
+        return (config.cluster_survival)
     elif sum(cluster) == 0:
         raise Exception(f"Error, no cells in cluster!")
     else:
@@ -63,9 +84,213 @@ def count_vasculature_cells(model):
     Returns:
         amount_of_cells (int): the total amount of cells in the vasculature
     """
-    amount_of_cells = sum([sum(x+y for x,y in value) for value in model.vasculature.values()])
+    amount_of_cells = model.vasculature.count_cells()
     return amount_of_cells
 
+def compute_site_environment(mmp2, ecm, mesenchymal_count, config, region=None):
+    """
+    Computes the next state of the MMP2 and ECM concentrations of a rectangular
+    region of a site, writing it in the second layer of the arrays.
+
+    The MMP2 diffusion uses a five point stencil over the whole region at once.
+    The borders are reflective: a neighbour that falls outside of the grid is
+    replaced by the neighbour on the opposite side. As only the first layer is
+    read, separate regions of the same site can be computed at the same time.
+
+    Input:
+        mmp2, ecm, mesenchymal_count, config: as in update_site_environment
+        region: (first row, row after the last one, first column, column after the
+            last one) of the region to compute. If None, the whole site is computed
+    Returns:
+        None
+    """
+    dmmp, tha, xha, th = config.dmmp, config.tha, config.xha, config.th
+    width, height = mmp2.shape[1:]
+    x0, x1, y0, y1 = (0, width, 0, height) if region is None else region
+    rows = np.arange(x0, x1)
+    columns = np.arange(y0, y1)
+    previous_rows = np.where(rows == 0, 1, rows - 1)
+    next_rows = np.where(rows == width - 1, width - 2, rows + 1)
+    previous_columns = np.where(columns == 0, 1, columns - 1)
+    next_columns = np.where(columns == height - 1, height - 2, columns + 1)
+    columns_band = mmp2[0,:,y0:y1]
+    rows_band = mmp2[0,x0:x1]
+    neighbours_sum = columns_band[next_rows] + columns_band[previous_rows] + rows_band[:,next_columns] + rows_band[:,previous_columns]
+    mesenchymal = mesenchymal_count[x0:x1,y0:y1]
+    mmp2[1,x0:x1,y0:y1] = dmmp*tha/xha**2*neighbours_sum \
+            + mmp2[0,x0:x1,y0:y1]*(1-4*dmmp*tha/xha**2-th*config.Lambda) + tha*config.theta*mesenchymal
+    ecm[1,x0:x1,y0:y1] = ecm[0,x0:x1,y0:y1]*(1-tha*(config.gamma1*mesenchymal+config.gamma2*mmp2[1,x0:x1,y0:y1]))
+
+def advance_site_environment(mmp2, ecm, region=None):
+    """
+    Checks the ECM computed by compute_site_environment in a region of a site and
+    makes the next state of its MMP2 and ECM concentrations the current one
+    """
+    x0, x1, y0, y1 = (0, mmp2.shape[1], 0, mmp2.shape[2]) if region is None else region
+    next_ecm = ecm[1,x0:x1,y0:y1]
+    if next_ecm.min() < 0:
+        x, y = np.unravel_index(next_ecm.argmin(), next_ecm.shape)
+        warnings.warn(f"<0 ecm in {np.count_nonzero(next_ecm < 0)} grid points, minimum in [1,{x0+x},{y0+y}] is {next_ecm[x,y]}")
+    if next_ecm.max() > 1:
+        x, y = np.unravel_index(next_ecm.argmax(), next_ecm.shape)
+        warnings.warn(f">1 ecm in {np.count_nonzero(next_ecm > 1)} grid points, maximum in [1,{x0+x},{y0+y}] is {next_ecm[x,y]}")
+        print("ECM is greater than 1! Your MMP2 diffusion rate is probably too high")
+    mmp2[0,x0:x1,y0:y1] = mmp2[1,x0:x1,y0:y1]
+    ecm[0,x0:x1,y0:y1] = next_ecm
+
+def update_site_environment(mmp2, ecm, mesenchymal_count, config, region=None):
+    """
+    Advances the MMP2 and ECM concentrations of a single site by one step.
+
+    Input:
+        mmp2: (2, width, height) array of the site, the first layer holding the
+            current state and the second one the next state
+        ecm: (2, width, height) array of the site, with the same layout as mmp2
+        mesenchymal_count: (width, height) array with the amount of mesenchymal
+            cells in every grid point of the site
+        config: SimulationConfig with the parameters of the simulation
+        region: as in compute_site_environment. The rest of the site is not changed
+    Returns:
+        None
+    """
+    compute_site_environment(mmp2, ecm, mesenchymal_count, config, region)
+    advance_site_environment(mmp2, ecm, region)
+
+def find_active_region(mmp2, mesenchymal_count, region, tolerance):
+    """
+    Finds the region of a site whose environment has to be updated in the next step.
+
+    Outside of the region there are no mesenchymal cells and the MMP2 is not greater
+    than tolerance, so the MMP2 and ECM there are left as they are. With a tolerance
+    of 0 this gives exactly the same result as updating the whole site, as the MMP2
+    is zero and the ECM does not change where there are no mesenchymal cells and no MMP2.
+    Only the current region is searched: the cells move at most one grid point per
+    step, and the MMP2 spreads at most one grid point per step, so the region found
+    in the previous step, grown by one point in every direction, still covers them.
+
+    Input:
+        mmp2: (width, height) array with the current MMP2 concentration of the site
+        mesenchymal_count: (width, height) array with the amount of mesenchymal cells
+        region: (x0, x1, y0, y1) region found in the previous step
+        tolerance: MMP2 concentration under which the MMP2 is considered negligible
+    Returns:
+        the new region, grown by one grid point in every direction, or None if it is empty
+    """
+    width, height = mmp2.shape
+    x0, x1, y0, y1 = region
+    active = (mmp2[x0:x1,y0:y1] > tolerance) | (mesenchymal_count[x0:x1,y0:y1] > 0)
+    active_rows = np.flatnonzero(active.any(axis=1))
+    if len(active_rows) == 0:
+        return None
+    active_columns = np.flatnonzero(active.any(axis=0))
+    return (max(x0 + active_rows[0] - 1, 0), min(x0 + active_rows[-1] + 2, width),
+            max(y0 + active_columns[0] - 1, 0), min(y0 + active_columns[-1] + 2, height))
+
+def rank_within_groups(keys):
+    """
+    Ranks the elements of keys among those with the same value.
+
+    Input:
+        keys: 1D integer array
+    Returns:
+        array with, for every element of keys, the amount of elements
+        with the same key that come before it
+    """
+    _, group, group_sizes = np.unique(keys, return_inverse=True, return_counts=True)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    by_group = np.argsort(group, kind="stable")
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[by_group] = np.arange(len(keys)) - np.repeat(group_starts, group_sizes)
+    return rank
+
+def get_movement_probabilities(ecm, config, fixed_probabilities=(None, None, None, None)):
+    """
+    Calculates the movement probabilities of the cancer cells of a site.
+
+    All the cells of the same phenotype in the same grid point have the same
+    probabilities, so they are calculated once for the whole site. Moves out
+    of the grid have probability 0, and on the borders the ECM gradient in
+    that axis is taken as 0. The fixed probabilities of moves out of the grid
+    are dropped and the rest of probabilities of that grid point normalized.
+    A ValueError is raised if the probability of staying in place is negative.
+
+    Input:
+        ecm: (width, height) array with the current ECM concentration of the site
+        config: SimulationConfig with the parameters of the simulation
+        fixed_probabilities: list with the fixed probabilities of moving to the
+            left, right, top and bottom. The ones that are not None replace the
+            calculated probabilities (they are only used for testing)
+    Returns:
+        (2, 5, width, height) array, where [phenotype code, direction, x, y] is the
+        probability that a cell in (x, y) moves to the left, right, top, bottom,
+        or stays in place (directions 0 to 4)
+    """
+    th, xh = config.th, config.xh
+    width, height = ecm.shape
+    gradient_x = np.zeros((width, height))
+    gradient_y = np.zeros((width, height))
+    gradient_x[1:-1,:] = ecm[2:,:] - ecm[:-2,:]
+    gradient_y[:,1:-1] = ecm[:,2:] - ecm[:,:-2]
+    probabilities = np.empty((2, 5, width, height))
+    for phenotype, code in PHENOTYPE_CODES.items():
+        diff_coeff, phi = (config.dM, config.phiM) if phenotype == "mesenchymal" else (config.dE, config.phiE)
+        probabilities[code,0] = th/xh**2*(diff_coeff-phi/4*gradient_x)
+        probabilities[code,1] = th/xh**2*(diff_coeff+phi/4*gradient_x)
+        probabilities[code,2] = th/xh**2*(diff_coeff+phi/4*gradient_y)
+        probabilities[code,3] = th/xh**2*(diff_coeff-phi/4*gradient_y)
+    probabilities[:,0,0,:]  = 0
+    probabilities[:,1,-1,:] = 0
+    probabilities[:,2,:,-1] = 0
+    probabilities[:,3,:,0]  = 0
+    for direction, fixed_probability in enumerate(fixed_probabilities):
+        if fixed_probability is not None:
+            probabilities[:,direction] = fixed_probability
+    probabilities[:,4] = 1 - probabilities[:,:4].sum(axis=1)
+    if (probabilities[:,4] < 0).any():
+        raise ValueError("The probability of staying in place is negative! The probabilities of moving left, right, top and bottom must not sum more than 1.")
+    if any(fixed_probability is not None for fixed_probability in fixed_probabilities):
+        # the fixed probabilities of moves out of the grid are dropped, and the rest
+        # normalized, so a cell that cannot move in any given direction stays in place
+        probabilities[:,0,0,:]  = 0
+        probabilities[:,1,-1,:] = 0
+        probabilities[:,2,:,-1] = 0
+        probabilities[:,3,:,0]  = 0
+        total = probabilities.sum(axis=1)
+        probabilities[:,4][total == 0] = 1
+        probabilities /= np.where(total == 0, 1, total)[:,None]
+    return probabilities
+
+def update_movement_probabilities(probabilities, ecm, config, fixed_probabilities, region):
+    """
+    Recalculates the movement probabilities of a site only where they can have changed.
+
+    The probabilities of a grid point depend on the ECM of its von Neumann neighbourhood,
+    so after updating the ECM in region only the points of region grown by one grid
+    point in every direction change. They are calculated from the ECM of that window
+    grown by one more point, so its gradients are the ones of the whole site, and the
+    rest of probabilities is kept as it is.
+
+    Input:
+        probabilities: (2, 5, width, height) array with the probabilities of the site, updated in place
+        ecm: (width, height) array with the current ECM concentration of the site
+        config: SimulationConfig with the parameters of the simulation
+        fixed_probabilities: list with the fixed probabilities of moving to the
+            left, right, top and bottom, as in get_movement_probabilities
+        region: (x0, x1, y0, y1) region where the ECM was updated
+    Returns:
+        None
+    """
+    width, height = ecm.shape
+    x0, x1, y0, y1 = region
+    x0, x1, y0, y1 = max(x0 - 1, 0), min(x1 + 1, width), max(y0 - 1, 0), min(y1 + 1, height)
+    ex0, ex1, ey0, ey1 = max(x0 - 1, 0), min(x1 + 1, width), max(y0 - 1, 0), min(y1 + 1, height)
+    window_probabilities = get_movement_probabilities(ecm[ex0:ex1,ey0:ey1], config, fixed_probabilities)
+    probabilities[:,:,x0:x1,y0:y1] = window_probabilities[:,:,x0-ex0:x1-ex0,y0-ey0:y1-ey0]
+
+# columns of the arrivals statistics saved in Arrivals.csv, with one row per secondary site
+# and arrival step. The clusters that die in the vasculature are counted for the whole step
+ARRIVALS_COLUMNS = ["Step", "Grid", "Clusters", "Extravasated mesenchymal cells", "Extravasated epithelial cells", "Cells without space", "Clusters dead in the vasculature"]
+
 class CancerModel(mesa.Model):
     """
     Class for the model.
@@ -83,6 +308,31 @@ class CancerModel(mesa.Model):
     seed: int
         the seed used for the random number generation for all the simulation.
         If None, the random one will be selected by default.
+    engine: str
+        how the cancer cells are stored and updated. "agents" (the default) uses
+        one CancerCell agent per cell, while "arrays" stores all the cells in a
+        CellPopulation of numpy arrays, which uses much less memory per cell.
+        Both engines sample the moves of all cells of a step in one batch.
+    checkpoint_period: int
+        amount of steps between the checkpoints saved in Checkpoint.npz, from which
+        a loaded simulation continues exactly where it stopped. If None (the default)
+        a checkpoint is saved at every data collection step, and if 0 none are saved.
+    config: SimulationConfig
+        parameters of the simulation, which can also be given as a dict. If None, they are
+        read from simulations_configs.csv. A loaded simulation uses the configs.csv of its folder.
+    environment_workers: int
+        amount of threads used to update the MMP2 and ECM of the sites at the same time.
+        With 1 (the default) the sites are updated one after the other.
+    environment_tiles: int
+        amount of blocks of rows in which every site is split when environment_workers is
+        greater than 1, so the threads can also share the work of large sites
+    environment_tolerance: float
+        MMP2 concentration under which it is considered negligible. The environment
+        is only updated in the bounding box of the mesenchymal cells and the MMP2 greater
+        than this tolerance, grown as the tumour invades the site. With 0 (the default)
+        the results are exactly the ones of updating the whole site, and a small positive
+        value such as 1e-12 keeps the box much smaller while the tumour is small.
+        If None, the whole site is always updated.
 
     Methods:
     ---------------
@@ -94,17 +344,35 @@ class CancerModel(mesa.Model):
         Calculates the next step for the given arrays of mmp2 and ecm concentrations
     disaggregate_clusters(time)
         For a given time, it will dissagregate single cells from clusters
+    check_config()
+        Checks that the config fits the amount of grids and their size
+    close()
+        Shuts down the threads of environment_workers
     """
 
-    def __init__(self, number_of_initial_cells, width, height, grids_number, max_steps, data_collection_period, new_simulation_folder, loaded_simulation_path="", fixed_p_left=None, fixed_p_right=None, fixed_p_top=None, fixed_p_bottom=None, seed=None):
+    # offsets of the left, right, top, bottom and stay moves, in the order used by get_movement_probabilities
+    MOVE_DX = np.array([-1, 1, 0, 0, 0])
+    MOVE_DY = np.array([0, 0, 1, -1, 0])
+
+    def __init__(self, number_of_initial_cells, width, height, grids_number, max_steps, data_collection_period, new_simulation_folder, loaded_simulation_path="", fixed_p_left=None, fixed_p_right=None, fixed_p_top=None, fixed_p_bottom=None, seed=None, engine="agents", checkpoint_period=None, config=None, environment_workers=1, environment_tiles=1, environment_tolerance=0.0):
         super().__init__()  
         # self.simulations_dir = "Simulations"
-        
+        if engine not in ("agents", "arrays"):
+            raise ValueError(f"Unknown engine '{engine}'! Use 'agents' or 'arrays'.")
+        self.engine = engine
+        self.rng = np.random.default_rng(seed)
+        self.cells = CellPopulation() if engine == "arrays" else None
+        #vessels never move, so they are kept out of the scheduler
+        self.vessel_agents = []
+        #one row per site and step in which clusters arrived from the vasculature
+        self.arrivals_data = []
+        #amount of rows of arrivals_data already saved in Arrivals.csv
+        self.saved_arrivals = 0
         self.fixed_p_left=fixed_p_left
         self.fixed_p_right=fixed_p_right
         self.fixed_p_top=fixed_p_top
         self.fixed_p_bottom=fixed_p_bottom
-        self.vasculature = {}
+        self.vasculature = Vasculature()
         self.number_of_initial_cells = number_of_initial_cells
         self.width = width
         self.height = height
@@ -113,11 +381,26 @@ class CancerModel(mesa.Model):
         self.current_agent_id = 0
         self.max_steps = max_steps
         self.data_collection_period = data_collection_period
+        self.checkpoint_period = data_collection_period if checkpoint_period is None else checkpoint_period
+        self.environment_tiles = environment_tiles
+        #sites without cells and without MMP2, whose environment does not change until cells arrive
+        self.dormant_sites = [False] * grids_number
+        #amount of updates of the environment of a site skipped because it was dormant
+        self.dormant_site_steps = 0
+        self.environment_tolerance = environment_tolerance
+        #(x0, x1, y0, y1) region of every site where the environment is updated, None if there is nothing to update
+        self.active_regions = [(0, width, 0, height) for _ in range(grids_number)]
+        #time spent in each phase of the steps and counters of the events of the simulation
+        self.profiler = StepProfiler()
+        self.movement_probabilities = None
+        self.environment_executor = concurrent.futures.ThreadPoolExecutor(max_workers=environment_workers) if environment_workers > 1 else None
         self.new_simulation_folder  = new_simulation_folder
-        self.mesenchymal_count = [np.zeros((width, height), dtype=float) for _ in range(grids_number)]
-        self.epithelial_count = [np.zeros((width, height), dtype=float) for _ in range(grids_number)]
         self.grids_number = grids_number
-        self.grids = [mesa.space.MultiGrid(width, height, False) for _ in range(self.grids_number)]
+        #amount of cells of each phenotype in every grid point, kept up to date by the grids
+        self.occupancy = np.zeros((grids_number, 2, width, height), dtype=np.int32)
+        self.mesenchymal_count = [self.occupancy[i,0] for i in range(grids_number)]
+        self.epithelial_count = [self.occupancy[i,1] for i in range(grids_number)]
+        self.grids = [CancerGrid(width, height, False, self.occupancy[i]) for i in range(self.grids_number)]
         self.grid_ids = [i+1 for i in range(self.grids_number)]
         self.cancer_cells_counter = [0] * grids_number
         self.time_grid_got_populated = [-1 for _ in range(self.grids_number)]
@@ -126,29 +409,42 @@ class CancerModel(mesa.Model):
         self.mmp2 = [np.zeros((2, width, height), dtype=float) for _ in range(grids_number)]
         self.ecm = [np.ones((2, width, height), dtype=float) for _ in range(grids_number)]
         self.loaded_max_step = 0
-        self.previous_cell_data = pd.DataFrame()
+        #simulation whose cells data has to be copied to the new simulation folder before the first collection
+        self.previous_cells_data_path = ""
 
         if loaded_simulation_path != "":
             print(f"Loading simulation at {loaded_simulation_path}!")
             configs_path = os.path.join(loaded_simulation_path, "configs.csv")
-            config_var_names = metaspread.configs.load_simulation_configs_for_reloaded_simulation(configs_path)
-            #load the configs so we can use them in this module as globals
-            for var in config_var_names:
-                globals()[var] = getattr(metaspread.configs, var)
-            self.load_previous_simulation(loaded_simulation_path)
-            self.previous_cell_data = pd.read_csv(os.path.join(loaded_simulation_path, "CellsData.csv"), index_col=0)
+            #a loaded simulation always continues with the parameters it was started with
+            self.config = SimulationConfig.from_csv(configs_path)
+            # a simulation continued in its own folder keeps appending to its cells data
+            continues_in_place = os.path.abspath(loaded_simulation_path) == os.path.abspath(new_simulation_folder)
+            self.check_config()
+            checkpoint_path = get_checkpoint_path(loaded_simulation_path)
+            if checkpoint_path is not None:
+                self.restore_checkpoint(checkpoint_path, continues_in_place)
+            else:
+                self.load_previous_simulation(loaded_simulation_path)
+            if not (continues_in_place and os.path.isfile(os.path.join(loaded_simulation_path, CELLS_DATA_FILE))):
+                self.previous_cells_data_path = loaded_simulation_path
+            if continues_in_place:
+                # the arrivals saved after the loaded step are dropped, and the new ones appended
+                pd.DataFrame(self.arrivals_data, columns=ARRIVALS_COLUMNS).to_csv(os.path.join(new_simulation_folder, "Arrivals.csv"), index=False)
+                self.saved_arrivals = len(self.arrivals_data)
         else:
             print("Starting simulation from zero!")
-            configs_path = "simulations_configs.csv"
-            config_var_names = metaspread.configs.init_simulation_configs(configs_path)
-            #load the configs so we can use them in this module as globals
-            for var in config_var_names:
-                globals()[var] = getattr(metaspread.configs, var)
+            if config is None:
+                config = SimulationConfig.from_csv("simulations_configs.csv")
+            elif not isinstance(config, SimulationConfig):
+                config = SimulationConfig.from_dict(config)
+            self.config = config
+            self.check_config()
             self._initialize_grids()
-            self.doubling_time_counter_M = doubling_time_M
-            self.doubling_time_counter_E = doubling_time_E
-        self.datacollector = mesa.DataCollector(
-            model_reporters={"Total cells": count_total_cells}, agent_reporters={"Position": "pos", "Agent Type": "agent_type", "Phenotype": "phenotype", "Ruptured": "ruptured", "Grid": "grid_id"})
+            self.doubling_time_counter_M = self.config.doubling_time_M
+            self.doubling_time_counter_E = self.config.doubling_time_E
+        self.dormant_sites = [self.is_dormant(i) for i in range(self.grids_number)]
+        self.calculate_movement_probabilities()
+        self.cells_data_collector = CellsDataCollector(new_simulation_folder)
 
     def step(self):
         """Advance the model by one step.
@@ -162,73 +458,39 @@ class CancerModel(mesa.Model):
         Returns: none
         """       
         if self.schedule.time in self.vasculature: # Add keys
-            self.disaggregate_clusters(self.schedule.time)
-            surviving_clusters = [cluster for cluster in self.vasculature[self.schedule.time] if self.random.random() < get_cluster_survival_probability(cluster)]
-            del self.vasculature[self.schedule.time]
-            for cluster in surviving_clusters:
-                selected_site = self.random.choices(range(1,self.grids_number), weights=extravasation_probs[0:self.grids_number-1])[0]
-                arriving_point = self.random.choice(self.grid_vessels_positions[selected_site])
-                x,y = arriving_point
-                on_left_border    = self.grids[selected_site].out_of_bounds((x-1,y))
-                on_right_border   = self.grids[selected_site].out_of_bounds((x+1,y))
-                on_top_border     = self.grids[selected_site].out_of_bounds((x,y+1))
-                on_bottom_border  = self.grids[selected_site].out_of_bounds((x,y-1))
-                possible_places = self.grids[selected_site].get_neighborhood(arriving_point, moore=False, include_center=False)
-                number_of_ccells_in_arriving_point ={}
-                for x2,y2 in possible_places:
-                    number_of_ccells_in_arriving_point[x2,y2] = len([agent for agent in self.grids[selected_site].get_cell_list_contents([(x2,y2)]) if agent.agent_type == "cell"])
-                for tuple_index, ccells_amount in enumerate(cluster):
-                    cell_type = "mesenchymal" if tuple_index == 0 else "epithelial"
-                    while ccells_amount > 0:
-                        if not on_left_border and carrying_capacity > number_of_ccells_in_arriving_point[x-1,y]:
-                            ccell = CancerCell(self.current_agent_id, self, self.grids[selected_site], self.grid_ids[selected_site], cell_type, self.ecm[selected_site], self.mmp2[selected_site])
-                            self.current_agent_id += 1
-                            self.grids[selected_site].place_agent(ccell, (x-1,y)) 
-                            number_of_ccells_in_arriving_point[x-1,y] += 1
-                            self.cancer_cells_counter[selected_site] += 1
-                            self.schedule.add(ccell)
-                        elif not on_right_border and carrying_capacity > number_of_ccells_in_arriving_point[x+1,y]:
-                            ccell = CancerCell(self.current_agent_id, self, self.grids[selected_site], self.grid_ids[selected_site], cell_type, self.ecm[selected_site], self.mmp2[selected_site])
-                            self.current_agent_id += 1
-                            self.grids[selected_site].place_agent(ccell, (x+1,y))
-                            number_of_ccells_in_arriving_point[x+1,y] += 1
-                            self.cancer_cells_counter[selected_site] += 1
-                            self.schedule.add(ccell)
-                        elif not on_bottom_border and carrying_capacity > number_of_ccells_in_arriving_point[x,y-1]:
-                            ccell = CancerCell(self.current_agent_id, self, self.grids[selected_site], self.grid_ids[selected_site], cell_type, self.ecm[selected_site], self.mmp2[selected_site])
-                            self.current_agent_id += 1
-                            self.grids[selected_site].place_agent(ccell, (x,y-1))
-                            number_of_ccells_in_arriving_point[x,y-1] += 1
-                            self.cancer_cells_counter[selected_site] += 1
-                            self.schedule.add(ccell)
-                        elif not on_top_border and carrying_capacity > number_of_ccells_in_arriving_point[x,y+1]:
-                            ccell = CancerCell(self.current_agent_id, self, self.grids[selected_site], self.grid_ids[selected_site], cell_type, self.ecm[selected_site], self.mmp2[selected_site])
-                            self.current_agent_id += 1
-                            self.grids[selected_site].place_agent(ccell, (x,y+1))
-                            number_of_ccells_in_arriving_point[x,y+1] += 1
-                            self.cancer_cells_counter[selected_site] += 1
-                            self.schedule.add(ccell)
-                        ccells_amount -= 1
-                    
+            with self.profiler.phase("vasculature"):
+                self.disaggregate_clusters(self.schedule.time)
+                clusters = self.vasculature.pop(self.schedule.time)
+                surviving_clusters, selected_sites, arriving_points = self.select_extravasation_points(clusters)
+                self.extravasate_clusters(surviving_clusters, selected_sites, arriving_points, len(clusters) - len(surviving_clusters))
+
         #Perform ECM and MMP2 calculations
-        self.calculate_environment(self.mmp2, self.ecm)
+        with self.profiler.phase("environment"):
+            self.calculate_environment(self.mmp2, self.ecm)
+        with self.profiler.phase("movement probabilities"):
+            self.calculate_movement_probabilities()
         
         # Proliferation
         # Counters are used so when loading a simulation the behaviour does not change, compared to use self.schedule.time % doubling_time_M == 0
-        if (self.doubling_time_counter_M == 0 and self.schedule.time != 0):
-            self.proliferate("mesenchymal")
-            self.doubling_time_counter_M = doubling_time_M
+        if (self.doubling_time_counter_M == 0 and self.schedule.time + self.loaded_max_step != 0):
+            with self.profiler.phase("proliferation"):
+                self.proliferate("mesenchymal")
+            self.doubling_time_counter_M = self.config.doubling_time_M
 
-        if (self.doubling_time_counter_E == 0 and self.schedule.time != 0):
-            self.proliferate("epithelial")
-            self.doubling_time_counter_E = doubling_time_E
+        if (self.doubling_time_counter_E == 0 and self.schedule.time + self.loaded_max_step != 0):
+            with self.profiler.phase("proliferation"):
+                self.proliferate("epithelial")
+            self.doubling_time_counter_E = self.config.doubling_time_E
                 
         self.doubling_time_counter_E -= 1
         self.doubling_time_counter_M -= 1
 
-        print(f'Step number: {self.schedule.time + self.loaded_max_step}', end="")
-        print("\r", end="")
-        self.schedule.step()
+        with self.profiler.phase("movement"):
+            if self.engine == "arrays":
+                self._move_cells()
+            else:
+                self._sample_agent_moves()
+            self.schedule.step()
         
         #At the end of each step, check if the grid has been populated, and if it happened, store the time step when it did
         for index, time in enumerate(self.time_grid_got_populated):
@@ -239,44 +501,57 @@ class CancerModel(mesa.Model):
         # Saving of non agents data every data_collection_interval steps
         if (self.schedule.time != 0 and (self.schedule.time % self.data_collection_period == 0)) \
             or self.schedule.time == self.max_steps:
-            self.datacollector.collect(self)
-            current_agents_state = self.datacollector.get_agent_vars_dataframe()
-            current_agents_state = current_agents_state.reset_index(level=["Step", "AgentID"])
-            path_to_save = os.path.join(self.new_simulation_folder, f'CellsData.csv')
-            if not self.previous_cell_data.empty:
-                current_agents_state["Step"] += self.loaded_max_step
-                current_agents_state = pd.concat([self.previous_cell_data, current_agents_state])
-            current_agents_state.to_csv(path_to_save)
+            # Only the rows of this step are appended to the cells data
+            with self.profiler.phase("data collection"):
+                self._copy_previous_cells_data()
+                self._collect_cells_data(self.schedule.time + self.loaded_max_step)
+            with self.profiler.phase("cells data writer"):
+                self.cells_data_collector.write()
             #pickling a model could be an option in the future
             # backup_file_path = os.path.join(self.new_simulation_folder, "Backup", "backup.p")
             # with open(backup_file_path, "wb") as f:
             #     pickle.dump(self, f)
-            df_time_grids_got_populated = pd.DataFrame()
-            for grid_id in self.grid_ids:
-                new_mmp2_df = pd.DataFrame(self.mmp2[grid_id-1][0,:,:])
-                mmp2CsvName = f"Mmp2-{grid_id}grid-{self.schedule.time + self.loaded_max_step}step.csv"
-                path_to_save = os.path.join(self.new_simulation_folder, "Mmp2", mmp2CsvName)
-                new_mmp2_df.to_csv(path_to_save)
-
-                new_ecm_df = pd.DataFrame(self.ecm[grid_id-1][0,:,:])
-                EcmCsvName = f"Ecm-{grid_id}grid-{self.schedule.time + self.loaded_max_step}step.csv"
-                path_to_save = os.path.join(self.new_simulation_folder, "Ecm", EcmCsvName)
-                new_ecm_df.to_csv(path_to_save)
-
-                df_time_grids_got_populated[f"Time when grid {grid_id} was first populated"] = [self.time_grid_got_populated[grid_id-1]]
-                df_time_grids_got_populated_csv_name = f"Cells-are-present-grid-{grid_id}-{self.schedule.time + self.loaded_max_step}step.csv"
-            path_to_save = os.path.join(self.new_simulation_folder, "Time when grids were populated", df_time_grids_got_populated_csv_name)
-            df_time_grids_got_populated.to_csv(path_to_save)
+            with self.profiler.phase("fields writer"):
+                df_time_grids_got_populated = pd.DataFrame()
+                for grid_id in self.grid_ids:
+                    current_step = self.schedule.time + self.loaded_max_step
+                    save_field(os.path.join(self.new_simulation_folder, "Mmp2"), "Mmp2", grid_id, current_step, self.mmp2[grid_id-1][0,:,:])
+                    save_field(os.path.join(self.new_simulation_folder, "Ecm"), "Ecm", grid_id, current_step, self.ecm[grid_id-1][0,:,:])
+
+                    df_time_grids_got_populated[f"Time when grid {grid_id} was first populated"] = [self.time_grid_got_populated[grid_id-1]]
+                    df_time_grids_got_populated_csv_name = f"Cells-are-present-grid-{grid_id}-{self.schedule.time + self.loaded_max_step}step.csv"
+                path_to_save = os.path.join(self.new_simulation_folder, "Time when grids were populated", df_time_grids_got_populated_csv_name)
+                df_time_grids_got_populated.to_csv(path_to_save)
+
+            # Saves the statistics of the clusters that arrived from the vasculature
+            # Only the rows of the arrivals since the last collection are appended
+            with self.profiler.phase("arrivals writer"):
+                path_to_save = os.path.join(self.new_simulation_folder, "Arrivals.csv")
+                new_arrivals = pd.DataFrame(self.arrivals_data[self.saved_arrivals:], columns=ARRIVALS_COLUMNS)
+                new_arrivals.to_csv(path_to_save, mode="a", header=not os.path.isfile(path_to_save), index=False)
+                self.saved_arrivals = len(self.arrivals_data)
 
             # Saves vasculature data
             # {key: list of clusters} -> {timestep: [(number of Mcells, number of Ecells), ..., (..., ...)]}
-            vasculature_json = json.dumps(self.vasculature)
-            
-            vasculature_json_name = f"Vasculature-{self.schedule.time + self.loaded_max_step}step.json"
-            path_to_save = os.path.join(self.new_simulation_folder, "Vasculature", vasculature_json_name)
-            
-            with open(path_to_save, 'w') as f:
-                f.write(vasculature_json)
+            with self.profiler.phase("vasculature writer"):
+                vasculature_json = json.dumps(self.vasculature.to_dict())
+                
+                vasculature_json_name = f"Vasculature-{self.schedule.time + self.loaded_max_step}step.json"
+                path_to_save = os.path.join(self.new_simulation_folder, "Vasculature", vasculature_json_name)
+                
+                with open(path_to_save, 'w') as f:
+                    f.write(vasculature_json)
+
+        # The checkpoint is saved after the data of the step, so it never misses collected data
+        if self.checkpoint_period and ((self.schedule.time % self.checkpoint_period == 0) or self.schedule.time == self.max_steps):
+            with self.profiler.phase("checkpoint writer"):
+                self.write_checkpoint()
+
+        self.profiler.progress(self.schedule.time + self.loaded_max_step, self.schedule.time, self.max_steps)
+        if self.schedule.time == self.max_steps:
+            self.profiler.counters["dormant site steps"] = self.dormant_site_steps
+            self.profiler.write_report(self.new_simulation_folder)
+            self.close()
                 
             # Saves cancer cells data as a backup in case the simulation fails
             # _, current_model_data = mesa.batchrunner._collect_data(self, self.data_collection_period-1)
@@ -292,26 +567,74 @@ class CancerModel(mesa.Model):
 
 
 
+    def check_config(self):
+        """
+        Checks that the config of the model can be used with its amount of grids and their size.
+        The config can have more sites than the model, which then only uses the first ones.
+
+        Input: none
+        Returns: none
+        """
+        error_string = ""
+        if self.grids_number > self.config.grids_number:
+            error_string += f"The model has {self.grids_number} grids, but the config only has the parameters of {self.config.grids_number}!\n"
+        # the quasi-circles of the initial cells and of the vessels must fit inside the grid
+        max_quasi_circle_points = np.pi * (min(self.width, self.height) / 2)**2
+        if max(self.config.n_center_points_for_tumor, self.config.n_center_points_for_Vessels) > max_quasi_circle_points:
+            error_string += f"A {self.width}x{self.height} grid is too small for n_center_points_for_tumor and n_center_points_for_Vessels!\n"
+        if error_string != "":
+            raise ValueError(error_string)
+
+    def close(self):
+        """
+        Shuts down the threads that update the environment. It is called when the
+        simulation reaches max_steps, and when the model is used as a context manager.
+        Any later step updates the environment without threads.
+        """
+        if self.environment_executor is not None:
+            self.environment_executor.shutdown()
+            self.environment_executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def proliferate(self, cell_type):
         """"
         Duplicates every cell of cell_type phenotype in every site of the model
 
-        Input: none
+        All the divisions are decided at once. A cell divides only if its grid point
+        is under the carrying capacity, counting the daughters of the cells before it,
+        so in every grid point the first cells (in the order of the scheduler, or of the
+        cell population) take the free places, as if the cells divided one at a time.
+        The daughters are then created in bulk.
+
+        Input: 
+            cell_type: the phenotype of the cells that will divide
         Returns: none
         """
-        for agent in self.schedule.agents:
-            if agent.agent_type == "cell":
-                x, y = agent.pos
-                amount_of_cells = len([cell for cell in agent.grid.get_cell_list_contents([(x, y)]) if cell.agent_type == "cell"])
-                if carrying_capacity > amount_of_cells and agent.phenotype == cell_type:
-                    # print("Created new cell!!")
-                    new_cell = CancerCell(self.current_agent_id, self, agent.grid, agent.grid_id, agent.phenotype, agent.ecm, agent.mmp2)
-                    self.current_agent_id += 1
-                    self.schedule.add(new_cell)
-                    agent.grid.place_agent(new_cell, (x,y))
-                    self.cancer_cells_counter[agent.grid_id - 1] += 1
-        
-
+        if self.engine == "arrays":
+            live = self.cells.live_indexes()
+            parents = live[self.cells.phenotype[live] == PHENOTYPE_CODES[cell_type]]
+            site = self.cells.site[parents].astype(np.int64)
+            x = self.cells.x[parents].astype(np.int64)
+            y = self.cells.y[parents].astype(np.int64)
+        else:
+            parents = [agent for agent in self.schedule.agents if agent.agent_type == "cell" and agent.phenotype == cell_type]
+            site = np.array([agent.grid_id - 1 for agent in parents], dtype=np.int64)
+            x = np.array([agent.pos[0] for agent in parents], dtype=np.int64)
+            y = np.array([agent.pos[1] for agent in parents], dtype=np.int64)
+        if len(parents) == 0:
+            return
+        free_places = self.config.carrying_capacity - self.occupancy[site,0,x,y] - self.occupancy[site,1,x,y]
+        divides = rank_within_groups((site*self.width + x)*self.height + y) < free_places
+        self.profiler.count("proliferation capacity rejections", int(np.count_nonzero(~divides)))
+        for current_site in np.unique(site[divides]).tolist():
+            dividing_here = divides & (site == current_site)
+            positions = list(zip(x[dividing_here].tolist(), y[dividing_here].tolist()))
+            self._create_cells(current_site, positions, [cell_type]*len(positions))
 
     def load_previous_simulation(self, path_to_simulation):
         """
@@ -324,65 +647,197 @@ class CancerModel(mesa.Model):
         mmp2_files_path = os.path.join(path_to_simulation, "Mmp2")
         ecm_files_path  = os.path.join(path_to_simulation, "Ecm")
         for grid_number in range(self.grids_number):
-            mmp2_files = [file for file in os.listdir(mmp2_files_path) if file.startswith(f"Mmp2-{grid_number+1}grid")]
-            ecm_files  = [file for file in os.listdir(ecm_files_path) if file.startswith(f"Ecm-{grid_number+1}grid")]
-            mmp2_files.sort(key = lambda file_name: int(file_name.split('step')[0][11:]))
-            ecm_files.sort(key  = lambda file_name: int(file_name.split('step')[0][10:]))
-            last_state_of_mmp2_filepath = os.path.join(mmp2_files_path,mmp2_files[-1])
-            last_state_of_ecm_filepath  = os.path.join(ecm_files_path,ecm_files[-1])
+            last_state_of_mmp2_filepath = list_field_files(mmp2_files_path, "Mmp2", grid_number+1)[-1]
+            last_state_of_ecm_filepath  = list_field_files(ecm_files_path, "Ecm", grid_number+1)[-1]
             print(f"Loading MMP2 state for grid id {grid_number + 1} in {last_state_of_mmp2_filepath}.")
             print(f"Loading ECM state for grid id {grid_number + 1} in {last_state_of_ecm_filepath}.")
-            self.ecm[grid_number][0,:,:]  = pd.read_csv(last_state_of_ecm_filepath, index_col=0).to_numpy(dtype=float)
-            self.mmp2[grid_number][0,:,:] = pd.read_csv(last_state_of_mmp2_filepath, index_col=0).to_numpy(dtype=float)
+            self.ecm[grid_number][0,:,:]  = load_field(last_state_of_ecm_filepath)
+            self.mmp2[grid_number][0,:,:] = load_field(last_state_of_mmp2_filepath)
 
-        path = os.path.join(path_to_simulation, "CellsData.csv")
-        previous_sim_df = pd.read_csv(path, converters={"Position": ast.literal_eval})
-        last_step = previous_sim_df["Step"].max()
+        previous_records = read_cells_data_records(path_to_simulation)
+        last_step = int(previous_records["Step"].max())
         self.loaded_max_step = last_step
-        previous_sim_df = previous_sim_df[previous_sim_df["Step"] == last_step]
+        previous_sim_df = records_to_dataframe(previous_records[previous_records["Step"] == last_step])
         last_step_cells = previous_sim_df[previous_sim_df["Agent Type"] == "cell"]
         last_step_vessels = previous_sim_df[previous_sim_df["Agent Type"] == "vessel"]
         self.number_of_initial_cells = 0
         for index, row in last_step_cells.iterrows():
             current_grid_number = int(row["Grid"]) - 1
-            ccell = CancerCell(self.current_agent_id, self, self.grids[current_grid_number], self.grid_ids[current_grid_number], row["Phenotype"], self.ecm[current_grid_number], self.mmp2[current_grid_number])
-            self.current_agent_id += 1
-            self.schedule.add(ccell)
-            self.grids[current_grid_number].place_agent(ccell, row["Position"])
-            self.cancer_cells_counter[current_grid_number] += 1
+            self._create_cells(current_grid_number, [(int(row["X"]), int(row["Y"]))], [row["Phenotype"]])
             self.number_of_initial_cells += 1
         for index, row in last_step_vessels.iterrows():
             current_grid_number = int(row["Grid"]) - 1
             ruptured_state = bool(row["Ruptured"])
+            position = (int(row["X"]), int(row["Y"]))
             vessel = Vessel(self.current_agent_id, self, ruptured_state, self.grids[current_grid_number], self.grid_ids[current_grid_number])
             self.current_agent_id += 1
-            self.schedule.add(vessel)
-            self.grids[current_grid_number].place_agent(vessel, row["Position"])
-            self.grid_vessels_positions[current_grid_number] += [row["Position"]]
+            self.vessel_agents.append(vessel)
+            self.grids[current_grid_number].place_agent(vessel, position)
+            self.grid_vessels_positions[current_grid_number] += [position]
 
         #load vasculature
         vasculature_path = os.path.join(path_to_simulation, "Vasculature")
-        vasculature_files = os.listdir(vasculature_path)
-        vasculature_files.sort(key = lambda file_name: int(file_name.split('step')[0][12:]))
+        vasculature_files = sorted([file_name for file_name in os.listdir(vasculature_path) if get_file_step(file_name) is not None], key=get_file_step)
         last_state_of_vasculature_filepath = os.path.join(vasculature_path,vasculature_files[-1])
         with open(last_state_of_vasculature_filepath, 'r') as f:
             last_state_of_vasculature = json.load(f)
         # Change keys to int
         last_state_of_vasculature = {int(k): v for k, v in last_state_of_vasculature.items()}
-        self.vasculature = last_state_of_vasculature
+        self.vasculature = Vasculature(last_state_of_vasculature)
 
         #calculate state of doubling counters
-        self.doubling_time_counter_E = doubling_time_E - (last_step % doubling_time_E)
-        self.doubling_time_counter_M = doubling_time_M - (last_step % doubling_time_M)
+        self.doubling_time_counter_E = self.config.doubling_time_E - (last_step % self.config.doubling_time_E)
+        self.doubling_time_counter_M = self.config.doubling_time_M - (last_step % self.config.doubling_time_M)
 
         #load time_grid_got_populated
         time_grid_got_populated_path = os.path.join(path_to_simulation, "Time when grids were populated")
-        time_grid_got_populated_files = os.listdir(time_grid_got_populated_path)
-        time_grid_got_populated_files.sort(key = lambda file_name: int(file_name.split('step')[0][25:]))
+        time_grid_got_populated_files = sorted([file_name for file_name in os.listdir(time_grid_got_populated_path) if get_file_step(file_name) is not None], key=get_file_step)
         time_grid_got_populated_filepath = os.path.join(time_grid_got_populated_path,time_grid_got_populated_files[-1])
         df_time_grid_got_populated = pd.read_csv(time_grid_got_populated_filepath, index_col=0)
         self.time_grid_got_populated = df_time_grid_got_populated.loc[0, :].values.flatten().tolist()
 
+        #load the arrivals statistics, that older simulations did not save
+        arrivals_path = os.path.join(path_to_simulation, "Arrivals.csv")
+        if os.path.isfile(arrivals_path):
+            self.arrivals_data = pd.read_csv(arrivals_path).to_dict("records")
+        self._build_vessels_masks()
+
+
+    def _copy_previous_cells_data(self):
+        """
+        Copies the cells data of the loaded simulation to the cells data of this one,
+        if it has not been copied yet
+        """
+        if self.previous_cells_data_path != "":
+            previous_records = read_cells_data_records(self.previous_cells_data_path)
+            append_cells_data(self.new_simulation_folder, previous_records[previous_records["Step"] <= self.loaded_max_step])
+            self.previous_cells_data_path = ""
+
+    def write_checkpoint(self):
+        """
+        Saves the state of the model in the Checkpoint.npz file of the simulation folder:
+        the MMP2 and ECM concentrations, the cancer cells, the vessels, the vasculature,
+        the counters and the state of the random number generators.
+
+        The times of the vasculature are saved as absolute steps, since the time of
+        the scheduler starts again from 0 when the simulation is loaded.
+
+        Input: none
+        Returns: none
+        """
+        step = self.schedule.time + self.loaded_max_step
+        if self.engine == "arrays":
+            live = self.cells.live_indexes()
+            cells_unique_id, cells_x, cells_y = self.cells.unique_id[live], self.cells.x[live], self.cells.y[live]
+            cells_site, cells_phenotype = self.cells.site[live], self.cells.phenotype[live]
+        else:
+            # the cells are saved in the order of the scheduler, so it is the same when loaded
+            agents = [agent for agent in self.schedule.agents if agent.agent_type == "cell"]
+            cells_unique_id = np.array([agent.unique_id for agent in agents], dtype=np.int64)
+            cells_x = np.array([agent.pos[0] for agent in agents], dtype=np.int32)
+            cells_y = np.array([agent.pos[1] for agent in agents], dtype=np.int32)
+            cells_site = np.array([agent.grid_id - 1 for agent in agents], dtype=np.int16)
+            cells_phenotype = np.array([PHENOTYPE_CODES[agent.phenotype] for agent in agents], dtype=np.int8)
+        vasculature_times = sorted(self.vasculature.keys())
+        self._copy_previous_cells_data()
+        cells_data_path = os.path.join(self.new_simulation_folder, CELLS_DATA_FILE)
+        arrays = {
+            "mmp2": np.stack([mmp2[0] for mmp2 in self.mmp2]),
+            "ecm": np.stack([ecm[0] for ecm in self.ecm]),
+            "cells_unique_id": cells_unique_id,
+            "cells_x": cells_x,
+            "cells_y": cells_y,
+            "cells_site": cells_site,
+            "cells_phenotype": cells_phenotype,
+            "vessels_unique_id": np.array([vessel.unique_id for vessel in self.vessel_agents], dtype=np.int64),
+            "vessels_x": np.array([vessel.pos[0] for vessel in self.vessel_agents], dtype=np.int32),
+            "vessels_y": np.array([vessel.pos[1] for vessel in self.vessel_agents], dtype=np.int32),
+            "vessels_site": np.array([vessel.grid_id - 1 for vessel in self.vessel_agents], dtype=np.int16),
+            "vessels_ruptured": np.array([vessel.ruptured for vessel in self.vessel_agents], dtype=bool),
+            "vasculature_times": np.array(vasculature_times, dtype=np.int64) + self.loaded_max_step,
+            "vasculature_sizes": np.array([len(self.vasculature[time]) for time in vasculature_times], dtype=np.int64),
+            "vasculature_clusters": np.concatenate([self.vasculature[time] for time in vasculature_times] + [np.zeros((0, 2), dtype=np.int64)]),
+            "arrivals": np.array([[row[column] for column in ARRIVALS_COLUMNS] for row in self.arrivals_data], dtype=np.int64).reshape(-1, len(ARRIVALS_COLUMNS))}
+        python_random_state = self.random.getstate()
+        metadata = {
+            "step": step,
+            "engine": self.engine,
+            "current_agent_id": self.current_agent_id,
+            "cancer_cells_counter": [int(counter) for counter in self.cancer_cells_counter],
+            "time_grid_got_populated": [int(time) for time in self.time_grid_got_populated],
+            "doubling_time_counter_M": int(self.doubling_time_counter_M),
+            "doubling_time_counter_E": int(self.doubling_time_counter_E),
+            "dormant_site_steps": int(self.dormant_site_steps),
+            "cells_data_records": os.path.getsize(cells_data_path) // CELLS_DATA_DTYPE.itemsize if os.path.isfile(cells_data_path) else 0,
+            "rng_state": self.rng.bit_generator.state,
+            "python_random_state": [python_random_state[0], list(python_random_state[1]), python_random_state[2]]}
+        save_checkpoint(self.new_simulation_folder, arrays, metadata)
+
+    def restore_checkpoint(self, checkpoint_path, continues_in_place=False):
+        """
+        Loads the state saved by write_checkpoint as the initial condition of this model,
+        so the loaded simulation continues exactly as if it had not stopped
+
+        Input:
+            checkpoint_path: path of the Checkpoint.npz file
+            continues_in_place: True if the simulation will be saved in the same folder,
+                whose cells data is then truncated to the steps saved before the checkpoint,
+                and whose fields, vasculature and populated grids files saved after it are removed
+        Returns: none
+        """
+        print(f"Loading checkpoint {checkpoint_path}.")
+        arrays, metadata = load_checkpoint(checkpoint_path)
+        step = metadata["step"]
+        self.loaded_max_step = step
+        for site in range(self.grids_number):
+            self.mmp2[site][0,:,:] = arrays["mmp2"][site]
+            self.ecm[site][0,:,:] = arrays["ecm"][site]
+
+        cells_site = arrays["cells_site"].astype(np.int64)
+        if self.engine == "arrays":
+            self.cells.add(arrays["cells_unique_id"], arrays["cells_x"], arrays["cells_y"], cells_site, arrays["cells_phenotype"])
+            np.add.at(self.occupancy, (cells_site, arrays["cells_phenotype"], arrays["cells_x"], arrays["cells_y"]), 1)
+        else:
+            for unique_id, x, y, site, code in zip(arrays["cells_unique_id"].tolist(), arrays["cells_x"].tolist(), arrays["cells_y"].tolist(), cells_site.tolist(), arrays["cells_phenotype"].tolist()):
+                ccell = CancerCell(unique_id, self, self.grids[site], self.grid_ids[site], PHENOTYPE_NAMES[code], self.ecm[site], self.mmp2[site])
+                self.schedule.add(ccell)
+                self.grids[site].place_agent(ccell, (x, y))
+        self.number_of_initial_cells = len(cells_site)
+        for unique_id, x, y, site, ruptured in zip(arrays["vessels_unique_id"].tolist(), arrays["vessels_x"].tolist(), arrays["vessels_y"].tolist(), arrays["vessels_site"].tolist(), arrays["vessels_ruptured"].tolist()):
+            vessel = Vessel(unique_id, self, ruptured, self.grids[site], self.grid_ids[site])
+            self.vessel_agents.append(vessel)
+            self.grids[site].place_agent(vessel, (x, y))
+            self.grid_vessels_positions[site] += [(x, y)]
+
+        cluster_groups = np.split(arrays["vasculature_clusters"], np.cumsum(arrays["vasculature_sizes"])[:-1])
+        self.vasculature = Vasculature({time - step: clusters for time, clusters in zip(arrays["vasculature_times"].tolist(), cluster_groups)})
+        self.arrivals_data = [dict(zip(ARRIVALS_COLUMNS, row)) for row in arrays["arrivals"].tolist()]
+        self.current_agent_id = metadata["current_agent_id"]
+        self.cancer_cells_counter = metadata["cancer_cells_counter"]
+        self.time_grid_got_populated = metadata["time_grid_got_populated"]
+        self.doubling_time_counter_M = metadata["doubling_time_counter_M"]
+        self.doubling_time_counter_E = metadata["doubling_time_counter_E"]
+        self.dormant_site_steps = metadata.get("dormant_site_steps", 0)
+        self.rng.bit_generator.state = metadata["rng_state"]
+        version, internal_state, gauss_next = metadata["python_random_state"]
+        self.random.setstate((version, tuple(internal_state), gauss_next))
+        self._build_vessels_masks()
+
+        # the steps collected after the checkpoint are collected again, so the data
+        # saved after it is removed and the postprocessing never mixes two histories
+        simulation_path = os.path.dirname(checkpoint_path)
+        cells_data_path = os.path.join(simulation_path, CELLS_DATA_FILE)
+        if continues_in_place and os.path.isfile(cells_data_path):
+            os.truncate(cells_data_path, min(os.path.getsize(cells_data_path), metadata["cells_data_records"] * CELLS_DATA_DTYPE.itemsize))
+        if continues_in_place:
+            for folder in STEP_FILES_FOLDERS:
+                folder_path = os.path.join(simulation_path, folder)
+                if not os.path.isdir(folder_path):
+                    continue
+                for file_name in os.listdir(folder_path):
+                    file_step = get_file_step(file_name)
+                    if file_step is not None and file_step > step:
+                        os.remove(os.path.join(folder_path, file_name))
 
     def _initialize_grids(self):
         """
@@ -391,8 +846,8 @@ class CancerModel(mesa.Model):
         Input: none
         Returns: none
         """
-        mesenchymal_number = round(self.number_of_initial_cells * mesenchymal_proportion)
-        possible_places = find_quasi_circle(n_center_points_for_tumor, self.width, self.height)[1]
+        mesenchymal_number = round(self.number_of_initial_cells * self.config.mesenchymal_proportion)
+        possible_places = find_quasi_circle(self.config.n_center_points_for_tumor, self.width, self.height)[1]
         # Place all the agents in the quasi-circle area in the center of the grid
         for i in range(self.number_of_initial_cells):
             if mesenchymal_number > 0:
@@ -401,41 +856,31 @@ class CancerModel(mesa.Model):
             elif mesenchymal_number == 0:
                 cell_type = "epithelial"
 
-            a = CancerCell(self.current_agent_id, self, self.grids[0], self.grid_ids[0], cell_type, self.ecm[0], self.mmp2[0])
-            self.current_agent_id += 1
             j = self.random.randrange(len(possible_places))
             x = int(possible_places[j][0])
             y = int(possible_places[j][1])
-
-            self.schedule.add(a)
-            self.grids[0].place_agent(a, (x, y))
-            self.cancer_cells_counter[0] += 1
+            self._create_cells(0, [(x, y)], [cell_type])
 
             # Remove the point after it has an amount of cells equal to the carrying capacity
             possible_places[j][2] += 1
-            if possible_places[j][2] == carrying_capacity:
+            if possible_places[j][2] == self.config.carrying_capacity:
                 possible_places.pop(j)
 
 
         # Create agents at second grid. Useful for debugging.
         amount_of_second_grid_cancer_cells = 0
         for i in range(amount_of_second_grid_cancer_cells):
-            a = CancerCell(self.current_agent_id, self, self.grids[1], self.grid_ids[1], "mesenchymal", self.ecm[1], self.mmp2[1])
-            self.current_agent_id += 1
-            self.schedule.add(a)
-        
             # Add the agent to a random grid cell
             x = self.random.randrange(3,7)
             y = self.random.randrange(3,7)
-            self.grids[1].place_agent(a, (x, y))
-            self.cancer_cells_counter[1] += 1
+            self._create_cells(1, [(x, y)], ["mesenchymal"])
 
         # Create vessels
-        num_normal_vessels = normal_vessels_primary
-        num_ruptured_vessels = ruptured_vessels_primary
+        num_normal_vessels = self.config.normal_vessels_primary
+        num_ruptured_vessels = self.config.ruptured_vessels_primary
 
         # creates grid with 1 where vessels must not be placed
-        not_possible_array = find_quasi_circle(n_center_points_for_Vessels, self.width, self.height)[0]
+        not_possible_array = find_quasi_circle(self.config.n_center_points_for_Vessels, self.width, self.height)[0]
         not_possible_array[:2,:] = 1
         not_possible_array[-2:,:] = 1
         not_possible_array[:,:2] = 1
@@ -452,7 +897,7 @@ class CancerModel(mesa.Model):
                     if coord_to_place in pos_coords:
                         a = Vessel(self.current_agent_id, self, True, self.grids[0], self.grid_ids[0])
                         self.current_agent_id += 1
-                        self.schedule.add(a)
+                        self.vessel_agents.append(a)
                         self.grids[0].place_agent(a, (int(coord_to_place[0]), int(coord_to_place[1])))
                         self.grid_vessels_positions[i] += [(int(coord_to_place[0]), int(coord_to_place[1]))]
                         not_possible_array[coord_to_place[0], coord_to_place[1]] = 1
@@ -466,7 +911,7 @@ class CancerModel(mesa.Model):
                     if coord_to_place in pos_coords:
                         a = Vessel(self.current_agent_id, self, False, self.grids[0], self.grid_ids[0])
                         self.current_agent_id += 1
-                        self.schedule.add(a)
+                        self.vessel_agents.append(a)
                         self.grids[0].place_agent(a, (int(coord_to_place[0]), int(coord_to_place[1])))
                         self.grid_vessels_positions[i] += [(int(coord_to_place[0]), int(coord_to_place[1]))]
 
@@ -474,72 +919,420 @@ class CancerModel(mesa.Model):
                         pos_coords.remove(coord_to_place)
                         temp -= 1
             elif i > 0: # secondary grid and beyond
-                    for m in range(secondary_sites_vessels[i-1]):
+                    for m in range(self.config.secondary_sites_vessels[i-1]):
                         a = Vessel(self.current_agent_id, self, False, self.grids[i], self.grid_ids[i])
                         self.current_agent_id += 1
-                        self.schedule.add(a)
+                        self.vessel_agents.append(a)
                         x = self.random.randrange(self.width)
                         y = self.random.randrange(self.height)
                         self.grids[i].place_agent(a, (x,y))
                         self.grid_vessels_positions[i] += [(x,y)]
+        self._build_vessels_masks()
+
+    def _build_vessels_masks(self):
+        """
+        Builds the lookup arrays of the vessels, so the movement of the cells
+        does not have to look for vessels in the grids.
+
+        vessels and ruptured_vessels are (grids_number, width, height) boolean
+        arrays marking the grid points with a vessel and with a ruptured vessel.
+        intravasation_zone marks the vessels and their von Neumann neighbourhood,
+        that is, the grid points whose cells travel when a vessel is entered.
+        vessels_neighbourhoods maps, for each site, the position of every vessel
+        to the list of grid points of its intravasation zone.
+
+        Input: none
+        Returns: none
+        """
+        self.vessels = np.zeros((self.grids_number, self.width, self.height), dtype=bool)
+        self.ruptured_vessels = np.zeros((self.grids_number, self.width, self.height), dtype=bool)
+        self.intravasation_zone = np.zeros((self.grids_number, self.width, self.height), dtype=bool)
+        self.vessels_neighbourhoods = [{} for _ in range(self.grids_number)]
+        for vessel in self.vessel_agents:
+            site = vessel.grid_id - 1
+            x, y = vessel.pos
+            self.vessels[site, x, y] = True
+            self.ruptured_vessels[site, x, y] |= vessel.ruptured
+            neighbourhood = [(x, y)] + list(self.grids[site].get_neighborhood((x, y), moore=False, include_center=False))
+            self.vessels_neighbourhoods[site][x, y] = neighbourhood
+            for x2, y2 in neighbourhood:
+                self.intravasation_zone[site, x2, y2] = True
                 
+    def _create_cells(self, site, positions, phenotypes):
+        """
+        Creates new cancer cells in a site, as agents or as entries of the
+        cell population, according to the engine of the model
+
+        Input:
+            site: index of the site (grid_id - 1)
+            positions: list of (x, y) tuples where the cells will be placed
+            phenotypes: list with the phenotype of each new cell
+        Returns:
+            None
+        """
+        if self.engine == "arrays":
+            amount = len(positions)
+            unique_ids = np.arange(self.current_agent_id, self.current_agent_id + amount)
+            x = np.array([position[0] for position in positions], dtype=int)
+            y = np.array([position[1] for position in positions], dtype=int)
+            codes = np.array([PHENOTYPE_CODES[phenotype] for phenotype in phenotypes], dtype=int)
+            self.cells.add(unique_ids, x, y, site, codes)
+            np.add.at(self.occupancy[site], (codes, x, y), 1)
+            self.current_agent_id += amount
+        else:
+            for position, phenotype in zip(positions, phenotypes):
+                ccell = CancerCell(self.current_agent_id, self, self.grids[site], self.grid_ids[site], phenotype, self.ecm[site], self.mmp2[site])
+                self.current_agent_id += 1
+                self.schedule.add(ccell)
+                self.grids[site].place_agent(ccell, position)
+        self.cancer_cells_counter[site] += len(positions)
+        if len(positions) > 0:
+            self.dormant_sites[site] = False
+            self._add_to_active_region(site, positions)
+
+    def _add_to_active_region(self, site, positions):
+        """
+        Grows the active region of a site so it covers the given (x, y) positions
+        """
+        xs = [position[0] for position in positions]
+        ys = [position[1] for position in positions]
+        region = (min(xs), max(xs) + 1, min(ys), max(ys) + 1)
+        if self.active_regions[site] is not None:
+            x0, x1, y0, y1 = self.active_regions[site]
+            region = (min(x0, region[0]), max(x1, region[1]), min(y0, region[2]), max(y1, region[3]))
+        self.active_regions[site] = region
+
+    def calculate_movement_probabilities(self):
+        """
+        Calculates, for every site, the probabilities that a cell of each phenotype
+        moves in each direction from every grid point, using the current ECM.
+        The result is stored in movement_probabilities and used by the movement of
+        both engines during the rest of the step. After the first step, they are only
+        calculated again in the active region of every site and one grid point around
+        it, unless environment_tolerance is None.
+
+        Input: none
+        Returns: none
+        """
+        fixed_probabilities = [self.fixed_p_left, self.fixed_p_right, self.fixed_p_top, self.fixed_p_bottom]
+        if self.movement_probabilities is None or self.environment_tolerance is None:
+            self.movement_probabilities = [get_movement_probabilities(ecm[0], self.config, fixed_probabilities) for ecm in self.ecm]
+            return
+        # the ECM only changed in the active region of the sites that are not dormant,
+        # so the probabilities are only calculated again around it
+        for i, ecm in enumerate(self.ecm):
+            if not self.dormant_sites[i] and self.active_regions[i] is not None:
+                update_movement_probabilities(self.movement_probabilities[i], ecm[0], self.config, fixed_probabilities, self.active_regions[i])
+
+    def is_dormant(self, site):
+        """
+        Returns True if the site has no cancer cells and no MMP2, so its MMP2
+        stays at zero and its ECM does not change while no cells arrive
+        """
+        return not self.occupancy[site].any() and not self.mmp2[site][0].any()
+
+    def _sample_moves(self, site, phenotype, x, y):
+        """
+        Samples, with one draw for all of them, the moves of a group of cancer cells
+        from movement_probabilities.
+
+        Input:
+            site, phenotype, x, y: arrays with the site index, phenotype code and position of every cell
+        Returns:
+            new_x, new_y: arrays with the positions the cells move to
+        """
+        probabilities = np.empty((len(site), 5))
+        for current_site in range(self.grids_number):
+            in_site = site == current_site
+            if in_site.any():
+                probabilities[in_site] = self.movement_probabilities[current_site][phenotype[in_site], :, x[in_site], y[in_site]]
+        cumulative_probabilities = probabilities.cumsum(axis=1)
+        # the moves out of the grid have probability 0, so they are never sampled
+        moves = (self.rng.random(len(site))[:,None] >= cumulative_probabilities[:,:4]).sum(axis=1)
+        new_x = x + self.MOVE_DX[moves]
+        new_y = y + self.MOVE_DY[moves]
+        return new_x, new_y
+
+    def _sample_agent_moves(self):
+        """
+        Samples in one batch the position every CancerCell of the agents engine moves
+        to in this step, and stores it in its next_position. A cell only changes its
+        position in its own move, so sampling all moves before the scheduler gives
+        the same distribution as sampling each one when the cell moves. The cells
+        then move in the random order of the scheduler, which resolves the
+        intravasations and the carrying capacity one cell at a time.
+
+        Input: none
+        Returns: none
+        """
+        ccells = [agent for agent in self.schedule.agents if agent.agent_type == "cell"]
+        if not ccells:
+            return
+        site = np.array([ccell.grid_id - 1 for ccell in ccells])
+        phenotype = np.array([PHENOTYPE_CODES[ccell.phenotype] for ccell in ccells])
+        x = np.array([ccell.pos[0] for ccell in ccells])
+        y = np.array([ccell.pos[1] for ccell in ccells])
+        new_x, new_y = self._sample_moves(site, phenotype, x, y)
+        for ccell, x2, y2 in zip(ccells, new_x.tolist(), new_y.tolist()):
+            ccell.next_position = (x2, y2)
+
+    def _move_cells(self):
+        """
+        Moves all the cancer cells of the arrays engine at once.
+
+        The moves of all cells are sampled in one batch from movement_probabilities.
+        Cells whose move ends in a vessel of the primary site (a ruptured one, or any
+        one for mesenchymal cells) intravasate together with their neighbours, in a
+        random order. The scheduler resolves the carrying capacity one cell at a time,
+        and here it is resolved for all cells together with this approximation:
+        each grid point accepts, in a random order, as many incoming cells as free
+        places it had at the beginning of the movement. The places left by the cells
+        moving out of a grid point are not offered to other cells in the same step,
+        so the carrying capacity is never exceeded, but a few moves into crowded
+        grid points that the scheduler could have accepted are rejected.
+
+        Input: none
+        Returns: none
+        """
+        cells = self.cells
+        order = self.rng.permutation(cells.live_indexes())
+        if len(order) == 0:
+            return
+        x, y = cells.x[order], cells.y[order]
+        site, phenotype = cells.site[order], cells.phenotype[order]
+        new_x, new_y = self._sample_moves(site, phenotype, x, y)
+
+        # intravasation, in the random order of the cells that trigger it
+        in_primary = site == 0
+        triggers = in_primary & self.vessels[0, new_x, new_y] & (self.ruptured_vessels[0, new_x, new_y] | (phenotype == PHENOTYPE_CODES["mesenchymal"]))
+        if triggers.any():
+            cells_in_zone = order[in_primary & self.intravasation_zone[0, x, y]]
+            for index, x2, y2 in zip(order[triggers].tolist(), new_x[triggers].tolist(), new_y[triggers].tolist()):
+                if cells.alive[index]:
+                    self._intravasate_cells(x2, y2, cells_in_zone)
+        moving = cells.alive[order] & ~triggers & ((new_x != x) | (new_y != y))
+        if not moving.any():
+            return
+        order, x, y, new_x, new_y = order[moving], x[moving], y[moving], new_x[moving], new_y[moving]
+        site, phenotype = site[moving], phenotype[moving]
+
+        # carrying capacity: the first cells in the random order take the free places of each grid point
+        free_places = self.config.carrying_capacity - self.occupancy[site,0,new_x,new_y] - self.occupancy[site,1,new_x,new_y]
+        accepted = rank_within_groups((site.astype(np.int64)*self.width + new_x)*self.height + new_y) < free_places
+        self.profiler.count("cells moved", int(np.count_nonzero(accepted)))
+        self.profiler.count("capacity rejections", int(np.count_nonzero(~accepted)))
+        np.subtract.at(self.occupancy, (site[accepted], phenotype[accepted], x[accepted], y[accepted]), 1)
+        np.add.at(self.occupancy, (site[accepted], phenotype[accepted], new_x[accepted], new_y[accepted]), 1)
+        cells.x[order[accepted]] = new_x[accepted]
+        cells.y[order[accepted]] = new_y[accepted]
+        if cells.size > 2*len(cells):
+            cells.compact()
+
+    def _intravasate_cells(self, x, y, candidates):
+        """
+        Sends to the vasculature, as one cluster, all the cancer cells of the arrays
+        engine that are in the primary site vessel at (x, y) or in its von Neumann neighbourhood
+
+        Input:
+            x, y: position of the vessel
+            candidates: indexes of the primary site cells inside the intravasation zone
+        Returns:
+            None
+        """
+        cells = self.cells
+        candidates = candidates[cells.alive[candidates]]
+        distance = np.abs(cells.x[candidates] - x) + np.abs(cells.y[candidates] - y)
+        travelling = candidates[distance <= 1]
+        codes = cells.phenotype[travelling]
+        amount_of_mesenchymal = int(np.count_nonzero(codes == PHENOTYPE_CODES["mesenchymal"]))
+        amount_of_epithelial = len(travelling) - amount_of_mesenchymal
+        self.vasculature.add_cluster(self.schedule.time + self.config.vasculature_time, amount_of_mesenchymal, amount_of_epithelial)
+        self.profiler.count("intravasation events")
+        self.profiler.count("intravasated cells", len(travelling))
+        np.subtract.at(self.occupancy[0], (codes, cells.x[travelling], cells.y[travelling]), 1)
+        cells.remove(travelling)
+
+    def _collect_cells_data(self, step):
+        """
+        Adds the current state of the cancer cells and the vessels to the snapshot of the cells data collector
+
+        Input:
+            step: step of the simulation saved with the snapshot
+        Returns:
+            None
+        """
+        if self.engine == "arrays":
+            cells = self.cells
+            live = cells.live_indexes()
+            self.cells_data_collector.collect(step, cells.unique_id[live], cells.x[live], cells.y[live], cells.site[live] + 1,
+                                              AGENT_TYPE_CODES["cell"], cells.phenotype[live], False)
+        else:
+            agents = [agent for agent in self.schedule.agents if agent.agent_type == "cell"]
+            amount = len(agents)
+            self.cells_data_collector.collect(step,
+                np.fromiter((agent.unique_id for agent in agents), dtype=np.int64, count=amount),
+                np.fromiter((agent.pos[0] for agent in agents), dtype=np.int32, count=amount),
+                np.fromiter((agent.pos[1] for agent in agents), dtype=np.int32, count=amount),
+                np.fromiter((agent.grid_id for agent in agents), dtype=np.int16, count=amount),
+                AGENT_TYPE_CODES["cell"],
+                np.fromiter((PHENOTYPE_CODES[agent.phenotype] for agent in agents), dtype=np.int8, count=amount),
+                False)
+        # the vessels are not in the scheduler, so they are added to every collected step
+        vessels = self.vessel_agents
+        self.cells_data_collector.collect(step,
+            [vessel.unique_id for vessel in vessels],
+            [vessel.pos[0] for vessel in vessels],
+            [vessel.pos[1] for vessel in vessels],
+            [vessel.grid_id for vessel in vessels],
+            AGENT_TYPE_CODES["vessel"], NO_PHENOTYPE,
+            [vessel.ruptured for vessel in vessels])
+
     def calculate_environment(self, mmp2, ecm):
-        global th
+        """
+        Calculates the next step of the MMP2 and ECM concentrations in every site.
+        The dormant sites, without cells and MMP2, are skipped and counted in dormant_site_steps,
+        and only the active region of the rest is updated, unless environment_tolerance is None.
+
+        Input:
+            mmp2: list of the MMP2 arrays of each site
+            ecm: list of the ECM arrays of each site
+        Returns:
+            None
+        """
+        # the update of a dormant site would leave its MMP2 at zero and its ECM unchanged
         for i in range(len(mmp2)):
-            for cell in self.grids[i].coord_iter():
-                cell_contents, (x, y) = cell
-                self.mesenchymal_count[i][x,y] = 0
-                self.epithelial_count[i][x,y] = 0
-                for cancer_cell in cell_contents:
-                    if isinstance(cancer_cell, CancerCell):
-                        if cancer_cell.phenotype == "mesenchymal":
-                            self.mesenchymal_count[i][x,y] += 1
-                        elif cancer_cell.phenotype == "epithelial":
-                            self.epithelial_count[i][x,y] += 1
-                        else:
-                            raise Exception("Unknown phenotype")
-                on_left_border = self.grids[i].out_of_bounds((x-1,y))
-                on_right_border = self.grids[i].out_of_bounds((x+1,y))
-                on_top_border = self.grids[i].out_of_bounds((x,y-1))
-                on_bottom_border = self.grids[i].out_of_bounds((x,y+1))
-                mmp2[i][1,x,y]=dmmp*tha/xha**2*((mmp2[i][0,x+1,y] if not on_right_border else mmp2[i][0,x-1,y])\
-                        +(mmp2[i][0,x-1,y] if not on_left_border else mmp2[i][0,x+1,y])\
-                        +(mmp2[i][0,x,y+1] if not on_bottom_border else mmp2[i][0,x,y-1])\
-                        +(mmp2[i][0,x,y-1] if not on_top_border else mmp2[i][0,x,y+1])\
-                        )\
-                        +mmp2[i][0,x,y]*(1-4*dmmp*tha/xha**2-th*Lambda)+tha*theta*self.mesenchymal_count[i][x,y]
-                ecm[i][1,x,y] = ecm[i][0,x,y]*(1-tha*(gamma1*self.mesenchymal_count[i][x,y]+gamma2*mmp2[i][1,x,y]))
-                if ecm[i][1,x,y] < 0:
-                    warnings.warn(f"<0 ecm in [i][1,{x},{y}] is {ecm[i][1,x,y]}")
-                if ecm[i][1,x,y] > 1:
-                    warnings.warn(f">1 ecm in [i][1,{x},{y}] is {ecm[i][1,x,y]}")
-                    print("ECM is greater than 1! Your MMP2 diffusion rate is probably too high")
-            mmp2[i][0,:,:] = mmp2[i][1,:,:]
-            ecm[i][0,:,:] = ecm[i][1,:,:]
+            if self.dormant_sites[i] and mmp2[i][0].any():
+                self.dormant_sites[i] = False
+                self.active_regions[i] = (0, self.width, 0, self.height)
+        active_sites = [i for i in range(len(mmp2)) if not self.dormant_sites[i]]
+        self.dormant_site_steps += len(mmp2) - len(active_sites)
+        # only the region with mesenchymal cells or MMP2 of every site is updated
+        if self.environment_tolerance is not None:
+            for i in active_sites:
+                if self.active_regions[i] is not None:
+                    self.active_regions[i] = find_active_region(mmp2[i][0], self.mesenchymal_count[i], self.active_regions[i], self.environment_tolerance)
+            active_sites = [i for i in active_sites if self.active_regions[i] is not None]
+        regions = [self.active_regions[i] if self.environment_tolerance is not None else None for i in range(len(mmp2))]
+        if self.environment_executor is None:
+            for i in active_sites:
+                update_site_environment(mmp2[i], ecm[i], self.mesenchymal_count[i], self.config, regions[i])
+            return
+        # the blocks of rows of every site are computed at the same time, as numpy
+        # releases the GIL, and only then every site advances to its next state
+        futures = []
+        for i in active_sites:
+            x0, x1, y0, y1 = (0, self.width, 0, self.height) if regions[i] is None else regions[i]
+            bounds = np.linspace(x0, x1, self.environment_tiles + 1).astype(int)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                futures.append(self.environment_executor.submit(compute_site_environment, mmp2[i], ecm[i], self.mesenchymal_count[i], self.config, (start, stop, y0, y1)))
+        for future in futures:
+            future.result()
+        for i in active_sites:
+            advance_site_environment(mmp2[i], ecm[i], regions[i])
 
     def disaggregate_clusters(self, time):
         """
         Dissagregates cells from clusters into single-cell clusters, according to
         the dissagregation probability
 
+        Every cell of a multicellular cluster leaves it, becoming a single-cell
+        cluster, with probability 1 - dissagreggation_prob, so the amount of
+        cells of each phenotype that leave a cluster is drawn from a binomial
+        distribution, for all clusters at once. The clusters are kept in the same
+        order as when the cells were drawn one by one: first the single-cell clusters,
+        and then every multicellular cluster, in its order, as the mesenchymal and
+        epithelial cells that left it followed by the rest of it. As the amounts are
+        drawn from the numpy generator, a seeded run does not detach the same cells
+        as the per-cell draws of older versions.
+
         Input:
             time: given time for which the dissagreggation will occur
         Returns: 
             None
         """
-        big_clusters = [cluster for cluster in self.vasculature[time] if sum(cluster) > 1]
-        new_vasculature = [cluster for cluster in self.vasculature[time] if sum(cluster) == 1]
-        for cluster in big_clusters:
-            new_mesenchymal, new_epithelial = cluster
-            for ccell_type, ccells_amount in enumerate(cluster):
-                for i in range(ccells_amount):
-                    if self.random.random() > dissagreggation_prob:
-                        if ccell_type == 0:
-                            new_vasculature += [(1, 0)]
-                            new_mesenchymal -= 1
-                        if ccell_type == 1:
-                            new_vasculature += [(0, 1)]
-                            new_epithelial -= 1
-            if new_mesenchymal + new_epithelial > 0:
-                new_vasculature += [(new_mesenchymal,new_epithelial)]
-        self.vasculature[time] = new_vasculature
\ No newline at end of file
+        clusters = self.vasculature[time]
+        sizes = clusters.sum(axis=1)
+        big_clusters = clusters[sizes > 1]
+        detached = self.rng.binomial(big_clusters, 1 - self.config.dissagreggation_prob)
+        remaining = big_clusters - detached
+        # every cluster is followed by the mesenchymal and epithelial cells that left it, and then by what remains of it
+        rows = np.stack([np.tile([1, 0], (len(big_clusters), 1)), np.tile([0, 1], (len(big_clusters), 1)), remaining], axis=1).reshape(-1, 2)
+        repeats = np.stack([detached[:,0], detached[:,1], (remaining.sum(axis=1) > 0).astype(detached.dtype)], axis=1).reshape(-1)
+        self.vasculature[time] = np.concatenate([clusters[sizes == 1], np.repeat(rows, repeats, axis=0)])
+
+    def extravasate_clusters(self, clusters, selected_sites, arriving_points, dead_clusters_amount):
+        """
+        Places the cells of the clusters that survived the vasculature in their secondary sites
+
+        The cells of each cluster, first the mesenchymal and then the epithelial ones,
+        take the free places of the grid points to the left, right, bottom and top
+        of the arriving vessel, in that order, and the cells that do not fit anywhere
+        die. The free places are resolved against the occupancy arrays, cluster by
+        cluster, and the cells of every site are created in bulk at the end.
+        The statistics of the arrivals of this step are appended to arrivals_data.
+
+        Input:
+            clusters: (number of clusters, 2) array with the surviving clusters
+            selected_sites: list with the index of the site where each cluster arrives
+            arriving_points: list with the vessel position where each cluster arrives
+            dead_clusters_amount: amount of clusters of this step that died in the vasculature
+        Returns:
+            None
+        """
+        #cells placed during this step, that are not yet in the occupancy arrays
+        placed = {}
+        new_cells = {site: ([], []) for site in range(1, self.grids_number)}
+        statistics = {site: [0, 0, 0, 0] for site in range(1, self.grids_number)}
+        for (mesenchymal, epithelial), site, (x, y) in zip(clusters.tolist(), selected_sites, arriving_points):
+            positions, phenotypes = new_cells[site]
+            site_statistics = statistics[site]
+            site_statistics[0] += 1
+            placed_cells = 0
+            for neighbour in [(x-1, y), (x+1, y), (x, y-1), (x, y+1)]:
+                if placed_cells == mesenchymal + epithelial:
+                    break
+                if self.grids[site].out_of_bounds(neighbour):
+                    continue
+                free_places = self.config.carrying_capacity - self.grids[site].count_cells(neighbour) - placed.get((site, neighbour), 0)
+                new_cells_here = min(max(free_places, 0), mesenchymal + epithelial - placed_cells)
+                #the first cells of the cluster are the mesenchymal ones
+                new_mesenchymal = max(0, min(mesenchymal - placed_cells, new_cells_here))
+                positions += [neighbour] * new_cells_here
+                phenotypes += ["mesenchymal"] * new_mesenchymal + ["epithelial"] * (new_cells_here - new_mesenchymal)
+                placed[(site, neighbour)] = placed.get((site, neighbour), 0) + new_cells_here
+                site_statistics[1] += new_mesenchymal
+                site_statistics[2] += new_cells_here - new_mesenchymal
+                placed_cells += new_cells_here
+            site_statistics[3] += mesenchymal + epithelial - placed_cells
+        for site, (positions, phenotypes) in new_cells.items():
+            if positions:
+                self._create_cells(site, positions, phenotypes)
+        step = self.schedule.time + self.loaded_max_step
+        for site, (clusters_amount, mesenchymal, epithelial, without_space) in statistics.items():
+            self.arrivals_data.append({"Step": step, "Grid": self.grid_ids[site], "Clusters": clusters_amount,
+                                       "Extravasated mesenchymal cells": mesenchymal, "Extravasated epithelial cells": epithelial,
+                                       "Cells without space": without_space, "Clusters dead in the vasculature": dead_clusters_amount})
+
+    def select_extravasation_points(self, clusters):
+        """
+        Decides which of the clusters arriving from the vasculature survive, and
+        where each surviving cluster extravasates, with one vectorized draw for all of them
+
+        Input:
+            clusters: (number of clusters, 2) array with the arriving clusters
+        Returns:
+            surviving_clusters: the rows of clusters that survived
+            selected_sites: list with the index of the site where each surviving cluster arrives
+            arriving_points: list with the vessel position where each surviving cluster arrives
+        """
+        sizes = clusters.sum(axis=1)
+        if (clusters < 0).any():
+            raise Exception(f"Error! Negative amount of cells in the clusters: {clusters[(clusters < 0).any(axis=1)].tolist()}")
+        if (sizes == 0).any():
+            raise Exception(f"Error, no cells in cluster!")
+        survival_probabilities = np.where(sizes == 1, self.config.single_cell_survival, self.config.cluster_survival)
+        surviving_clusters = clusters[self.rng.random(len(clusters)) < survival_probabilities]
+        site_weights = np.array(self.config.extravasation_probs[0:self.grids_number-1], dtype=float)
+        selected_sites = self.rng.choice(np.arange(1, self.grids_number), size=len(surviving_clusters), p=site_weights/site_weights.sum()).tolist()
+        arriving_points = [self.grid_vessels_positions[site][self.rng.integers(len(self.grid_vessels_positions[site]))] for site in selected_sites]
+        return surviving_clusters, selected_sites, arriving_points
@@ -0,0 +1,102 @@
+import numpy as np
+from metaspread.cancergrid import PHENOTYPE_CODES
+
+PHENOTYPE_NAMES = {code: name for name, code in PHENOTYPE_CODES.items()}
+
+class CellPopulation:
+    """
+    Struct-of-arrays storage for the cancer cells of every site.
+
+    Each cancer cell is a slot in a set of contiguous numpy arrays instead of a
+    mesa.Agent object. Removed cells are only flagged as not alive, and their
+    slots are reclaimed by compact().
+
+    Attributes:
+    ---------------
+    size: int
+        amount of slots in use, alive or not
+    unique_id: numpy array
+        unique id of each cell, taken from the same counter as the agents ids
+    x, y: numpy arrays
+        position of each cell in its grid
+    site: numpy array
+        index of the site (grid_id - 1) of each cell
+    phenotype: numpy array
+        phenotype code of each cell, as in cancergrid.PHENOTYPE_CODES
+    alive: numpy array
+        False for the cells that have been removed from the sites
+
+    Methods:
+    ---------------
+    add(unique_ids, x, y, site, phenotype)
+        Appends new cells, returning their indexes
+    remove(indexes)
+        Flags the given cells as not alive
+    live_indexes()
+        Returns the indexes of all the cells that are alive
+    compact()
+        Drops the cells that are not alive from the arrays
+    """
+
+    def __init__(self, initial_capacity=1024):
+        self.size = 0
+        self.unique_id = np.zeros(initial_capacity, dtype=np.int64)
+        self.x = np.zeros(initial_capacity, dtype=np.int32)
+        self.y = np.zeros(initial_capacity, dtype=np.int32)
+        self.site = np.zeros(initial_capacity, dtype=np.int16)
+        self.phenotype = np.zeros(initial_capacity, dtype=np.int8)
+        self.alive = np.zeros(initial_capacity, dtype=bool)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive[:self.size]))
+
+    def _reserve(self, capacity):
+        if capacity <= len(self.alive):
+            return
+        new_capacity = max(capacity, 2*len(self.alive))
+        for name in ["unique_id", "x", "y", "site", "phenotype", "alive"]:
+            old_array = getattr(self, name)
+            new_array = np.zeros(new_capacity, dtype=old_array.dtype)
+            new_array[:self.size] = old_array[:self.size]
+            setattr(self, name, new_array)
+
+    def add(self, unique_ids, x, y, site, phenotype):
+        """
+        Appends new cells to the population
+
+        Input:
+            unique_ids, x, y, site, phenotype: array-likes of the same length
+                with the values of the new cells (site and phenotype can also
+                be scalars shared by all of them)
+        Returns:
+            indexes: the indexes of the new cells
+        """
+        amount = len(unique_ids)
+        self._reserve(self.size + amount)
+        indexes = np.arange(self.size, self.size + amount)
+        self.unique_id[indexes] = unique_ids
+        self.x[indexes] = x
+        self.y[indexes] = y
+        self.site[indexes] = site
+        self.phenotype[indexes] = phenotype
+        self.alive[indexes] = True
+        self.size += amount
+        return indexes
+
+    def remove(self, indexes):
+        self.alive[indexes] = False
+
+    def live_indexes(self):
+        return np.flatnonzero(self.alive[:self.size])
+
+    def compact(self):
+        """
+        Drops the cells that are not alive, keeping the order of the remaining ones
+        """
+        live = self.live_indexes()
+        amount = len(live)
+        for name in ["unique_id", "x", "y", "site", "phenotype", "alive"]:
+            array = getattr(self, name)
+            array[:amount] = array[live]
+        self.alive[amount:self.size] = False
+        self.size = amount
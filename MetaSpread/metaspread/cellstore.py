@@ -0,0 +1,310 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+from metaspread.cancergrid import PHENOTYPE_CODES
+
+# The state of the cancer cells and vessels is appended to CellsData.bin every data
+# collection step, as raw records of CELLS_DATA_DTYPE, so only the rows of the new
+# step are written and the file never has to be rewritten. The Position of the
+# agents is stored as the integer X and Y columns, and the Agent Type and Phenotype
+# as the codes of AGENT_TYPE_CODES and cancergrid.PHENOTYPE_CODES (-1 for vessels).
+# Simulations made with previous versions saved the whole history in CellsData.csv,
+# which load_cells_data still reads and convert_cells_data turns into CellsData.bin.
+# As the steps are written in order, iter_cells_data_steps can read the data of huge
+# simulations in chunks of CHUNK_RECORDS records, keeping only one step in memory.
+# The first time a CellsData.csv is read it is parsed into the CellsData.csv.cache
+# sidecar, with the same records as CellsData.bin, and the size and modification time
+# of the csv are saved in CellsData.csv.cache.json. The next reads use the sidecar
+# while the csv keeps the same size and modification time, and parse it again if not.
+CELLS_DATA_FILE = "CellsData.bin"
+LEGACY_CELLS_DATA_FILE = "CellsData.csv"
+CACHE_FILE = LEGACY_CELLS_DATA_FILE + ".cache"
+CACHE_KEY_FILE = CACHE_FILE + ".json"
+CELLS_DATA_DTYPE = np.dtype([
+    ("Step", np.int64),
+    ("AgentID", np.int64),
+    ("X", np.int32),
+    ("Y", np.int32),
+    ("Grid", np.int16),
+    ("Agent Type", np.int8),
+    ("Phenotype", np.int8),
+    ("Ruptured", np.bool_)])
+AGENT_TYPE_CODES = {"cell": 0, "vessel": 1}
+NO_PHENOTYPE = -1
+CHUNK_RECORDS = 2**20
+
+def get_cells_data_path(simulation_path):
+    """
+    Returns the path of the cells data of a simulation, the binary log if it
+    exists and the CellsData.csv of older simulations if not. Returns None if
+    the simulation has no cells data.
+    """
+    for file_name in [CELLS_DATA_FILE, LEGACY_CELLS_DATA_FILE]:
+        path = os.path.join(simulation_path, file_name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def cells_data_records(dataframe):
+    """
+    Converts a dataframe with the columns of the CellsData.csv of older versions
+    (Step, AgentID, Position, Agent Type, Phenotype, Ruptured and Grid) to records of
+    CELLS_DATA_DTYPE. If the dataframe has X and Y columns they are used instead of Position.
+    """
+    records = np.zeros(len(dataframe), dtype=CELLS_DATA_DTYPE)
+    if "X" in dataframe and "Y" in dataframe:
+        records["X"] = dataframe["X"].to_numpy()
+        records["Y"] = dataframe["Y"].to_numpy()
+    else:
+        positions = np.array(dataframe["Position"].tolist(), dtype=np.int64).reshape(-1, 2)
+        records["X"] = positions[:,0]
+        records["Y"] = positions[:,1]
+    records["Step"] = dataframe["Step"].to_numpy()
+    records["AgentID"] = dataframe["AgentID"].to_numpy()
+    records["Grid"] = dataframe["Grid"].to_numpy()
+    records["Agent Type"] = dataframe["Agent Type"].map(AGENT_TYPE_CODES).to_numpy()
+    records["Phenotype"] = dataframe["Phenotype"].map(PHENOTYPE_CODES).fillna(NO_PHENOTYPE).to_numpy()
+    records["Ruptured"] = dataframe["Ruptured"].astype(str) == "True"
+    return records
+
+def append_cells_data(simulation_path, records):
+    """
+    Appends the records of one or more collected steps to the cells data log of a simulation
+
+    Input:
+        simulation_path: path of the simulation folder
+        records: array of CELLS_DATA_DTYPE
+    Returns:
+        None
+    """
+    with open(os.path.join(simulation_path, CELLS_DATA_FILE), "ab") as f:
+        f.write(np.ascontiguousarray(records, dtype=CELLS_DATA_DTYPE).tobytes())
+
+class CellsDataCollector:
+    """
+    Collects the state of the cancer cells and vessels of one step and appends it to the cells data log.
+
+    The rows of a snapshot are written into a structured array of CELLS_DATA_DTYPE
+    that is allocated once and reused by every collection, growing only when the
+    population outgrows it, so the memory used depends on the amount of agents and
+    not on the amount of collected steps.
+
+    Attributes:
+    ---------------
+    simulation_path: str
+        folder of the simulation where CellsData.bin is written
+    buffer: numpy array
+        preallocated array of CELLS_DATA_DTYPE holding the current snapshot
+    size: int
+        amount of rows of the buffer used by the current snapshot
+
+    Methods:
+    ---------------
+    collect(step, unique_id, x, y, grid, agent_type, phenotype, ruptured)
+        Adds rows to the current snapshot
+    write()
+        Appends the current snapshot, sorted by AgentID, to the log and empties it
+    """
+
+    def __init__(self, simulation_path, capacity=1024):
+        self.simulation_path = simulation_path
+        self.buffer = np.zeros(capacity, dtype=CELLS_DATA_DTYPE)
+        self.size = 0
+
+    def collect(self, step, unique_id, x, y, grid, agent_type, phenotype, ruptured):
+        """
+        Adds rows to the current snapshot. Every argument can be a scalar, shared by
+        all the rows, or an array with one value per row, with the codes of
+        AGENT_TYPE_CODES and cancergrid.PHENOTYPE_CODES for agent_type and phenotype
+        """
+        amount = len(unique_id)
+        if self.size + amount > len(self.buffer):
+            new_buffer = np.zeros(max(2*len(self.buffer), self.size + amount), dtype=CELLS_DATA_DTYPE)
+            new_buffer[:self.size] = self.buffer[:self.size]
+            self.buffer = new_buffer
+        rows = self.buffer[self.size:self.size + amount]
+        rows["Step"] = step
+        rows["AgentID"] = unique_id
+        rows["X"] = x
+        rows["Y"] = y
+        rows["Grid"] = grid
+        rows["Agent Type"] = agent_type
+        rows["Phenotype"] = phenotype
+        rows["Ruptured"] = ruptured
+        self.size += amount
+
+    def write(self):
+        snapshot = self.buffer[:self.size]
+        snapshot.sort(order="AgentID")
+        append_cells_data(self.simulation_path, snapshot)
+        self.size = 0
+
+def read_cells_data_records(simulation_path):
+    """
+    Reads all the records of the cells data of a simulation as an array of CELLS_DATA_DTYPE.
+
+    A record left incomplete by a simulation that stopped while writing is ignored.
+    """
+    path = get_cells_data_records_path(simulation_path)
+    if path.endswith(".csv"):
+        return _read_legacy_cells_data(path)
+    complete_records = os.path.getsize(path) // CELLS_DATA_DTYPE.itemsize
+    return np.fromfile(path, dtype=CELLS_DATA_DTYPE, count=complete_records)
+
+def records_to_dataframe(records):
+    """
+    Converts records of CELLS_DATA_DTYPE to a dataframe, with the Agent Type and
+    the Phenotype as categorical columns with their names (the Phenotype of the vessels is NaN)
+    """
+    dataframe = pd.DataFrame({name: records[name] for name in CELLS_DATA_DTYPE.names})
+    dataframe["Agent Type"] = pd.Categorical.from_codes(records["Agent Type"], categories=list(AGENT_TYPE_CODES))
+    dataframe["Phenotype"] = pd.Categorical.from_codes(records["Phenotype"], categories=list(PHENOTYPE_CODES))
+    return dataframe
+
+def load_cells_data(simulation_path):
+    """
+    Loads the cells data of every collected step of a simulation
+
+    Input:
+        simulation_path: path of the simulation folder
+    Returns:
+        dataframe with the columns Step, AgentID, X, Y, Grid, Agent Type, Phenotype and Ruptured
+    """
+    return records_to_dataframe(read_cells_data_records(simulation_path))
+
+def _legacy_cells_data_records(dataframe):
+    # the positions were saved as "(x, y)" strings
+    positions = dataframe["Position"].str.extract(r'\((-?\d+),\s*(-?\d+)\)').astype(np.int64)
+    dataframe["X"] = positions[0]
+    dataframe["Y"] = positions[1]
+    return cells_data_records(dataframe)
+
+def _read_legacy_cells_data(path):
+    return _legacy_cells_data_records(pd.read_csv(path, index_col=0))
+
+def _iter_cells_data_chunks(path, chunk_size):
+    if path.endswith(".csv"):
+        for dataframe in pd.read_csv(path, index_col=0, chunksize=chunk_size):
+            yield _legacy_cells_data_records(dataframe)
+        return
+    remaining_records = os.path.getsize(path) // CELLS_DATA_DTYPE.itemsize
+    with open(path, "rb") as f:
+        while remaining_records > 0:
+            chunk = np.fromfile(f, dtype=CELLS_DATA_DTYPE, count=min(chunk_size, remaining_records))
+            remaining_records -= len(chunk)
+            yield chunk
+
+def iter_cells_data_steps(simulation_path, steps=None, chunk_size=CHUNK_RECORDS):
+    """
+    Iterates over the cells data of a simulation step by step, reading it in chunks,
+    so only the records of one step and one chunk are in memory at the same time
+
+    Input:
+        simulation_path: path of the simulation folder
+        steps: increasing steps to yield. A step without records is yielded with an
+            empty array, and the steps that are not in steps are skipped. If None,
+            every step in the cells data is yielded
+        chunk_size: amount of records read at once
+    Yields:
+        (step, records) tuples, with the records of CELLS_DATA_DTYPE of the step
+    """
+    path = get_cells_data_records_path(simulation_path)
+    def read_steps():
+        pending = np.zeros(0, dtype=CELLS_DATA_DTYPE)
+        for chunk in _iter_cells_data_chunks(path, chunk_size):
+            records = np.concatenate([pending, chunk])
+            # every step but the last one of the chunk is complete
+            boundaries = np.flatnonzero(records["Step"][1:] != records["Step"][:-1]) + 1
+            start = 0
+            for end in boundaries:
+                yield int(records["Step"][start]), records[start:end]
+                start = end
+            pending = records[start:]
+        if len(pending):
+            yield int(pending["Step"][0]), pending
+    if steps is None:
+        yield from read_steps()
+        return
+    data_steps = read_steps()
+    data_step, records = next(data_steps, (None, None))
+    for step in steps:
+        while data_step is not None and data_step < step:
+            data_step, records = next(data_steps, (None, None))
+        yield step, records if data_step == step else np.zeros(0, dtype=CELLS_DATA_DTYPE)
+
+def get_last_cells_data_step(simulation_path):
+    """
+    Returns the last step saved in the cells data of a simulation, reading only its last record
+    """
+    path = get_cells_data_records_path(simulation_path)
+    if path.endswith(".csv"):
+        return int(max(chunk["Step"].max() for chunk in pd.read_csv(path, usecols=["Step"], chunksize=CHUNK_RECORDS)))
+    complete_records = os.path.getsize(path) // CELLS_DATA_DTYPE.itemsize
+    if complete_records == 0:
+        raise ValueError(f"The cells data in {simulation_path} is empty")
+    with open(path, "rb") as f:
+        f.seek((complete_records - 1)*CELLS_DATA_DTYPE.itemsize)
+        return int(np.fromfile(f, dtype=CELLS_DATA_DTYPE, count=1)["Step"][0])
+
+def _get_cache_key(csv_path):
+    stat = os.stat(csv_path)
+    return {"Size": stat.st_size, "Modification time": stat.st_mtime_ns}
+
+def get_cells_data_records_path(simulation_path):
+    """
+    Returns the path of a file with the records of the cells data of a simulation:
+    its CellsData.bin, or for older simulations the sidecar cache of their CellsData.csv,
+    which is created or updated if the csv changed since it was parsed. If the cache
+    cannot be written, the path of the csv is returned.
+    """
+    path = get_cells_data_path(simulation_path)
+    if path is None:
+        raise FileNotFoundError(f"No cells data found in directory: {simulation_path}")
+    if not path.endswith(".csv"):
+        return path
+    cache_path = os.path.join(simulation_path, CACHE_FILE)
+    cache_key_path = os.path.join(simulation_path, CACHE_KEY_FILE)
+    key = _get_cache_key(path)
+    if os.path.isfile(cache_path) and os.path.isfile(cache_key_path):
+        try:
+            with open(cache_key_path) as f:
+                if json.load(f) == key:
+                    return cache_path
+        except (OSError, ValueError):
+            pass
+    print(f"Parsing {path} into {CACHE_FILE}")
+    temporary_path = cache_path + ".tmp"
+    try:
+        if os.path.isfile(cache_key_path):
+            os.remove(cache_key_path)
+        with open(temporary_path, "wb") as f:
+            for chunk in _iter_cells_data_chunks(path, CHUNK_RECORDS):
+                f.write(chunk.tobytes())
+        os.replace(temporary_path, cache_path)
+        with open(cache_key_path, "w") as f:
+            json.dump(key, f)
+    except OSError as error:
+        print(f"Could not save the cache of {path}: {error}")
+        return path
+    return cache_path
+
+def convert_cells_data(simulation_path, remove_csv=False):
+    """
+    Converts the CellsData.csv of a simulation made with older versions to CellsData.bin
+
+    Input:
+        simulation_path: path of the simulation folder
+        remove_csv: if True, CellsData.csv is deleted after being converted
+    Returns:
+        The amount of converted rows
+    """
+    csv_path = os.path.join(simulation_path, LEGACY_CELLS_DATA_FILE)
+    if not os.path.isfile(csv_path) or os.path.isfile(os.path.join(simulation_path, CELLS_DATA_FILE)):
+        return 0
+    records = _read_legacy_cells_data(csv_path)
+    append_cells_data(simulation_path, records)
+    if remove_csv:
+        os.remove(csv_path)
+    print(f"Converted {len(records)} rows of {csv_path} to {CELLS_DATA_FILE}")
+    return len(records)
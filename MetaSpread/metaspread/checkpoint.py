@@ -0,0 +1,54 @@
+import numpy as np
+import json
+import os
+
+# The checkpoint of a simulation is a single Checkpoint.npz file in its folder, with
+# the arrays needed to continue the simulation exactly where it stopped. The values
+# that are not arrays (counters, random number generators states, ...) are saved as
+# a json string in its "metadata" entry, so the file can be loaded without pickle.
+CHECKPOINT_FILE = "Checkpoint.npz"
+
+def get_checkpoint_path(simulation_path):
+    """
+    Returns the path of the checkpoint of a simulation, or None if it has none
+    """
+    path = os.path.join(simulation_path, CHECKPOINT_FILE)
+    return path if os.path.isfile(path) else None
+
+def save_checkpoint(simulation_path, arrays, metadata):
+    """
+    Saves a checkpoint in the folder of a simulation, replacing the previous one.
+
+    The checkpoint is first written to a temporary file that then replaces the
+    old one, so a simulation that stops while saving never leaves a corrupted checkpoint.
+
+    Input:
+        simulation_path: path of the simulation folder
+        arrays: dict of numpy arrays
+        metadata: dict of values that can be saved as json
+    Returns:
+        The path of the checkpoint
+    """
+    path = os.path.join(simulation_path, CHECKPOINT_FILE)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    return path
+
+def load_checkpoint(path):
+    """
+    Loads a checkpoint saved by save_checkpoint
+
+    Input:
+        path: path of the Checkpoint.npz file
+    Returns:
+        arrays: dict of numpy arrays
+        metadata: dict with the rest of the values
+    """
+    with np.load(path) as checkpoint:
+        arrays = {name: checkpoint[name] for name in checkpoint.files if name != "metadata"}
+        metadata = json.loads(str(checkpoint["metadata"]))
+    return arrays, metadata
@@ -1,6 +1,123 @@
 import pandas as pd
 import os
 import ast
+import dataclasses
+
+# Names of the parameters of a simulation, in the order of the simulations_configs.csv file
+CONFIG_NAMES = ["th","tha","xh","xha","dM","dE","phiM","phiE","dmmp","theta","Lambda","gamma1","gamma2","vasculature_time","doubling_time_M","doubling_time_E","single_cell_survival","cluster_survival","extravasation_probs","dissagreggation_prob","carrying_capacity","normal_vessels_primary","ruptured_vessels_primary","secondary_sites_vessels","n_center_points_for_tumor","n_center_points_for_Vessels","gridsize","grids_number","mesenchymal_proportion","epithelial_proportion","number_of_initial_cells"]
+# Configurations saved in the configs.csv of every simulation, that are not parameters of the model
+RUN_CONFIG_NAMES = ["max_steps", "data_collection_period"]
+
+@dataclasses.dataclass(frozen=True)
+class SimulationConfig:
+    """
+    Immutable set of parameters of a simulation.
+
+    Each CancerModel keeps its own SimulationConfig, so models with different
+    parameters can run in the same process. The values are checked when the
+    config is created, and the lists are stored as tuples.
+
+    Methods:
+    ---------------
+    from_dict(values)
+        Creates a config from a dict with a value for every name of CONFIG_NAMES
+    from_csv(path)
+        Creates a config from a simulations_configs.csv or a configs.csv file
+    to_dict()
+        Returns the values as a dict, with the tuples as lists
+    replace(**changes)
+        Returns a copy of the config with some values changed
+    """
+    th: float
+    tha: float
+    xh: float
+    xha: float
+    dM: float
+    dE: float
+    phiM: float
+    phiE: float
+    dmmp: float
+    theta: float
+    Lambda: float
+    gamma1: float
+    gamma2: float
+    vasculature_time: int
+    doubling_time_M: int
+    doubling_time_E: int
+    single_cell_survival: float
+    cluster_survival: float
+    extravasation_probs: tuple
+    dissagreggation_prob: float
+    carrying_capacity: int
+    normal_vessels_primary: int
+    ruptured_vessels_primary: int
+    secondary_sites_vessels: tuple
+    n_center_points_for_tumor: int
+    n_center_points_for_Vessels: int
+    gridsize: int
+    grids_number: int
+    mesenchymal_proportion: float
+    epithelial_proportion: float
+    number_of_initial_cells: int
+
+    def __post_init__(self):
+        object.__setattr__(self, "extravasation_probs", tuple(self.extravasation_probs))
+        object.__setattr__(self, "secondary_sites_vessels", tuple(self.secondary_sites_vessels))
+        error_string = ""
+        if sum(self.extravasation_probs) != 1:
+            error_string += "Extravasation probabilities must sum 1!\n"
+        if len(self.extravasation_probs) != self.grids_number - 1:
+            error_string += "There must be as many Extravasation probabilities as the value of (grids_number - 1)!\n"
+        if len(self.secondary_sites_vessels) != self.grids_number-1:
+            error_string += "There must be as many secondary site vessels as the value of grids_number - 1!\n"
+        if self.mesenchymal_proportion + self.epithelial_proportion != 1:
+            error_string += "Mesenchymal_proportion + epithelial_proportion must be 1!\n"
+        if error_string != "":
+            raise ValueError(error_string)
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Creates a config from a dict with the value of every parameter. The
+        max_steps and data_collection_period of a configs.csv are ignored.
+        """
+        values = {name: value for name, value in values.items() if name not in RUN_CONFIG_NAMES}
+        missing_names = [name for name in CONFIG_NAMES if name not in values]
+        unknown_names = [name for name in values if name not in CONFIG_NAMES]
+        if missing_names:
+            raise ValueError(f"Missing configuration options: {missing_names}")
+        if unknown_names:
+            raise ValueError(f"Unknown configuration options: {unknown_names}")
+        return cls(**values)
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Creates a config from the csv given in path, with the Names and Values columns
+        """
+        df_configs = pd.read_csv(path, header=0, converters={"Values": ast.literal_eval})
+        return cls.from_dict(dict(zip(df_configs["Names"], df_configs["Values"])))
+
+    def to_dict(self):
+        return {name: list(value) if isinstance(value, tuple) else value for name, value in dataclasses.asdict(self).items()}
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+def read_run_configs(path):
+    """
+    Reads the configurations of a configs.csv file that are not parameters of the
+    model, which SimulationConfig ignores
+    Input:
+        string: path
+        return: dict with the max_steps and data_collection_period of the simulation
+    """
+    df_configs = pd.read_csv(path, header=0, converters={"Values": ast.literal_eval})
+    dict_configs = dict(zip(df_configs["Names"], df_configs["Values"]))
+    missing_names = [name for name in RUN_CONFIG_NAMES if name not in dict_configs]
+    if missing_names:
+        raise ValueError(f"Missing configuration options: {missing_names}")
+    return {name: dict_configs[name] for name in RUN_CONFIG_NAMES}
 
 def init_simulation_configs(path):
     """
@@ -82,7 +199,7 @@ def load_simulation_configs_for_reloaded_simulation(path):
 
 def generate_default_configs():
     """Creates a default simulation_configs.csv file"""
-    names = ["th","tha","xh","xha","dM","dE","phiM","phiE","dmmp","theta","Lambda","gamma1","gamma2","vasculature_time","doubling_time_M","doubling_time_E","single_cell_survival","cluster_survival","extravasation_probs","dissagreggation_prob","carrying_capacity","normal_vessels_primary","ruptured_vessels_primary","secondary_sites_vessels","n_center_points_for_tumor","n_center_points_for_Vessels","gridsize","grids_number","mesenchymal_proportion","epithelial_proportion","number_of_initial_cells"]
+    names = CONFIG_NAMES
     values = [0.001,0.001,0.005,0.005,1e-4,5e-5,0.0005,0.0005,0.001,0.195,0.1,1,1,180,2000,3000,5e-04,0.025,[0.75, 0.25],0.5,4,8,2,[10, 10],97,200,201,3,0.6,0.4,388]
     default_configs = pd.DataFrame({"Names": names, "Values": values})
     default_configs.to_csv("simulations_configs.csv", index=False)
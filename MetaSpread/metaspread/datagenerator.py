@@ -1,91 +1,158 @@
-import ast
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 import pandas as pd
 import numpy as np
-import re
 import os
 import json
-import metaspread.configs
+from metaspread.configs import SimulationConfig, read_run_configs
+from metaspread.fieldstore import list_field_files
+from metaspread.cellstore import get_cells_data_path, get_last_cells_data_step, iter_cells_data_steps, AGENT_TYPE_CODES
+from metaspread.cancergrid import PHENOTYPE_CODES
 
 # To run this code you must be in the parent folder of agent-based-cancer
 
-def read_coords_for_plot(step, all_cells_dataframe, grid_id):
-    df = all_cells_dataframe[["Step", "Position", "Phenotype", "Grid", "Agent Type", "Ruptured"]]
-
-    # Selected step to plot
-    df_selected_step_and_grid = df.loc[(df["Step"] == step) & (df["Grid"] == grid_id)]
-
-    # Save the position data
-    mPoints = list(df_selected_step_and_grid.loc[df_selected_step_and_grid["Phenotype"] == "mesenchymal"]["Position"])
-    ePoints = list(df_selected_step_and_grid.loc[df_selected_step_and_grid["Phenotype"] == "epithelial"]["Position"])
-    vPoints = list(df_selected_step_and_grid.loc[(df_selected_step_and_grid["Agent Type"] == "vessel") & (df_selected_step_and_grid["Ruptured"] == False)]["Position"])
-    vRupturedPoints = list(df_selected_step_and_grid.loc[(df_selected_step_and_grid["Agent Type"] == "vessel") & (df_selected_step_and_grid["Ruptured"] == True)]["Position"])
-
-    X_position_m, Y_position_m = [i[0] for i in mPoints], [i[1] for i in mPoints]
-    X_position_e, Y_position_e = [i[0] for i in ePoints], [i[1] for i in ePoints]
-    X_position_v, Y_position_v = [i[0] for i in vPoints], [i[1] for i in vPoints]
-    X_position_vr, Y_position_vr = [i[0] for i in vRupturedPoints], [i[1] for i in vRupturedPoints]
-
-    return [X_position_m, Y_position_m, X_position_e, Y_position_e, X_position_v, Y_position_v, X_position_vr, Y_position_vr]
+# The cells data is analysed in a single pass over its records: they are assigned to
+# a group per (grid, step), numbered grid-major, and sorted once by group and by
+# category (mesenchymal, epithelial, vessel and ruptured vessel), so the coordinates,
+# amounts of cells, occupancy histograms and occupied positions of every group are
+# slices of the same arrays, instead of filtering all the rows again for every grid
+# and step. generate_data streams the cells data and analyses one step at a time, so
+# its memory is bounded by the population of one step.
+MESENCHYMAL, EPITHELIAL, VESSEL, RUPTURED_VESSEL = range(4)
+CATEGORIES_NUMBER = 4
+
+# The time series of a simulation are saved once, as one table each inside its Data
+# analysis folder, with a row per collected step (and per grid for the cells growth),
+# and the graphs of a step use the rows up to that step.
+GROWTH_FILE = os.path.join("Cells growth", "CellsGrowth.csv")
+VASCULATURE_FILE = os.path.join("Vasculature dynamics", "Vasculature.csv")
+RADIUS_DIAMETER_FILE = os.path.join("Tumor dynamics", "Tumor radius and diameter history in grid 1.csv")
+
+class CellsDataAnalysis:
+    """
+    Analysis of the cells data of all the collected steps of a simulation.
+
+    Attributes:
+    ---------------
+    steps: numpy array
+        collected steps that are analysed
+    grids_number: int
+        amount of grids
+    gridsize: int
+        width and height of the grids
+    counts: numpy array
+        amount of records of every category, with shape (grids_number, len(steps), 4)
+    histograms: numpy array
+        amount of grid points with every amount of cancer cells, with shape (groups, maximum occupancy + 1)
+
+    Methods:
+    ---------------
+    coordinates(grid_id, step)
+        Returns the X and Y lists of the mesenchymal cells, epithelial cells, vessels and ruptured vessels
+    histogram(grid_id, step)
+        Returns the occupancy histogram as a dataframe with the Bins and Frequency columns
+    growth(real_delta_time)
+        Returns the amount of epithelial and mesenchymal cells of every grid at every step as a dataframe
+    positions(grid_id, step)
+        Returns the positions occupied by cancer cells as an array of shape (n, 2)
+    """
 
-def save_cancer(all_cells_dataframe, grid_id, step, real_time_at_step, tumor_data_path):
-    coords_list = False
+    def __init__(self, records, steps, grids_number, gridsize):
+        self.steps = np.asarray(steps, dtype=np.int64)
+        self.grids_number = grids_number
+        self.gridsize = gridsize
+        groups_number = grids_number*len(self.steps)
+
+        record_steps = records["Step"].astype(np.int64)
+        grids = records["Grid"].astype(np.int64)
+        step_index = np.minimum(np.searchsorted(self.steps, record_steps), max(len(self.steps) - 1, 0))
+        valid = (grids >= 1) & (grids <= grids_number)
+        if len(self.steps):
+            valid &= self.steps[step_index] == record_steps
+        else:
+            valid[:] = False
+
+        categories = np.full(len(records), -1, dtype=np.int64)
+        categories[records["Phenotype"] == PHENOTYPE_CODES["mesenchymal"]] = MESENCHYMAL
+        categories[records["Phenotype"] == PHENOTYPE_CODES["epithelial"]] = EPITHELIAL
+        vessels = records["Agent Type"] == AGENT_TYPE_CODES["vessel"]
+        categories[vessels & ~records["Ruptured"]] = VESSEL
+        categories[vessels & records["Ruptured"]] = RUPTURED_VESSEL
+        valid &= categories >= 0
+
+        groups = (grids[valid] - 1)*len(self.steps) + step_index[valid]
+        keys = groups*CATEGORIES_NUMBER + categories[valid]
+        order = np.argsort(keys, kind="stable")
+        self._x = records["X"][valid][order].astype(np.int64)
+        self._y = records["Y"][valid][order].astype(np.int64)
+        self._bounds = np.searchsorted(keys[order], np.arange(groups_number*CATEGORIES_NUMBER + 1))
+        self.counts = np.diff(self._bounds).reshape(grids_number, len(self.steps), CATEGORIES_NUMBER)
+
+        # occupied positions of the cancer cells of every group, and how many cells each one has
+        cells = categories[valid] <= EPITHELIAL
+        area = gridsize*gridsize
+        linear_positions = groups[cells]*area + records["X"][valid][cells].astype(np.int64)*gridsize + records["Y"][valid][cells].astype(np.int64)
+        occupied, occupancy = np.unique(linear_positions, return_counts=True)
+        occupied_groups = occupied // area
+        self._occupied = occupied % area
+        self._occupied_bounds = np.searchsorted(occupied_groups, np.arange(groups_number + 1))
+        max_occupancy = occupancy.max() if len(occupancy) else 0
+        self.histograms = np.bincount(occupied_groups*(max_occupancy + 1) + occupancy, minlength=groups_number*(max_occupancy + 1)).reshape(groups_number, max_occupancy + 1)
+        self.histograms[:,0] = area - np.diff(self._occupied_bounds)
+
+    def _group(self, grid_id, step):
+        return (grid_id - 1)*len(self.steps) + np.searchsorted(self.steps, step)
+
+    def coordinates(self, grid_id, step):
+        first_key = self._group(grid_id, step)*CATEGORIES_NUMBER
+        coordinates = []
+        for key in range(first_key, first_key + CATEGORIES_NUMBER):
+            start, end = self._bounds[key], self._bounds[key + 1]
+            coordinates += [self._x[start:end].tolist(), self._y[start:end].tolist()]
+        return coordinates
+
+    def histogram(self, grid_id, step):
+        histogram = self.histograms[self._group(grid_id, step)]
+        bins = np.flatnonzero(histogram[1:]) + 1
+        # the most frequent amounts of cells first, and the empty grid points at the end
+        bins = bins[np.argsort(-histogram[bins], kind="stable")]
+        return pd.DataFrame({'Bins': np.append(bins, 0), 'Frequency': np.append(histogram[bins], histogram[0])}, index=list(range(len(bins))) + [0])
+
+    def growth(self, real_delta_time):
+        steps = np.tile(self.steps, self.grids_number)
+        return pd.DataFrame({
+            "Grid": np.repeat(np.arange(1, self.grids_number + 1), len(self.steps)),
+            "Step": steps,
+            "Days": real_delta_time*steps/(3600*24),
+            "Number of Epithelial Cells": self.counts[:,:,EPITHELIAL].ravel(),
+            "Number of Mesenchymal Cells": self.counts[:,:,MESENCHYMAL].ravel()})
+
+    def positions(self, grid_id, step):
+        group = self._group(grid_id, step)
+        occupied = self._occupied[self._occupied_bounds[group]:self._occupied_bounds[group + 1]]
+        return np.column_stack((occupied // self.gridsize, occupied % self.gridsize))
+
+def save_cancer(analysis, grid_id, step, real_time_at_step, tumor_data_path):
     path = os.path.join(tumor_data_path, f'Cells-grid{grid_id}-step{step} - Tumor size at {real_time_at_step/(3600*24):.2f} days.csv')
     if not os.path.isfile(path):
-        coords_list = read_coords_for_plot(step, all_cells_dataframe, grid_id)
-        Xm, Ym, Xe, Ye, Xv, Yv, Xvr, Yvr = coords_list[0], coords_list[1], coords_list[2], coords_list[3], coords_list[4], coords_list[5], coords_list[6], coords_list[7]
-
-        # save the data
-        df_export = pd.DataFrame([Xm, Ym, Xe, Ye, Xv, Yv, Xvr, Yvr]) 
+        df_export = pd.DataFrame(analysis.coordinates(grid_id, step))
         df_export.to_csv(path)
 
     #create histogram of positions
     path = os.path.join(tumor_data_path, f'Cells-grid{grid_id}-step{step} - Histogram at {real_time_at_step/(3600*24):.2f} days.csv')
     if not os.path.isfile(path):
-        if coords_list:
-            Xm, Ym, Xe, Ye, Xv, Yv, Xvr, Yvr = coords_list[0], coords_list[1], coords_list[2], coords_list[3], coords_list[4], coords_list[5], coords_list[6], coords_list[7]
-        else:
-            coords_list = read_coords_for_plot(step, all_cells_dataframe, grid_id)
-            Xm, Ym, Xe, Ye, Xv, Yv, Xvr, Yvr = coords_list[0], coords_list[1], coords_list[2], coords_list[3], coords_list[4], coords_list[5], coords_list[6], coords_list[7]
-        df_positions = pd.DataFrame({'Position': zip(Xm + Xe, Ym + Ye)})
-        position_repetition_count = df_positions['Position'].value_counts()
-        histogram = position_repetition_count.value_counts()
-        histogram = pd.DataFrame({'Bins': histogram.index, 'Frequency': histogram.values})
-        number_of_empty_positions = metaspread.configs.gridsize * metaspread.configs.gridsize - len(position_repetition_count)
-        new_row = pd.DataFrame({'Bins': [0], 'Frequency': [number_of_empty_positions]})
-        histogram = pd.concat([histogram, new_row])
-        histogram.to_csv(path)
-        # return
-        #this will return the radius and diameter of the processed tumor
-        return get_cluster_centroid_radius_and_diameter(df_positions, grid_id)
-    path = os.path.join(tumor_data_path, "Tumor radius and diameter history in grid 1.csv")
-    if not os.path.isfile(path):
-        if coords_list:
-            Xm, Ym, Xe, Ye, Xv, Yv, Xvr, Yvr = coords_list[0], coords_list[1], coords_list[2], coords_list[3], coords_list[4], coords_list[5], coords_list[6], coords_list[7]
-        else:
-            coords_list = read_coords_for_plot(step, all_cells_dataframe, grid_id)
-            Xm, Ym, Xe, Ye, Xv, Yv, Xvr, Yvr = coords_list[0], coords_list[1], coords_list[2], coords_list[3], coords_list[4], coords_list[5], coords_list[6], coords_list[7]
-        df_positions = pd.DataFrame({'Position': zip(Xm + Xe, Ym + Ye)})
-        return get_cluster_centroid_radius_and_diameter(df_positions, grid_id)
-    return ([np.nan, np.nan], np.nan, np.nan)
-    
-def save_growth_data(all_cells_dataframe, grid_id, cells_data_path, step_number, real_time_at_step, real_delta_time, df_csv_last_step):
-    path_to_save = os.path.join(cells_data_path, f'CellsGrowth-grid{grid_id}-step{step_number} - {real_time_at_step/(3600*24):.2f} days.csv')
-    if os.path.isfile(path_to_save):
-        return pd.DataFrame()
-    df = all_cells_dataframe.loc[(all_cells_dataframe["Grid"] == grid_id) & (all_cells_dataframe["Step"] == step_number)]
-    amount_of_mesenchymal = len(df[df["Phenotype"] == "mesenchymal"])
-    amount_of_epithelial = len(df[df["Phenotype"] == "epithelial"])
-    df = pd.DataFrame({"Number of Epithelial Cells": [amount_of_epithelial], "Number of Mesenchymal Cells": [amount_of_mesenchymal], "Steps": [step_number], "Days": [real_delta_time*step_number/(3600*24)]})
-    if not df_csv_last_step.empty:
-        df_csv = pd.concat([df_csv_last_step, df], ignore_index=True)
-    else:
-        df_csv = df
-    df_csv.to_csv(path_to_save)
-    return df_csv
+        analysis.histogram(grid_id, step).to_csv(path)
 
-def get_vasculature_state_at_step(path_to_save, vasculature_json_path, step):
+def get_vasculature_history(vasculature_path, steps):
+    """
+    Returns a dataframe with the state of the vasculature at every step
+    """
+    rows = [get_vasculature_state_at_step(os.path.join(vasculature_path, f"Vasculature-{step}step.json"), step) for step in steps]
+    if not rows:
+        return pd.DataFrame(columns=["Step", "Mesenchymal cells", "Epithelial cells", "Multicellular clusters", "Total clusters"])
+    return pd.concat(rows, ignore_index=True)
+
+def get_vasculature_state_at_step(vasculature_json_path, step):
     # Reads the dict in the json file
     with open(vasculature_json_path, 'r') as f:
         vasculature_dict = json.load(f)
@@ -107,46 +174,47 @@ def get_vasculature_state_at_step(path_to_save, vasculature_json_path, step):
             epithelial_count += cluster[1]
             if cluster[0] + cluster[1] > 1:
                 multicellular_cluster_count += 1
-    df_export = pd.DataFrame({ "Time": [step], "Mesenchymal cells": [mesenchymal_count], "Epithelial cells" :[epithelial_count], "Multicellular clusters": [multicellular_cluster_count], "Total clusters": [total_cluster_count]})
+    df_export = pd.DataFrame({ "Step": [step], "Mesenchymal cells": [mesenchymal_count], "Epithelial cells" :[epithelial_count], "Multicellular clusters": [multicellular_cluster_count], "Total clusters": [total_cluster_count]})
     return df_export
 
-def generate_data(nameOfTheSimulation):
+def generate_data(nameOfTheSimulation, config=None):
     simulation_path = os.path.join("Simulations", nameOfTheSimulation)
     
+    # the parameters of the simulation, and the max_steps and data_collection_period it was run with
     configs_path = os.path.join(simulation_path, "configs.csv")
-    metaspread.configs.load_simulation_configs_for_data_generation(configs_path)
+    if config is None:
+        config = SimulationConfig.from_csv(configs_path)
+    run_configs = read_run_configs(configs_path)
     
     print(f'\tAnalyzing data in the folder {simulation_path}\n')
 
     # Get the Ecm and Mmp2 data filenames 
     ecm_path = os.path.join(simulation_path, "Ecm")
     mmp2_path = os.path.join(simulation_path, "Mmp2")
-    ecm_files_name = [f for f in sorted(os.listdir(ecm_path), key=lambda x: int(re.findall(r'\d+(?=step)', x)[0])) if os.path.isfile(os.path.join(ecm_path, f)) and f.endswith(".csv")]
-    mmp2_files_name = [f for f in sorted(os.listdir(mmp2_path), key=lambda x: int(re.findall(r'\d+(?=step)', x)[0])) if os.path.isfile(os.path.join(mmp2_path, f)) and f.endswith(".csv")]
+    ecm_files_path = list_field_files(ecm_path, "Ecm")
+    mmp2_files_path = list_field_files(mmp2_path, "Mmp2")
 
     # Get the vasculature data filename
     vasculature_path = os.path.join(simulation_path, "Vasculature")
     vasculature_files_name = [f for f in os.listdir(vasculature_path) if os.path.isfile(os.path.join(vasculature_path, f)) and f.endswith(".json")]
 
-    all_cells_filename = os.path.join(simulation_path, "CellsData.csv")
-    if os.path.isfile(all_cells_filename):
+    all_cells_filename = get_cells_data_path(simulation_path)
+    if all_cells_filename is not None:
         print("Using cells data at:", all_cells_filename)
     else:
-        print("No CellsData.csv cell data found in directory:", simulation_path)
+        print("No CellsData.bin or CellsData.csv cell data found in directory:", simulation_path)
         return
 
-    if ecm_files_name:
-        ecm_files_path = [os.path.join(ecm_path, p) for p in ecm_files_name]
+    if ecm_files_path:
         print("Using Ecm data in the folder:", ecm_path)
     else:
-        print("No .csv Ecm data found in directory:", ecm_path)
+        print("No .npy or .csv Ecm data found in directory:", ecm_path)
         return
 
-    if mmp2_files_name:
-        mmp2_files_path = [os.path.join(mmp2_path, p) for p in mmp2_files_name]
+    if mmp2_files_path:
         print("Using Mmp2 data in the folder:", mmp2_path)
     else:
-        print("No .csv Mmp2 data found in directory:", mmp2_path)
+        print("No .npy or .csv Mmp2 data found in directory:", mmp2_path)
         return
 
     if vasculature_files_name:
@@ -155,13 +223,11 @@ def generate_data(nameOfTheSimulation):
         print("No .json vasculature data found in directory:", simulation_path)
         return
 
-    step_size = metaspread.configs.data_collection_period
-    real_delta_time = 40 * metaspread.configs.th/0.001 #in seconds (the original ratio is 40 seconds/0.001 non-dimensional time)
-    grids_number = metaspread.configs.grids_number
-    configs_max_step = metaspread.configs.max_steps
-    all_cells_dataframe = pd.read_csv(all_cells_filename, converters={"Position": ast.literal_eval})
-    all_cells_dataframe = all_cells_dataframe[["Step", "Position", "Phenotype", "Grid", "Agent Type", "Ruptured"]]
-    max_step = max(all_cells_dataframe["Step"])
+    step_size = run_configs["data_collection_period"]
+    real_delta_time = 40 * config.th/0.001 #in seconds (the original ratio is 40 seconds/0.001 non-dimensional time)
+    grids_number = config.grids_number
+    configs_max_step = run_configs["max_steps"]
+    max_step = get_last_cells_data_step(simulation_path)
     if configs_max_step >= max_step:
         print(f"Warning: the run for this simulation terminated early")
         print(f"Max step reached is {max_step} while {configs_max_step} was expected.")
@@ -184,57 +250,53 @@ def generate_data(nameOfTheSimulation):
     print("Saving cells numbers data in the folder:", cells_data_path)
     print("Saving vasculature data in the folder:", vasculature_data_path)
     
-    for grid_id in range(1, grids_number+1):
-        print(f'\nGrid: {grid_id}')
-
-        print(f'\tSaving tumor data...')
-        df_radius_diameter_history = pd.DataFrame(columns=['Centroid x', 'Centroid y', 'Radius', 'Diameter', 'Step', 'Grid Id'])
-        for id, step in enumerate(range(step_size,max_step+1,step_size)):
-            real_time_at_step = real_delta_time * step
-            if grid_id == 1:
-                # save_cancer(all_cells_dataframe, grid_id, step, real_time_at_step, tumor_data_path)
-                (centroid, radius, diameter) = save_cancer(all_cells_dataframe, grid_id, step, real_time_at_step, tumor_data_path)
-                new_row = pd.DataFrame({'Centroid x': [centroid[0]], 'Centroid y': [centroid[1]],'Radius': [radius], 'Diameter': [diameter], 'Step': [step], 'Grid Id': [grid_id]})
-                df_radius_diameter_history = pd.concat([df_radius_diameter_history, new_row])
-            else:
-                save_cancer(all_cells_dataframe, grid_id, step, real_time_at_step, tumor_data_path)
-        if grid_id == 1:
-            path = os.path.join(tumor_data_path, f'Tumor radius and diameter history in grid {grid_id}.csv')
-            if not os.path.isfile(path):
-                df_radius_diameter_history.to_csv(path)
-
-        print(f'\tSaving cells numbers graph data...')
-        df_csv_last_step = pd.DataFrame()
-        for id, step in enumerate(range(step_size,max_step+1,step_size)):
-            real_time_at_step = real_delta_time * step
-            df_csv_last_step = save_growth_data(all_cells_dataframe, grid_id , cells_data_path, step, real_time_at_step, real_delta_time, df_csv_last_step)
+    print("Analyzing the cells data, step by step...")
+    steps = np.arange(step_size, max_step+1, step_size)
+    radius_diameter_path = os.path.join(data_path, RADIUS_DIAMETER_FILE)
+    radius_diameter_rows = []
+    growth_dataframes = []
+    for step, records in iter_cells_data_steps(simulation_path, steps):
+        # only the records of this step are in memory
+        analysis = CellsDataAnalysis(records, [step], grids_number, config.gridsize)
+        for grid_id in range(1, grids_number+1):
+            save_cancer(analysis, grid_id, step, real_delta_time * step, tumor_data_path)
+        if not os.path.isfile(radius_diameter_path):
+            (centroid, radius, diameter) = get_cluster_centroid_radius_and_diameter(analysis.positions(1, step), 1)
+            radius_diameter_rows.append({'Centroid x': centroid[0], 'Centroid y': centroid[1], 'Radius': radius, 'Diameter': diameter, 'Step': step, 'Grid Id': 1})
+        growth_dataframes.append(analysis.growth(real_delta_time))
+
+    print(f'Saving radius and diameter data...')
+    if not os.path.isfile(radius_diameter_path):
+        pd.DataFrame(radius_diameter_rows, columns=['Centroid x', 'Centroid y', 'Radius', 'Diameter', 'Step', 'Grid Id']).to_csv(radius_diameter_path, index=False)
+
+    print(f'Saving cells numbers graph data...')
+    path = os.path.join(data_path, GROWTH_FILE)
+    if growth_dataframes and not os.path.isfile(path):
+        growth = pd.concat(growth_dataframes, ignore_index=True)
+        growth.sort_values(["Grid", "Step"], kind="stable").to_csv(path, index=False)
 
     print(f'Saving vasculature...')
-    df_export = pd.DataFrame(columns=["Time", "Mesenchymal cells", "Epithelial cells", "Multicellular clusters", "Total clusters"])
-    for step in range(step_size,max_step+1,step_size):
-        path = os.path.join(vasculature_data_path, f'Vasculature-step{step}.csv')
-        if os.path.isfile(path):
-            continue
-        file_vasculature_on_step = os.path.join(vasculature_path, f"Vasculature-{step}step.json")
-        row = get_vasculature_state_at_step(vasculature_data_path, file_vasculature_on_step, step)
-        df_export = pd.concat([df_export, row])
-        df_export.to_csv(path)
+    path = os.path.join(data_path, VASCULATURE_FILE)
+    if not os.path.isfile(path):
+        get_vasculature_history(vasculature_path, steps).to_csv(path, index=False)
 
-def generate_data_vasculature_only(nameOfTheSimulation):
+def generate_data_vasculature_only(nameOfTheSimulation, config=None):
     simulation_path = os.path.join("Simulations", nameOfTheSimulation)
     
     configs_path = os.path.join(simulation_path, "configs.csv")
-    metaspread.configs.load_simulation_configs_for_data_generation
+    if config is None:
+        config = SimulationConfig.from_csv(configs_path)
+    run_configs = read_run_configs(configs_path)
 
     # Get the vasculature data filename
     vasculature_path = os.path.join(simulation_path, "Vasculature")
     vasculature_files_name = [f for f in os.listdir(vasculature_path) if os.path.isfile(os.path.join(vasculature_path, f)) and f.endswith(".json")]
 
-    all_cells_filename = os.path.join(simulation_path, "CellsData.csv")
-    if os.path.isfile(all_cells_filename):
+    all_cells_filename = get_cells_data_path(simulation_path)
+    if all_cells_filename is not None:
         print("Using cells data at:", all_cells_filename)
     else:
-        print("No CellsData.csv cell data found in directory:", simulation_path)
+        print("No CellsData.bin or CellsData.csv cell data found in directory:", simulation_path)
         return
     if vasculature_files_name:
         print("Using vasculature data at:", vasculature_path)
@@ -242,12 +304,10 @@ def generate_data_vasculature_only(nameOfTheSimulation):
         print("No .json vasculature data found in directory:", simulation_path)
         return
 
-    print("Loading CellsData.csv. This might take a minute...")
-    step_size = metaspread.configs.data_collection_period
-    configs_max_step = metaspread.configs.max_steps
-    all_cells_dataframe = pd.read_csv(all_cells_filename, converters={"Position": ast.literal_eval})
-    all_cells_dataframe = all_cells_dataframe[["Step", "Position", "Phenotype", "Grid", "Agent Type", "Ruptured"]]
-    max_step = max(all_cells_dataframe["Step"])
+    print("Loading the cells data. This might take a minute...")
+    step_size = run_configs["data_collection_period"]
+    configs_max_step = run_configs["max_steps"]
+    max_step = get_last_cells_data_step(simulation_path)
     if configs_max_step >= max_step:
         print(f"Warning: the run for this simulation terminated early")
         print(f"Max step reached is {max_step} while {configs_max_step} was expected.")
@@ -258,49 +318,83 @@ def generate_data_vasculature_only(nameOfTheSimulation):
     vasculature_data_path = os.path.join(data_path, "Vasculature dynamics")
 
     print(f'Saving vasculature...')
-    df_export = pd.DataFrame(columns=["Time", "Mesenchymal cells", "Epithelial cells", "Multicellular clusters", "Total clusters"])
-    for step in range(step_size,max_step+1,step_size):
-        file_vasculature_on_step = os.path.join(vasculature_path, f"Vasculature-{step}step.json")
-        row = get_vasculature_state_at_step(vasculature_data_path, file_vasculature_on_step, step)
-        df_export = pd.concat([df_export, row])
-        path = os.path.join(vasculature_data_path, f'Vasculature-step{step}.csv')
-        df_export.to_csv(path)
+    os.makedirs(vasculature_data_path, exist_ok = True)
+    get_vasculature_history(vasculature_path, range(step_size,max_step+1,step_size)).to_csv(os.path.join(data_path, VASCULATURE_FILE), index=False)
 
 def get_cluster_centroid_radius_and_diameter(ccells_positions, grid_id):
     """"
     Calculates the radius and diameter of the cancer cells in a given site.
 
     Input:
-        model_dataframe: the dataframe containing al information about the model
+        ccells_positions: array of shape (n, 2) with the positions occupied by cancer cells
         grid_id: the grid number for which the radius and diameter will be calculated.
     Returns:
         radius: the maximum of all the distances from each cell to the cell's centroid.
         diameter: the maximum of all the cell-cell distances.
     """
-    if ccells_positions.empty or grid_id != 1:
+    if len(ccells_positions) == 0 or grid_id != 1:
         return ([np.nan, np.nan], np.nan, np.nan)
-    ccells_positions= list(ccells_positions['Position'].unique())
     centroid = np.average(ccells_positions, axis=0)
     #calculating radius
     radii  = np.linalg.norm(ccells_positions - centroid, axis=1)
     radius = radii.max()
-    #calculating diameter
-    dist_matrix = get_distance_matrix(ccells_positions)
-    diameter = dist_matrix.max()
+    #calculating diameter, the farthest cells are vertices of the convex hull
+    diameter = get_hull_diameter(get_convex_hull(ccells_positions))
     return (centroid, radius, diameter)
 
-def get_distance_matrix(vectors):
+def _cross(origin, a, b):
+    return (a[0] - origin[0])*(b[1] - origin[1]) - (a[1] - origin[1])*(b[0] - origin[0])
+
+def get_convex_hull(points):
+    """
+    Calculates the convex hull of a set of grid points with the monotone chain algorithm
+
+    Input:
+        points: array of shape (n, 2) with integer coordinates
+    Returns:
+        list with the vertices of the hull in counterclockwise order, without collinear points
+    """
+    points = np.unique(np.asarray(points, dtype=np.int64).reshape(-1, 2), axis=0)
+    if len(points) > 2:
+        # only the lowest and highest points of every column can be vertices of the hull
+        new_column = points[1:,0] != points[:-1,0]
+        points = points[np.r_[True, new_column] | np.r_[new_column, True]]
+    points = points.tolist()
+    if len(points) <= 2:
+        return points
+    def half_hull(points):
+        hull = []
+        for point in points:
+            while len(hull) >= 2 and _cross(hull[-2], hull[-1], point) <= 0:
+                hull.pop()
+            hull.append(point)
+        return hull
+    lower = half_hull(points)
+    upper = half_hull(reversed(points))
+    return lower[:-1] + upper[:-1]
+
+def get_hull_diameter(hull):
     """
-    Calculates the distance matrix between all the vectors in a list
+    Calculates the largest distance between the vertices of a convex hull, checking
+    its antipodal pairs with the rotating calipers method
 
     Input:
-        vectors (list of numpy 2 by 1 arrays): 
+        hull: list of vertices in counterclockwise order, as returned by get_convex_hull
     Returns:
-        distance matrix: len(vectors) by len(Vectors) numpy array with the distances
-        for all vectors.
+        diameter: the maximum distance between two vertices of the hull
     """
-    vectors = np.array(vectors)
-    x = np.sum(vectors**2,axis=1)
-    xx = np.matmul(vectors,vectors.T)
-    x2 = x.reshape(-1,1) #transposing the vector
-    return np.sqrt(x2-2*xx+x)
\ No newline at end of file
+    n = len(hull)
+    if n < 2:
+        return 0.0
+    squared_distance = lambda a, b: (a[0] - b[0])**2 + (a[1] - b[1])**2
+    if n == 2:
+        return np.sqrt(squared_distance(hull[0], hull[1]))
+    max_squared_distance = 0
+    j = 1
+    for i in range(n):
+        next_i = (i + 1) % n
+        # the farthest vertex from the edge (i, next_i) is its antipodal vertex
+        while _cross(hull[i], hull[next_i], hull[(j + 1) % n]) > _cross(hull[i], hull[next_i], hull[j]):
+            j = (j + 1) % n
+        max_squared_distance = max(max_squared_distance, squared_distance(hull[i], hull[j]), squared_distance(hull[next_i], hull[j]))
+    return np.sqrt(max_squared_distance)
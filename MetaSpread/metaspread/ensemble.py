@@ -0,0 +1,145 @@
+import numpy as np
+import concurrent.futures
+import traceback
+import shutil
+import json
+import time
+import os
+from pathlib import Path
+from datetime import datetime
+import metaspread.simrunner as simrunner
+
+# An ensemble runs several replicates of the same simulation in a pool of processes.
+# Every replicate has its own folder inside the folder of the ensemble, and its own
+# seed, spawned from the master seed of the ensemble with numpy's SeedSequence, so
+# the replicates are independent and the whole ensemble can be reproduced from the
+# master seed. The outcome of every replicate is saved in the EnsembleManifest.json
+# of the ensemble, even if some of them failed.
+MANIFEST_FILE = "EnsembleManifest.json"
+
+def spawn_seeds(master_seed, amount):
+    """
+    Returns amount of independent integer seeds derived from master_seed
+    """
+    children = np.random.SeedSequence(master_seed).spawn(amount)
+    return [int(child.generate_state(1, dtype=np.uint64)[0]) for child in children]
+
+def run_replicate(task):
+    """
+    Runs one replicate of an ensemble, retrying it if it fails. This is the
+    function executed by the workers of the pool, so it never raises.
+
+    Input:
+        task: dict with the replicate index, seed, folder, the amount of retries
+            and the arguments of simrunner.run_simulation
+    Returns:
+        dict with the outcome of the replicate
+    """
+    result = {"Replicate": task["replicate"], "Seed": task["seed"], "Folder": task["folder"], "Status": "failed", "Attempts": 0, "Error": None}
+    for attempt in range(task["retries"] + 1):
+        result["Attempts"] = attempt + 1
+        # a failed attempt may leave a partial simulation behind
+        shutil.rmtree(task["folder"], ignore_errors=True)
+        start = time.perf_counter()
+        try:
+            model = simrunner.run_simulation(
+                f"{task['ensemble_id']}-{task['replicate']}",
+                task["max_steps"],
+                task["data_collection_period"],
+                save_path=Path(task["folder"]),
+                engine=task["engine"],
+                checkpoint_period=task["checkpoint_period"],
+                configs=task["config"],
+                seed=task["seed"])
+        except Exception:
+            result["Error"] = traceback.format_exc()
+            continue
+        result["Status"] = "finished"
+        result["Error"] = None
+        result["Runtime"] = time.perf_counter() - start
+        result["Simulation path"] = model.new_simulation_folder
+        # cancer_cells_counter also counts the cells that left the sites, so the live cells are counted
+        result["Final cancer cells"] = [int(model.occupancy[site].sum()) for site in range(model.grids_number)]
+        result["Time when grids were populated"] = list(model.time_grid_got_populated)
+        result["Dormant site steps"] = model.dormant_site_steps
+        break
+    return result
+
+def run_tasks(tasks, workers):
+    """
+    Runs the replicates of tasks, as given to run_replicate, in a pool of workers processes
+
+    Returns:
+        list with the outcome of every task, in the same order as tasks
+    """
+    results = [None] * len(tasks)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_replicate, task): i for i, task in enumerate(tasks)}
+        for future in concurrent.futures.as_completed(futures):
+            task = tasks[futures[future]]
+            try:
+                result = future.result()
+            except Exception:
+                # the worker process itself died, e.g. killed for using too much memory
+                result = {"Replicate": task["replicate"], "Seed": task["seed"], "Folder": task["folder"], "Status": "failed", "Attempts": 1, "Error": traceback.format_exc()}
+            print(f"Replicate {result['Replicate']} {result['Status']} after {result['Attempts']} attempts")
+            results[futures[future]] = result
+    return results
+
+def run_ensemble(replicates, max_steps, data_collection_period, save_path=Path("."), master_seed=None, workers=None, retries=1, engine="agents", checkpoint_period=None, configs=None):
+    """
+    Runs replicates of a simulation in a pool of processes.
+
+    Input:
+        replicates: amount of replicates
+        max_steps, data_collection_period: as in simrunner.run_simulation
+        save_path: folder where the Ensembles folder is created
+        master_seed: seed from which the seeds of the replicates are spawned. If
+            None, a random one is used and saved in the manifest
+        workers: amount of processes. If None, one per CPU, up to the amount of replicates
+        retries: amount of times a failed replicate is run again
+        engine, checkpoint_period: as in simrunner.run_simulation
+        configs: SimulationConfig or dict of values replacing the ones of the
+            package simulations_configs.csv, shared by all the replicates
+    Returns:
+        The manifest, a dict with the parameters of the ensemble and the outcome of every replicate
+    """
+    if master_seed is None:
+        master_seed = np.random.SeedSequence().entropy
+    config = simrunner.get_simulation_config(configs=configs)
+    if workers is None:
+        workers = min(os.cpu_count() or 1, replicates)
+    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    ensemble_id = f"Ensemble-{current_time}"
+    ensemble_path = os.path.join(save_path, "Ensembles", ensemble_id)
+    os.makedirs(ensemble_path)
+    print(f"Running {replicates} replicates in {workers} processes, saving them at {ensemble_path}")
+
+    tasks = [{
+        "replicate": i,
+        "seed": seed,
+        "folder": os.path.join(ensemble_path, f"Replicate-{i}"),
+        "retries": retries,
+        "ensemble_id": ensemble_id,
+        "max_steps": max_steps,
+        "data_collection_period": data_collection_period,
+        "engine": engine,
+        "checkpoint_period": checkpoint_period,
+        "config": config} for i, seed in enumerate(spawn_seeds(master_seed, replicates))]
+    results = run_tasks(tasks, workers)
+
+    manifest = {
+        "Ensemble": ensemble_id,
+        "Master seed": master_seed,
+        "Replicates": replicates,
+        "Finished": sum(result["Status"] == "finished" for result in results),
+        "Failed": sum(result["Status"] == "failed" for result in results),
+        "Max steps": max_steps,
+        "Data collection period": data_collection_period,
+        "Engine": engine,
+        "Configs": config.to_dict(),
+        "Results": results}
+    with open(os.path.join(ensemble_path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=4)
+    print(f"Finished the ensemble: {manifest['Finished']} replicates finished and {manifest['Failed']} failed")
+    return manifest
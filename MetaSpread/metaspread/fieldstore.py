@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import re
+import os
+
+# The MMP2 and ECM concentrations of each grid are saved every data collection step as
+# binary .npy files, named as the csv files used by previous versions of the simulator:
+#   Mmp2/Mmp2-{grid_id}grid-{step}step.npy
+#   Ecm/Ecm-{grid_id}grid-{step}step.npy
+# The readers also accept the old .csv files, so older simulations can still be loaded
+# and postprocessed, and convert_simulation_fields turns them into .npy files.
+FIELDS = ["Mmp2", "Ecm"]
+FIELD_EXTENSIONS = (".npy", ".csv")
+
+def get_field_file_name(field, grid_id, step, extension=".npy"):
+    return f"{field}-{grid_id}grid-{step}step{extension}"
+
+def get_step_and_grid(file_name):
+    """
+    Returns the (step, grid_id) of a field file name
+    """
+    grid_id, step = re.findall(r'-(\d+)grid-(\d+)step', file_name)[0]
+    return int(step), int(grid_id)
+
+def save_field(folder, field, grid_id, step, concentration):
+    """
+    Saves the concentration of a field of a grid at a given step as a .npy file
+
+    Input:
+        folder: path of the Mmp2 or Ecm folder of the simulation
+        field: "Mmp2" or "Ecm"
+        grid_id: id of the grid
+        step: step of the simulation
+        concentration: (width, height) array with the concentration
+    Returns:
+        The path of the saved file
+    """
+    path = os.path.join(folder, get_field_file_name(field, grid_id, step))
+    np.save(path, concentration)
+    return path
+
+def load_field(path):
+    """
+    Loads the concentration saved in a .npy or .csv field file as a (width, height) array
+    """
+    if path.endswith(".npy"):
+        return np.load(path)
+    return pd.read_csv(path, index_col=0).to_numpy(dtype=float)
+
+def list_field_files(folder, field, grid_id=None):
+    """
+    Lists the field files of a folder, of all grids or only of grid_id, sorted by step.
+
+    If a step has both a .npy and a .csv file, only the .npy one is listed.
+
+    Input:
+        folder: path of the Mmp2 or Ecm folder of the simulation
+        field: "Mmp2" or "Ecm"
+        grid_id: if not None, only the files of this grid are listed
+    Returns:
+        list with the paths of the files
+    """
+    files_by_step_and_grid = {}
+    for file_name in os.listdir(folder):
+        if not (file_name.startswith(f"{field}-") and file_name.endswith(FIELD_EXTENSIONS)):
+            continue
+        step, file_grid_id = get_step_and_grid(file_name)
+        if grid_id is not None and file_grid_id != grid_id:
+            continue
+        if file_name.endswith(".npy") or (step, file_grid_id) not in files_by_step_and_grid:
+            files_by_step_and_grid[(step, file_grid_id)] = os.path.join(folder, file_name)
+    return [files_by_step_and_grid[key] for key in sorted(files_by_step_and_grid)]
+
+def convert_simulation_fields(simulation_path, remove_csv=False):
+    """
+    Converts the .csv Mmp2 and Ecm files of a simulation to .npy files
+
+    Input:
+        simulation_path: path of the simulation folder
+        remove_csv: if True, the .csv files are deleted after being converted
+    Returns:
+        The amount of converted files
+    """
+    converted_files = 0
+    for field in FIELDS:
+        folder = os.path.join(simulation_path, field)
+        if not os.path.isdir(folder):
+            continue
+        for file_name in sorted(os.listdir(folder)):
+            if not (file_name.startswith(f"{field}-") and file_name.endswith(".csv")):
+                continue
+            csv_path = os.path.join(folder, file_name)
+            step, grid_id = get_step_and_grid(file_name)
+            save_field(folder, field, grid_id, step, load_field(csv_path))
+            if remove_csv:
+                os.remove(csv_path)
+            converted_files += 1
+    print(f"Converted {converted_files} Mmp2 and Ecm files in {simulation_path} to .npy")
+    return converted_files
@@ -0,0 +1,102 @@
+import pandas as pd
+import contextlib
+import json
+import time
+import os
+
+# The performance report of a simulation is saved in its folder as
+# PerformanceReport.json, with the time spent in every phase of the steps and the
+# counters of the events of the simulation, and as PerformanceReport.csv, with one
+# row per phase and counter.
+REPORT_FILE = "PerformanceReport"
+
+class StepProfiler:
+    """
+    Measures the time spent in each phase of the steps of a simulation, counts its
+    events and shows its progress.
+
+    Attributes:
+    ---------------
+    times: dict
+        total time in seconds spent in every phase
+    calls: dict
+        amount of times every phase was run
+    counters: dict
+        amount of every counted event
+    progress_interval: float
+        minimum amount of seconds between two progress lines
+
+    Methods:
+    ---------------
+    phase(name)
+        Context manager that adds the time spent inside it to the phase
+    count(name, amount)
+        Adds amount to the counter of name
+    progress(step, steps_done, total_steps)
+        Shows the progress line, if progress_interval seconds passed since the last one
+    report()
+        Returns the times and counters as a dict
+    write_report(folder)
+        Saves the report in PerformanceReport.json and PerformanceReport.csv
+    """
+
+    def __init__(self, progress_interval=1.0):
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+        self.progress_interval = progress_interval
+        self.start_time = time.perf_counter()
+        self.last_progress_time = None
+        self.steps = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def progress(self, step, steps_done, total_steps):
+        """
+        Shows the current step, the steps per second and the estimated time left
+
+        Input:
+            step: number of the current step, counting the steps of a loaded simulation
+            steps_done: amount of steps run by this model
+            total_steps: amount of steps this model has to run
+        """
+        self.steps = steps_done
+        now = time.perf_counter()
+        if self.last_progress_time is not None and now - self.last_progress_time < self.progress_interval and steps_done < total_steps:
+            return
+        self.last_progress_time = now
+        elapsed = now - self.start_time
+        steps_per_second = steps_done / elapsed if elapsed > 0 else 0.0
+        eta = (total_steps - steps_done) / steps_per_second if steps_per_second > 0 else 0.0
+        print(f"Step number: {step} ({steps_done}/{total_steps}), {steps_per_second:.2f} steps/s, ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}   ", end="\r")
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start_time
+        return {
+            "Steps": self.steps,
+            "Elapsed time (s)": elapsed,
+            "Steps per second": self.steps / elapsed if elapsed > 0 else 0.0,
+            "Phases": {name: {"Calls": self.calls[name], "Time (s)": self.times[name]} for name in self.times},
+            "Counters": dict(self.counters)}
+
+    def write_report(self, folder):
+        """
+        Saves the report in the PerformanceReport.json and PerformanceReport.csv files of folder
+        """
+        report = self.report()
+        with open(os.path.join(folder, REPORT_FILE + ".json"), "w") as f:
+            json.dump(report, f, indent=4)
+        rows = [{"Name": name, "Type": "phase", "Calls": phase["Calls"], "Time (s)": phase["Time (s)"], "Count": None} for name, phase in report["Phases"].items()]
+        rows += [{"Name": name, "Type": "counter", "Calls": None, "Time (s)": None, "Count": count} for name, count in report["Counters"].items()]
+        pd.DataFrame(rows, columns=["Name", "Type", "Calls", "Time (s)", "Count"]).to_csv(os.path.join(folder, REPORT_FILE + ".csv"), index=False)
+        return report
@@ -1,4 +1,5 @@
 import metaspread.configs
+from metaspread.configs import SimulationConfig
 import pandas as pd
 import shutil
 import mesa
@@ -10,13 +11,14 @@ from datetime import datetime
 
 # To run this code you must be in the parent folder of the program
 
-def save_configs(simulations_dir, new_simulation_folder, config_var_names, max_steps, data_collection_period):
+def save_configs(simulations_dir, new_simulation_folder, config, max_steps, data_collection_period):
     # Saves the simulation configuration
     print(f"\t Saving all the simulations parameters at: {os.path.join(simulations_dir, new_simulation_folder, 'configs.csv')}")
-    values = [getattr(metaspread.configs, i) for i in config_var_names]
-    names = config_var_names
+    config_dict = config.to_dict()
+    names = list(config_dict)
+    values = list(config_dict.values())
 
-    #add configurations that are not in the global variables
+    #add configurations that are not parameters of the model
     names += ['max_steps', 'data_collection_period']
     values += [max_steps, data_collection_period]
     df_vars = pd.DataFrame({"Names": names, "Values": values})
@@ -25,24 +27,38 @@ def save_configs(simulations_dir, new_simulation_folder, config_var_names, max_s
     df_vars.to_csv(path)
 
 
-def run_simulation(simulation_id, max_steps, data_collection_period, save_path=Path("."), loaded_simulation_path=""):
+def get_simulation_config(loaded_simulation_path="", configs=None):
+    """
+    Returns the SimulationConfig of a simulation.
+
+    Input:
+        loaded_simulation_path: if given, the configs.csv of this simulation is used
+        configs: SimulationConfig to use as is, or dict with the values that
+            replace the ones of the simulations_configs.csv of the package
+    Returns:
+        SimulationConfig
+    """
+    if loaded_simulation_path != "":
+        return SimulationConfig.from_csv(os.path.join(loaded_simulation_path, "configs.csv"))
+    if isinstance(configs, SimulationConfig):
+        return configs
+    package_dir = os.path.dirname(metaspread.__file__)
+    config = SimulationConfig.from_csv(os.path.join(package_dir, "simulations_configs.csv"))
+    if configs:
+        config = SimulationConfig.from_dict({**config.to_dict(), **configs})
+    return config
+
+def run_simulation(simulation_id, max_steps, data_collection_period, save_path=Path("."), loaded_simulation_path="", engine="agents", checkpoint_period=None, configs=None, seed=None, environment_workers=1, environment_tiles=1, environment_tolerance=0.0):
     # n = random.randint(1, 100)
-    # load configs file from a previous simulation or loads the general configs file
+    # load configs file from a previous simulation, or use the given configs over the general configs file
     # print(loaded_simulation_path)
     loaded_simulation_path= loaded_simulation_path.strip('\"')
-    if loaded_simulation_path != "":
-        configs_path = os.path.join(loaded_simulation_path, "configs.csv")
-        config_var_names = metaspread.configs.load_simulation_configs_for_reloaded_simulation(configs_path)
-    else:
-        package_dir = os.path.dirname(metaspread.__file__)
-        configs_path = os.path.join(package_dir, "simulations_configs.csv")
-        # print(f"simrunner.py configs_path: {configs_path}")
-        config_var_names = metaspread.configs.init_simulation_configs(configs_path)
+    config = get_simulation_config(loaded_simulation_path, configs)
     
     # Parameters for this simulation
-    number_of_initial_cells = metaspread.configs.number_of_initial_cells # Number of cancer cells
-    gridsize     = metaspread.configs.gridsize
-    grids_number = metaspread.configs.grids_number
+    number_of_initial_cells = config.number_of_initial_cells # Number of cancer cells
+    gridsize     = config.gridsize
+    grids_number = config.grids_number
     width        = gridsize
     height       = gridsize
 
@@ -50,15 +66,10 @@ def run_simulation(simulation_id, max_steps, data_collection_period, save_path=P
     simulations_dir = save_path / "Simulations"
     os.makedirs(simulations_dir, exist_ok=True)
     if loaded_simulation_path != "":
-        cells_path = os.path.join(loaded_simulation_path, "CellsData.csv")
-        df = pd.read_csv(cells_path)
-        loaded_max_step = max(df["Step"])
         new_simulation_folder = os.path.normpath(loaded_simulation_path)
         new_simulation_folder = os.path.basename(new_simulation_folder)
         new_simulation_path = os.path.join(simulations_dir, new_simulation_folder)
     else:
-        df = pd.DataFrame()
-        loaded_max_step = 0
         current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         new_simulation_folder = f"Sim-{simulation_id}-Date-{current_time}"
 
@@ -87,7 +98,7 @@ def run_simulation(simulation_id, max_steps, data_collection_period, save_path=P
             return print("This simulation already exists!")
 
     # Run the simulation and saves the data
-    save_configs(simulations_dir, new_simulation_folder, config_var_names, max_steps, data_collection_period)
+    save_configs(simulations_dir, new_simulation_folder, config, max_steps, data_collection_period)
     model = metaspread.CancerModel(
         number_of_initial_cells,
         width,
@@ -96,8 +107,17 @@ def run_simulation(simulation_id, max_steps, data_collection_period, save_path=P
         max_steps,
         data_collection_period,
         new_simulation_path,
-        loaded_simulation_path)
-    for i in range(max_steps):
-        model.step()
+        loaded_simulation_path,
+        engine=engine,
+        checkpoint_period=checkpoint_period,
+        config=config,
+        seed=seed,
+        environment_workers=environment_workers,
+        environment_tiles=environment_tiles,
+        environment_tolerance=environment_tolerance)
+    with model:
+        for i in range(max_steps):
+            model.step()
     print(f'Finished the simulation at time step {model.schedule.time}!')
+    print(f'Skipped {model.dormant_site_steps} environment updates of dormant sites')
     return model
\ No newline at end of file
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+import dataclasses
+import itertools
+import json
+import os
+from pathlib import Path
+from datetime import datetime
+import metaspread.simrunner as simrunner
+import metaspread.ensemble as ensemble
+from metaspread.configs import SimulationConfig
+
+# A sweep runs a simulation for every point of a design over some of the parameters
+# of simulations_configs.csv. The range of a parameter is either a (low, high) tuple,
+# sampled as a continuous range (rounded for the integer parameters), or a list of the
+# values it can take, such as the possible extravasation_probs. The points that do not
+# satisfy the constraints of SimulationConfig are not run, and every run of the
+# sweep, including the invalid points, is a row of its SweepResults.csv.
+DESIGN_METHODS = ["grid", "random", "latin_hypercube"]
+RESULTS_FILE = "SweepResults.csv"
+
+def _scale(range_, fractions):
+    # maps fractions in [0, 1) to the values of a range
+    if isinstance(range_, list):
+        return [range_[int(fraction*len(range_))] for fraction in fractions]
+    low, high = range_
+    return (low + np.asarray(fractions)*(high - low)).tolist()
+
+def generate_design(ranges, method="grid", points=10, levels=3, seed=None):
+    """
+    Generates the points of a sweep over the parameters in ranges.
+
+    Input:
+        ranges: dict with a (low, high) tuple or a list of values for every parameter
+        method: "grid" uses every combination of levels evenly spaced values of the
+            tuples and of all the values of the lists. "random" samples points points
+            uniformly, and "latin_hypercube" samples points points so that every one
+            of points equal intervals of each range is used once.
+        points: amount of points of the random and latin_hypercube designs
+        levels: amount of values of every tuple range in the grid design
+        seed: seed of the random and latin_hypercube designs
+    Returns:
+        list of dicts with the value of every parameter
+    """
+    if method not in DESIGN_METHODS:
+        raise ValueError(f"Unknown design method '{method}'! Use one of {DESIGN_METHODS}.")
+    names = list(ranges)
+    if method == "grid":
+        axes = [ranges[name] if isinstance(ranges[name], list) else np.linspace(*ranges[name], levels).tolist() for name in names]
+        return [dict(zip(names, values)) for values in itertools.product(*axes)]
+    rng = np.random.default_rng(seed)
+    if method == "random":
+        fractions = rng.random((len(names), points))
+    else:
+        fractions = (np.array([rng.permutation(points) for _ in names]) + rng.random((len(names), points)))/points
+    columns = [_scale(ranges[name], fractions[i]) for i, name in enumerate(names)]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+def make_config(base_config, point):
+    """
+    Returns the SimulationConfig of a point of a sweep, built over base_config.
+
+    The integer parameters are rounded, and if only one of mesenchymal_proportion and
+    epithelial_proportion is in the point the other one is set so they sum 1.
+    Raises ValueError if the point does not satisfy the constraints of SimulationConfig.
+    """
+    types = {field.name: field.type for field in dataclasses.fields(SimulationConfig)}
+    values = {}
+    for name, value in point.items():
+        if name not in types:
+            raise ValueError(f"Unknown configuration option: {name}")
+        values[name] = int(round(value)) if types[name] is int else value
+    if "mesenchymal_proportion" in values and "epithelial_proportion" not in values:
+        values["epithelial_proportion"] = 1 - values["mesenchymal_proportion"]
+    elif "epithelial_proportion" in values and "mesenchymal_proportion" not in values:
+        values["mesenchymal_proportion"] = 1 - values["epithelial_proportion"]
+    return base_config.replace(**values)
+
+def run_sweep(ranges, max_steps, data_collection_period, method="grid", points=10, levels=3, replicates=1, master_seed=None, workers=None, retries=1, save_path=Path("."), engine="agents", configs=None):
+    """
+    Runs a simulation for every point of a design, in a pool of processes.
+
+    Input:
+        ranges, method, points, levels: as in generate_design. The design uses master_seed as its seed.
+        max_steps, data_collection_period: as in simrunner.run_simulation
+        replicates: amount of simulations run for every point
+        master_seed: seed from which the seeds of all the simulations are spawned. If None, a random one is used
+        workers: amount of processes. If None, one per CPU
+        retries: amount of times a failed simulation is run again
+        save_path: folder where the Sweeps folder is created
+        engine: as in simrunner.run_simulation
+        configs: SimulationConfig or dict with the values of the parameters that are not swept
+    Returns:
+        dataframe with the results of the sweep, one row per simulation, also saved in SweepResults.csv
+    """
+    if master_seed is None:
+        master_seed = np.random.SeedSequence().entropy
+    base_config = simrunner.get_simulation_config(configs=configs)
+    design = generate_design(ranges, method, points, levels, seed=master_seed)
+    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    sweep_id = f"Sweep-{current_time}"
+    sweep_path = os.path.join(save_path, "Sweeps", sweep_id)
+    os.makedirs(sweep_path)
+
+    rows = []
+    tasks = []
+    seeds = ensemble.spawn_seeds(master_seed, len(design)*replicates)
+    for point_index, point in enumerate(design):
+        try:
+            config = make_config(base_config, point)
+        except ValueError as error:
+            config = None
+            error_message = str(error)
+        for replicate in range(replicates):
+            run = point_index*replicates + replicate
+            row = {"Point": point_index, "Replicate": replicate, "Seed": seeds[run]}
+            row.update({name: json.dumps(value) if isinstance(value, list) else value for name, value in point.items()})
+            rows.append(row)
+            if config is None:
+                row.update({"Status": "invalid", "Error": error_message})
+                continue
+            tasks.append({
+                "replicate": run,
+                "seed": seeds[run],
+                "folder": os.path.join(sweep_path, f"Point-{point_index}-Replicate-{replicate}"),
+                "retries": retries,
+                "ensemble_id": sweep_id,
+                "max_steps": max_steps,
+                "data_collection_period": data_collection_period,
+                "engine": engine,
+                "checkpoint_period": None,
+                "config": config})
+    if workers is None:
+        workers = max(1, min(os.cpu_count() or 1, len(tasks)))
+    print(f"Running {len(tasks)} simulations of {len(design)} points ({len(rows) - len(tasks)} runs of invalid points skipped) in {workers} processes, saving them at {sweep_path}")
+    results = ensemble.run_tasks(tasks, workers) if tasks else []
+
+    results_by_run = {result["Replicate"]: result for result in results}
+    grids_number = max([base_config.grids_number] + [len(result.get("Final cancer cells", [])) for result in results])
+    for row in rows:
+        result = results_by_run.get(row["Point"]*replicates + row["Replicate"])
+        if result is None:
+            continue
+        row.update({"Status": result["Status"], "Runtime": result.get("Runtime"), "Error": result["Error"], "Simulation path": result.get("Simulation path")})
+        for grid in range(grids_number):
+            cells = result.get("Final cancer cells", [])
+            populated = result.get("Time when grids were populated", [])
+            row[f"Cancer cells in grid {grid+1}"] = cells[grid] if grid < len(cells) else None
+            row[f"Time when grid {grid+1} was first populated"] = populated[grid] if grid < len(populated) else None
+    df = pd.DataFrame(rows)
+    df.to_csv(os.path.join(sweep_path, RESULTS_FILE), index=False)
+    with open(os.path.join(sweep_path, "SweepDesign.json"), "w") as f:
+        json.dump({"Ranges": ranges, "Method": method, "Points": len(design), "Replicates": replicates, "Master seed": master_seed,
+                   "Max steps": max_steps, "Data collection period": data_collection_period, "Engine": engine, "Configs": base_config.to_dict()}, f, indent=4)
+    print(f"Finished the sweep: {(df['Status'] == 'finished').sum()} simulations finished, {(df['Status'] == 'failed').sum()} failed and {(df['Status'] == 'invalid').sum()} were invalid")
+    return df
+
+def run_sweep_file(path):
+    """
+    Runs the sweep described in a json file, with the ranges and the rest of the
+    arguments of run_sweep as its keys. A (low, high) range is written as a dict
+    {"low": low, "high": high}, and a list of values as a list.
+    """
+    with open(path) as f:
+        arguments = json.load(f)
+    arguments["ranges"] = {name: (range_["low"], range_["high"]) if isinstance(range_, dict) else range_ for name, range_ in arguments["ranges"].items()}
+    return run_sweep(**arguments)
@@ -0,0 +1,86 @@
+import numpy as np
+
+class Vasculature:
+    """
+    Clusters of cancer cells travelling through the vasculature, indexed by their arrival time.
+
+    The clusters arriving at each time are stored as a (number of clusters, 2) integer
+    array, where the first column is the amount of mesenchymal cells of each cluster
+    and the second one the amount of epithelial cells. It can be used as a dict from
+    arrival times to clusters, and indexing a time returns its array of clusters.
+
+    Methods:
+    ---------------
+    add_cluster(time, mesenchymal, epithelial)
+        Adds a cluster that will arrive at the given time
+    count_cells()
+        Returns the total amount of cells in the vasculature
+    to_dict()
+        Returns the clusters as a dict of lists, that can be saved as json
+    """
+
+    def __init__(self, clusters_by_time=None):
+        self._clusters = {}
+        if clusters_by_time is not None:
+            for time, clusters in clusters_by_time.items():
+                self[time] = clusters
+
+    def __setitem__(self, time, clusters):
+        self._clusters[int(time)] = np.asarray(clusters, dtype=np.int64).reshape(-1, 2)
+
+    def __getitem__(self, time):
+        return self._clusters[time]
+
+    def __delitem__(self, time):
+        del self._clusters[time]
+
+    def __contains__(self, time):
+        return time in self._clusters
+
+    def __iter__(self):
+        return iter(self._clusters)
+
+    def __len__(self):
+        return len(self._clusters)
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            other = Vasculature(other)
+        if not isinstance(other, Vasculature):
+            return NotImplemented
+        return self._clusters.keys() == other._clusters.keys() and \
+            all(np.array_equal(self._clusters[time], other._clusters[time]) for time in self._clusters)
+
+    def __repr__(self):
+        return f"Vasculature({self.to_dict()})"
+
+    def keys(self):
+        return self._clusters.keys()
+
+    def items(self):
+        return self._clusters.items()
+
+    def values(self):
+        return self._clusters.values()
+
+    def get(self, time, default=None):
+        return self._clusters.get(time, default)
+
+    def pop(self, time, *default):
+        return self._clusters.pop(time, *default)
+
+    def add_cluster(self, time, mesenchymal, epithelial):
+        """
+        Adds a cluster of mesenchymal and epithelial cells that will arrive at the given time
+        """
+        new_cluster = np.array([[mesenchymal, epithelial]], dtype=np.int64)
+        if time in self._clusters:
+            self._clusters[time] = np.concatenate([self._clusters[time], new_cluster])
+        else:
+            self._clusters[time] = new_cluster
+
+    def count_cells(self):
+        return int(sum(clusters.sum() for clusters in self._clusters.values()))
+
+    def to_dict(self):
+        return {time: clusters.tolist() for time, clusters in self._clusters.items()}
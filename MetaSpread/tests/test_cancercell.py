@@ -282,4 +282,31 @@ def test_cancercell_movement_stay(tmp_path) -> None:
         for agent in model.schedule.agents:
             if agent.agent_type == "cell":
                 assert agent.pos == current_positions[i]
-                i = i + 1
\ No newline at end of file
+                i = i + 1
+
+def test_cancercell_step_outside_of_the_model(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=0,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path,
+        fixed_p_left=1,
+        fixed_p_right=0,
+        fixed_p_top=0,
+        fixed_p_bottom=0
+        )
+    grid_id = 1
+    ccell = CancerCell(model.current_agent_id, model, model.grids[grid_id-1], grid_id, "epithelial", model.ecm[grid_id-1], model.mmp2[grid_id-1])
+    model.current_agent_id += 1
+    model.grids[grid_id-1].place_agent(ccell, (1, 20))
+    model.schedule.add(ccell)
+    # without the moves sampled by the model, the cell samples its own move
+    ccell.step()
+    assert ccell.pos == (0, 20)
+    assert ccell.next_position is None
+    # the move out of the grid is dropped, so the cell stays on the border
+    ccell.step()
+    assert ccell.pos == (0, 20)
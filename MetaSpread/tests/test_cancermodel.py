@@ -1,6 +1,6 @@
 import pytest
 from metaspread import cancermodel
-from metaspread import configs
+from metaspread.configs import SimulationConfig
 from metaspread import simrunner
 from pathlib import Path
 
@@ -24,17 +24,21 @@ def test_imports():
 from metaspread.cancermodel import CancerModel
 from metaspread.cancercell import CancerCell
 from metaspread.vessel import Vessel
+from metaspread.vasculature import Vasculature
+from metaspread.cellstore import load_cells_data
 import numpy as np
 import pandas as pd
 import pytest
 import ast
+import shutil
+import os
 
 #todo: model is not callable (duh! I think I cannot call a private variable (is it though?))
 #todo: use tmp_path_facorty to create the model once, and use it for the rest of the tests
 
 def test_load(tmp_path) -> None:
     simulations_path = tmp_path / "Simulations"
-    model = simrunner.run_simulation(10, 10, save_path=tmp_path)
+    model = simrunner.run_simulation(1, 10, 10, save_path=tmp_path)
     
     model_loaded = CancerModel(
         number_of_initial_cells=30,
@@ -44,8 +48,9 @@ def test_load(tmp_path) -> None:
         max_steps=1000,
         data_collection_period=2,
         new_simulation_folder= simulations_path / "test_loaded_sim",
-        loaded_simulation_path = simulations_path / "Sim-max_steps-10-collection_period-10-cells-388-grids_number-3")
-    assert model.vasculature == model_loaded.vasculature
+        loaded_simulation_path = model.new_simulation_folder)
+    # the vasculature of the loaded model is indexed by the time of its own scheduler
+    assert model.vasculature == {time + model_loaded.loaded_max_step: clusters for time, clusters in model_loaded.vasculature.items()}
     assert model.number_of_initial_cells == model_loaded.number_of_initial_cells
     assert model.width == model_loaded.width
     assert model.height == model_loaded.height
@@ -88,15 +93,15 @@ def test_cancermodel(tmp_path) -> None:
         new_simulation_folder=temp_simulation_folder)
     
     assert model.number_of_initial_cells==30
-    assert model.width==configs.gridsize
-    assert model.height==configs.gridsize
-    assert model.grids_number==configs.grids_number
+    assert model.width==model.config.gridsize
+    assert model.height==model.config.gridsize
+    assert model.grids_number==model.config.grids_number
     assert model.max_steps==1000
     assert model.data_collection_period==200000
     assert model.new_simulation_folder==temp_simulation_folder
 
     #test proliferation
-    cancermodel.carrying_capacity = 200
+    model.config = model.config.replace(carrying_capacity=200)
     # current_cell_count = list(map(type, model.schedule.agents)).count(CancerCell)
     current_cell_count = cancermodel.count_total_cells(model)
     model.proliferate("mesenchymal")
@@ -118,20 +123,19 @@ def test_cancermodel(tmp_path) -> None:
     
     #test count_vasculature_cells
     assert cancermodel.count_vasculature_cells(model) == 0
-    model.vasculature = {1: [(100,100)]}
+    model.vasculature = Vasculature({1: [(100,100)]})
     assert cancermodel.count_vasculature_cells(model) == 200
 
     #test cell disaggregation
     for i in range(100):
         for j in range(100):
-            model.vasculature = {1: [(i,j)]}
+            model.vasculature = Vasculature({1: [(i,j)]})
             model.disaggregate_clusters(1)
             assert sum(x+y for x,y in model.vasculature[1]) == i + j
 
     #test cell travel
-    model.vasculature = {1: [(100,100)]}
-    cancermodel.single_cell_survival = 1
-    cancermodel.cluster_survival = 1
+    model.vasculature = Vasculature({1: [(100,100)]})
+    model.config = model.config.replace(single_cell_survival=1, cluster_survival=1)
     model.step()
     model.step()
     assert list(map(type, model.schedule.agents)).count(CancerCell) == current_cell_count + 200
@@ -140,3 +144,505 @@ def test_cancermodel(tmp_path) -> None:
     
 
     
+
+def reference_calculate_environment(mmp2, ecm, mesenchymal_count, config):
+    # point by point version of the environment update, kept to check the vectorized one
+    width, height = mmp2.shape[1:]
+    dmmp, tha, xha, th = config.dmmp, config.tha, config.xha, config.th
+    for x in range(width):
+        for y in range(height):
+            left   = mmp2[0,x-1,y] if x > 0 else mmp2[0,x+1,y]
+            right  = mmp2[0,x+1,y] if x < width-1 else mmp2[0,x-1,y]
+            top    = mmp2[0,x,y-1] if y > 0 else mmp2[0,x,y+1]
+            bottom = mmp2[0,x,y+1] if y < height-1 else mmp2[0,x,y-1]
+            mmp2[1,x,y] = dmmp*tha/xha**2*(right+left+bottom+top)\
+                    +mmp2[0,x,y]*(1-4*dmmp*tha/xha**2-th*config.Lambda)+tha*config.theta*mesenchymal_count[x,y]
+            ecm[1,x,y] = ecm[0,x,y]*(1-tha*(config.gamma1*mesenchymal_count[x,y]+config.gamma2*mmp2[1,x,y]))
+    mmp2[0,:,:] = mmp2[1,:,:]
+    ecm[0,:,:] = ecm[1,:,:]
+
+def test_calculate_environment_matches_pointwise_update(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=60,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path)
+    generator = np.random.default_rng(0)
+    for i in range(model.grids_number):
+        model.mmp2[i][0] = generator.random((51, 51))
+        model.ecm[i][0] = 1 - 0.1*generator.random((51, 51))
+    expected_mmp2 = [array.copy() for array in model.mmp2]
+    expected_ecm = [array.copy() for array in model.ecm]
+    for _ in range(3):
+        model.calculate_environment(model.mmp2, model.ecm)
+        for i in range(model.grids_number):
+            reference_calculate_environment(expected_mmp2[i], expected_ecm[i], model.mesenchymal_count[i], model.config)
+    for i in range(model.grids_number):
+        assert np.allclose(model.mmp2[i], expected_mmp2[i], rtol=1e-12, atol=1e-15)
+        assert np.allclose(model.ecm[i], expected_ecm[i], rtol=1e-12, atol=1e-15)
+
+def test_threaded_environment_matches_sequential(tmp_path) -> None:
+    config = SimulationConfig.from_csv("simulations_configs.csv").replace(
+        grids_number=4,
+        secondary_sites_vessels=[10, 10, 10],
+        extravasation_probs=[0.5, 0.25, 0.25])
+    models = [CancerModel(
+        number_of_initial_cells=60,
+        width=51,
+        height=51,
+        grids_number=4,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path,
+        seed=2,
+        environment_workers=workers,
+        environment_tiles=tiles,
+        config=config) for workers, tiles in [(1, 1), (4, 1), (3, 5)]]
+    for model in models:
+        generator = np.random.default_rng(0)
+        for i in range(model.grids_number):
+            model.mmp2[i][0] = generator.random((51, 51))
+            model.ecm[i][0] = 1 - 0.1*generator.random((51, 51))
+        for _ in range(3):
+            model.calculate_environment(model.mmp2, model.ecm)
+    for model in models[1:]:
+        for i in range(model.grids_number):
+            assert (model.mmp2[i] == models[0].mmp2[i]).all()
+            assert (model.ecm[i] == models[0].ecm[i]).all()
+
+def test_config_must_fit_the_model(tmp_path) -> None:
+    with pytest.raises(ValueError, match="grids"):
+        CancerModel(30, 51, 51, 4, 10, 10, tmp_path)
+    with pytest.raises(ValueError, match="too small"):
+        CancerModel(30, 11, 11, 2, 10, 10, tmp_path)
+
+def test_environment_threads_are_shut_down(tmp_path) -> None:
+    for folder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+        (tmp_path / folder).mkdir()
+    model = CancerModel(
+        number_of_initial_cells=30,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=2,
+        data_collection_period=2,
+        new_simulation_folder=tmp_path,
+        environment_workers=2)
+    executor = model.environment_executor
+    model.step()
+    assert model.environment_executor is executor
+    model.step()
+    # the threads are not needed after the last step
+    assert model.environment_executor is None
+    assert executor._shutdown
+    with CancerModel(30, 51, 51, 2, 10, 10, tmp_path, environment_workers=2) as model:
+        executor = model.environment_executor
+    assert executor._shutdown and model.environment_executor is None
+
+def test_dormant_sites_are_skipped(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=30,
+        width=51,
+        height=51,
+        grids_number=3,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path)
+    assert model.dormant_sites == [False, True, True]
+    for _ in range(5):
+        model.step()
+    assert model.dormant_site_steps == 10
+    for site in [1, 2]:
+        assert not model.mmp2[site].any()
+        assert (model.ecm[site] == 1).all()
+    model._create_cells(1, [(20, 20)], ["mesenchymal"])
+    assert model.dormant_sites == [False, False, True]
+    model.step()
+    assert model.dormant_site_steps == 11
+    assert model.mmp2[1][0, 20, 20] > 0
+    assert model.ecm[1][0, 20, 20] < 1
+
+def test_active_region_matches_whole_site(tmp_path) -> None:
+    models = {}
+    for tolerance in [None, 0.0, 1e-12]:
+        for folder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+            (tmp_path / str(tolerance) / folder).mkdir(parents=True)
+        models[tolerance] = CancerModel(
+            number_of_initial_cells=100,
+            width=81,
+            height=81,
+            grids_number=2,
+            max_steps=1000,
+            data_collection_period=200000,
+            new_simulation_folder=tmp_path / str(tolerance),
+            seed=4,
+            engine="arrays",
+            environment_tolerance=tolerance)
+    for _ in range(40):
+        for model in models.values():
+            model.step()
+    full_model = models[None]
+    for tolerance in [0.0, 1e-12]:
+        assert (models[tolerance].occupancy == full_model.occupancy).all()
+    # with no tolerance the results are exactly the same
+    assert (models[0.0].mmp2[0] == full_model.mmp2[0]).all()
+    assert (models[0.0].ecm[0] == full_model.ecm[0]).all()
+    assert np.allclose(models[1e-12].mmp2[0], full_model.mmp2[0], rtol=0, atol=1e-10)
+    assert np.allclose(models[1e-12].ecm[0], full_model.ecm[0], rtol=0, atol=1e-10)
+    x0, x1, y0, y1 = models[1e-12].active_regions[0]
+    assert (x1 - x0)*(y1 - y0) < 81*81/2
+    assert models[1e-12].active_regions[1] is None or models[1e-12].dormant_sites[1]
+    # the probabilities kept outside of the active regions are the ones of the current ECM
+    for model in models.values():
+        for i in range(model.grids_number):
+            assert (model.movement_probabilities[i] == cancermodel.get_movement_probabilities(model.ecm[i][0], model.config)).all()
+
+def test_occupancy_is_kept_up_to_date(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=100,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path)
+    model.proliferate("mesenchymal")
+    for _ in range(20):
+        model.step()
+    expected_occupancy = np.zeros_like(model.occupancy)
+    for agent in model.schedule.agents:
+        if agent.agent_type == "cell":
+            x, y = agent.pos
+            phenotype_index = 0 if agent.phenotype == "mesenchymal" else 1
+            expected_occupancy[agent.grid_id-1, phenotype_index, x, y] += 1
+    assert (model.occupancy == expected_occupancy).all()
+    assert (model.occupancy.sum(axis=1) <= model.config.carrying_capacity).all()
+
+def test_arrays_engine(tmp_path) -> None:
+    for folder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+        (tmp_path / "agents" / folder).mkdir(parents=True)
+        (tmp_path / "arrays" / folder).mkdir(parents=True)
+    models = {}
+    for engine in ["agents", "arrays"]:
+        models[engine] = CancerModel(
+            number_of_initial_cells=100,
+            width=51,
+            height=51,
+            grids_number=2,
+            max_steps=20,
+            data_collection_period=10,
+            new_simulation_folder=tmp_path / engine,
+            seed=3,
+            engine=engine)
+    arrays_model = models["arrays"]
+    assert len(arrays_model.cells) == 100
+    assert (arrays_model.occupancy == models["agents"].occupancy).all()
+    assert not any(isinstance(agent, CancerCell) for agent in arrays_model.schedule.agents)
+    for _ in range(20):
+        for model in models.values():
+            model.step()
+
+    cells = arrays_model.cells
+    live = cells.live_indexes()
+    expected_occupancy = np.zeros_like(arrays_model.occupancy)
+    np.add.at(expected_occupancy, (cells.site[live], cells.phenotype[live], cells.x[live], cells.y[live]), 1)
+    assert (arrays_model.occupancy == expected_occupancy).all()
+    assert (arrays_model.occupancy.sum(axis=1) <= arrays_model.config.carrying_capacity).all()
+
+    agents_data = load_cells_data(tmp_path / "agents")
+    arrays_data = load_cells_data(tmp_path / "arrays")
+    assert list(agents_data.columns) == list(arrays_data.columns)
+    assert sorted(arrays_data["Step"].unique()) == [10, 20]
+    assert len(arrays_data[arrays_data["Agent Type"] == "vessel"]) == len(agents_data[agents_data["Agent Type"] == "vessel"])
+    assert len(arrays_data[(arrays_data["Step"] == 20) & (arrays_data["Agent Type"] == "cell")]) == len(cells)
+
+def test_arrays_engine_movement(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=0,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path,
+        fixed_p_left=0,
+        fixed_p_right=0,
+        fixed_p_top=1,
+        fixed_p_bottom=0,
+        engine="arrays")
+    model._create_cells(1, [(20, 20)], ["mesenchymal"])
+    for j in range(1, 10):
+        model.step()
+        assert (model.cells.x[0], model.cells.y[0]) == (20, 20 + j)
+        assert model.mesenchymal_count[1][20, 20 + j] == 1
+    assert model.occupancy.sum() == 1
+
+def test_arrays_engine_intravasation(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=0,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path,
+        fixed_p_left=0,
+        fixed_p_right=1,
+        fixed_p_top=0,
+        fixed_p_bottom=0,
+        engine="arrays")
+    x, y = model.grid_vessels_positions[0][0]
+    model._create_cells(0, [(x-1, y), (x-1, y)], ["mesenchymal", "epithelial"])
+    model.step()
+    assert len(model.cells) == 0
+    assert model.occupancy.sum() == 0
+    assert model.vasculature[model.config.vasculature_time].tolist() == [[1, 1]]
+
+def test_movement_probabilities_match_per_cell_formula() -> None:
+    ecm = 1 - 0.5*np.random.default_rng(1).random((11, 13))
+    config = SimulationConfig.from_csv("simulations_configs.csv")
+    probabilities = cancermodel.get_movement_probabilities(ecm, config)
+    th, xh = config.th, config.xh
+    for code, (diff_coeff, phi) in enumerate([(config.dM, config.phiM), (config.dE, config.phiE)]):
+        for x in range(11):
+            for y in range(13):
+                on_left_border, on_right_border = x == 0, x == 10
+                on_bottom_border, on_top_border = y == 0, y == 12
+                p_left   = 0 if on_left_border else th/xh**2*(diff_coeff-phi/4*(0 if on_right_border else ecm[x+1,y]-ecm[x-1,y]))
+                p_right  = 0 if on_right_border else th/xh**2*(diff_coeff+phi/4*(0 if on_left_border else ecm[x+1,y]-ecm[x-1,y]))
+                p_top    = 0 if on_top_border else th/xh**2*(diff_coeff+phi/4*(0 if on_bottom_border else ecm[x,y+1]-ecm[x,y-1]))
+                p_bottom = 0 if on_bottom_border else th/xh**2*(diff_coeff-phi/4*(0 if on_top_border else ecm[x,y+1]-ecm[x,y-1]))
+                p_stay   = 1-(p_left+p_right+p_top+p_bottom)
+                assert np.allclose(probabilities[code,:,x,y], [p_left, p_right, p_top, p_bottom, p_stay], rtol=1e-12, atol=0)
+
+def test_fixed_probabilities_out_of_the_grid_are_dropped() -> None:
+    ecm = np.ones((5, 5))
+    config = SimulationConfig.from_csv("simulations_configs.csv")
+    probabilities = cancermodel.get_movement_probabilities(ecm, config, (0.5, 0.25, 0, 0))
+    assert np.allclose(probabilities.sum(axis=1), 1)
+    assert np.allclose(probabilities[:,:,2,2], [0.5, 0.25, 0, 0, 0.25])
+    # on the left border the move to the left is dropped and the rest normalized
+    assert np.allclose(probabilities[:,:,0,2], [0, 0.5, 0, 0, 0.5])
+    probabilities = cancermodel.get_movement_probabilities(ecm, config, (1, 0, 0, 0))
+    assert np.allclose(probabilities[:,:,0,2], [0, 0, 0, 0, 1])
+    with pytest.raises(ValueError, match="negative"):
+        cancermodel.get_movement_probabilities(ecm, config, (0.5, 0.5, 0.5, 0))
+
+def test_arrays_engine_capacity_approximation(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=0,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path,
+        fixed_p_left=0,
+        fixed_p_right=1,
+        fixed_p_top=0,
+        fixed_p_bottom=0,
+        engine="arrays")
+    capacity = model.config.carrying_capacity
+    # a full grid point, with a crowd behind it trying to move into it
+    model._create_cells(1, [(20, 20)]*capacity, ["epithelial"]*capacity)
+    model._create_cells(1, [(19, 20)]*capacity, ["mesenchymal"]*capacity)
+    model._create_cells(1, [(18, 20)]*2, ["mesenchymal"]*2)
+    model.step()
+    # the places freed by the cells leaving (20, 20) are not offered in the same step
+    assert model.grids[1].count_cells((21, 20)) == capacity
+    assert model.grids[1].count_cells((20, 20)) == 0
+    assert model.grids[1].count_cells((19, 20)) == capacity
+    assert model.grids[1].count_cells((18, 20)) == 2
+    model.step()
+    assert model.grids[1].count_cells((22, 20)) == capacity
+    assert model.grids[1].count_cells((20, 20)) == capacity
+    assert model.grids[1].count_cells((19, 20)) == 0
+    assert model.grids[1].count_cells((18, 20)) == 2
+    assert (model.occupancy.sum(axis=1) <= capacity).all()
+    live = model.cells.live_indexes()
+    assert len(live) == 2*capacity + 2
+
+def test_vessels_masks(tmp_path) -> None:
+    model = CancerModel(
+        number_of_initial_cells=30,
+        width=51,
+        height=51,
+        grids_number=3,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path)
+    assert not any(isinstance(agent, Vessel) for agent in model.schedule.agents)
+    for site in range(model.grids_number):
+        vessels = [vessel for vessel in model.vessel_agents if vessel.grid_id == site + 1]
+        assert model.vessels[site].sum() == len(set(vessel.pos for vessel in vessels))
+        for vessel in vessels:
+            x, y = vessel.pos
+            assert model.vessels[site, x, y]
+            assert model.intravasation_zone[site, x, y]
+            assert model.intravasation_zone[site, max(x-1, 0), y] and model.intravasation_zone[site, x, max(y-1, 0)]
+            if vessel.ruptured:
+                assert model.ruptured_vessels[site, x, y]
+    assert model.ruptured_vessels[0].sum() == model.config.ruptured_vessels_primary
+    assert not model.ruptured_vessels[1:].any()
+
+def reference_proliferate(model, cell_type):
+    # one cell at a time version of the proliferation, kept to check the batched one
+    for agent in model.schedule.agents:
+        if agent.agent_type == "cell" and agent.phenotype == cell_type:
+            if model.config.carrying_capacity > agent.grid.count_cells(agent.pos):
+                model._create_cells(agent.grid_id - 1, [agent.pos], [cell_type])
+
+def test_proliferate_matches_one_at_a_time(tmp_path) -> None:
+    models = []
+    for _ in range(2):
+        model = CancerModel(
+            number_of_initial_cells=0,
+            width=51,
+            height=51,
+            grids_number=2,
+            max_steps=1000,
+            data_collection_period=200000,
+            new_simulation_folder=tmp_path)
+        model._create_cells(0, [(10, 10)]*3 + [(11, 10)] + [(12, 10)]*2, ["mesenchymal", "epithelial", "mesenchymal", "mesenchymal", "epithelial", "epithelial"])
+        model._create_cells(1, [(10, 10)]*2, ["mesenchymal"]*2)
+        models.append(model)
+    arrays_model = CancerModel(
+        number_of_initial_cells=0,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path,
+        engine="arrays")
+    arrays_model._create_cells(0, [(10, 10)]*3 + [(11, 10)] + [(12, 10)]*2, ["mesenchymal", "epithelial", "mesenchymal", "mesenchymal", "epithelial", "epithelial"])
+    arrays_model._create_cells(1, [(10, 10)]*2, ["mesenchymal"]*2)
+    for cell_type in ["mesenchymal", "epithelial", "mesenchymal"]:
+        reference_proliferate(models[0], cell_type)
+        models[1].proliferate(cell_type)
+        arrays_model.proliferate(cell_type)
+        assert (models[0].occupancy == models[1].occupancy).all()
+        assert (models[0].occupancy == arrays_model.occupancy).all()
+        assert models[0].cancer_cells_counter == models[1].cancer_cells_counter == arrays_model.cancer_cells_counter
+    assert models[1].grids[0].count_cells((10, 10)) == models[1].config.carrying_capacity
+    assert models[1].current_agent_id == models[0].current_agent_id
+    assert len(arrays_model.cells) == sum(arrays_model.cancer_cells_counter)
+
+def reference_extravasate(model, clusters, selected_sites, arriving_points):
+    # one cell at a time version of the extravasation, kept to check the batched one
+    for cluster, site, (x, y) in zip(clusters, selected_sites, arriving_points):
+        grid = model.grids[site]
+        for tuple_index, ccells_amount in enumerate(cluster):
+            cell_type = "mesenchymal" if tuple_index == 0 else "epithelial"
+            for _ in range(ccells_amount):
+                for neighbour in [(x-1, y), (x+1, y), (x, y-1), (x, y+1)]:
+                    if not grid.out_of_bounds(neighbour) and model.config.carrying_capacity > grid.count_cells(neighbour):
+                        model._create_cells(site, [neighbour], [cell_type])
+                        break
+
+def test_extravasation_matches_one_at_a_time(tmp_path) -> None:
+    clusters = np.array([[1, 2], [3, 0], [2, 3], [0, 1], [5, 5], [1, 0]])
+    selected_sites = [1, 1, 2, 1, 1, 2]
+    arriving_points = [(10, 10), (10, 10), (0, 5), (11, 10), (10, 10), (0, 5)]
+    models = []
+    for engine in ["agents", "agents", "arrays"]:
+        model = CancerModel(
+            number_of_initial_cells=0,
+            width=51,
+            height=51,
+            grids_number=3,
+            max_steps=1000,
+            data_collection_period=200000,
+            new_simulation_folder=tmp_path,
+            engine=engine)
+        model._create_cells(1, [(9, 10)] * (model.config.carrying_capacity - 1), ["epithelial"] * (model.config.carrying_capacity - 1))
+        models.append(model)
+    reference_extravasate(models[0], clusters.tolist(), selected_sites, arriving_points)
+    models[1].extravasate_clusters(clusters, selected_sites, arriving_points, 2)
+    models[2].extravasate_clusters(clusters, selected_sites, arriving_points, 2)
+    assert (models[0].occupancy == models[1].occupancy).all()
+    assert (models[0].occupancy == models[2].occupancy).all()
+    assert models[0].cancer_cells_counter == models[1].cancer_cells_counter == models[2].cancer_cells_counter
+    arrivals = pd.DataFrame(models[1].arrivals_data, columns=cancermodel.ARRIVALS_COLUMNS)
+    assert arrivals["Grid"].tolist() == [2, 3]
+    assert arrivals["Clusters"].tolist() == [4, 2]
+    assert arrivals["Clusters dead in the vasculature"].tolist() == [2, 2]
+    placed_cells = arrivals["Extravasated mesenchymal cells"] + arrivals["Extravasated epithelial cells"]
+    assert placed_cells.tolist() == [models[1].cancer_cells_counter[1] - (models[1].config.carrying_capacity - 1), models[1].cancer_cells_counter[2]]
+    assert (placed_cells + arrivals["Cells without space"]).sum() == clusters.sum()
+
+def test_disaggregation_keeps_the_order_of_the_clusters(tmp_path) -> None:
+    model = CancerModel(30, 51, 51, 2, 1000, 200000, tmp_path)
+    model.vasculature = Vasculature({1: [(0, 2), (1, 0), (2, 1)], 2: [(2, 1), (1, 0), (0, 2)]})
+    model.config = model.config.replace(dissagreggation_prob=0)
+    model.disaggregate_clusters(1)
+    assert model.vasculature[1].tolist() == [[1, 0], [0, 1], [0, 1], [1, 0], [1, 0], [0, 1]]
+    model.config = model.config.replace(dissagreggation_prob=1)
+    model.disaggregate_clusters(2)
+    assert model.vasculature[2].tolist() == [[1, 0], [2, 1], [0, 2]]
+
+def test_get_file_step() -> None:
+    assert cancermodel.get_file_step("Vasculature-120step.json") == 120
+    assert cancermodel.get_file_step("Cells-are-present-grid-12-1500step.csv") == 1500
+    assert cancermodel.get_file_step("Mmp2-3grid-40step.npy") == 40
+    assert cancermodel.get_file_step(".DS_Store") is None
+
+def test_checkpoint_resume_is_exact(tmp_path) -> None:
+    config = SimulationConfig.from_csv("simulations_configs.csv")
+    for engine in ["agents", "arrays"]:
+        folder = tmp_path / engine / "original"
+        for subfolder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+            (folder / subfolder).mkdir(parents=True)
+        model = CancerModel(
+            number_of_initial_cells=100,
+            width=51,
+            height=51,
+            grids_number=2,
+            max_steps=20,
+            data_collection_period=5,
+            new_simulation_folder=folder,
+            seed=5,
+            engine=engine,
+            checkpoint_period=10)
+        model.vasculature.add_cluster(14, 3, 2)
+        for _ in range(17):
+            model.step()
+        # the copy has the checkpoint of step 10, and the cells data of step 15 that is saved again when loaded
+        copied_folder = tmp_path / engine / "copy"
+        shutil.copytree(folder, copied_folder)
+        simrunner.save_configs(tmp_path / engine, "copy", config, 10, 5)
+        for _ in range(3):
+            model.step()
+        loaded_model = CancerModel(
+            number_of_initial_cells=100,
+            width=51,
+            height=51,
+            grids_number=2,
+            max_steps=10,
+            data_collection_period=5,
+            new_simulation_folder=copied_folder,
+            loaded_simulation_path=copied_folder,
+            engine=engine)
+        assert loaded_model.loaded_max_step == 10
+        # the files of step 15, saved after the checkpoint, are removed until they are saved again
+        for subfolder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+            assert [file_name for file_name in os.listdir(copied_folder / subfolder) if "15step" in file_name] == []
+        for _ in range(10):
+            loaded_model.step()
+        for site in range(2):
+            assert (model.mmp2[site] == loaded_model.mmp2[site]).all()
+            assert (model.ecm[site] == loaded_model.ecm[site]).all()
+        assert (model.occupancy == loaded_model.occupancy).all()
+        assert model.current_agent_id == loaded_model.current_agent_id
+        assert model.arrivals_data == loaded_model.arrivals_data
+        # the arrival of step 15 in the copied Arrivals.csv is not saved twice
+        arrivals = pd.read_csv(folder / "Arrivals.csv")
+        assert len(arrivals) == len(model.arrivals_data) > 0
+        assert arrivals.equals(pd.read_csv(copied_folder / "Arrivals.csv"))
+        assert model.vasculature == {time + 10: clusters for time, clusters in loaded_model.vasculature.items()}
+        assert load_cells_data(folder).equals(load_cells_data(copied_folder))
+        for subfolder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+            assert sorted(os.listdir(folder / subfolder)) == sorted(os.listdir(copied_folder / subfolder))
@@ -0,0 +1,81 @@
+from metaspread.cellstore import cells_data_records, append_cells_data, load_cells_data, convert_cells_data, iter_cells_data_steps, get_last_cells_data_step, CellsDataCollector, CELLS_DATA_FILE, CACHE_FILE, CACHE_KEY_FILE, AGENT_TYPE_CODES, NO_PHENOTYPE
+import numpy as np
+import pandas as pd
+import os
+
+def test_cellstore(tmp_path) -> None:
+    step_10 = pd.DataFrame({"Step": [10, 10], "AgentID": [0, 1], "Position": [(3, 4), (5, 6)],
+                            "Agent Type": ["cell", "vessel"], "Phenotype": ["epithelial", False],
+                            "Ruptured": [False, True], "Grid": [1, 2]})
+    step_20 = step_10.assign(Step=20, Position=[(3, 5), (5, 6)])
+    # the whole history in one csv, as saved by older versions of the simulator
+    pd.concat([step_10, step_20], ignore_index=True).to_csv(tmp_path / "CellsData.csv")
+    legacy_data = load_cells_data(tmp_path)
+    assert legacy_data["X"].tolist() == [3, 5, 3, 5]
+    assert legacy_data["Y"].tolist() == [4, 6, 5, 6]
+    assert convert_cells_data(tmp_path) == 4
+
+    new_folder = tmp_path / "new"
+    new_folder.mkdir()
+    append_cells_data(new_folder, cells_data_records(step_10))
+    append_cells_data(new_folder, cells_data_records(step_20))
+    # a record that was being written when the simulation stopped is ignored
+    with open(os.path.join(new_folder, CELLS_DATA_FILE), "ab") as f:
+        f.write(b"\x00" * 5)
+    data = load_cells_data(new_folder)
+    assert data.equals(load_cells_data(tmp_path))
+    assert data["Step"].tolist() == [10, 10, 20, 20]
+    assert data["Agent Type"].tolist() == ["cell", "vessel", "cell", "vessel"]
+    assert (data["Phenotype"] == "epithelial").tolist() == [True, False, True, False]
+    assert data["Ruptured"].tolist() == [False, True, False, True]
+    assert data["Grid"].tolist() == [1, 2, 1, 2]
+
+def test_cells_data_collector(tmp_path) -> None:
+    collector = CellsDataCollector(tmp_path, capacity=2)
+    for step in [10, 20]:
+        collector.collect(step, np.array([4, 2, 3]), np.array([1, 2, 3]), np.array([4, 5, 6]), 1, AGENT_TYPE_CODES["cell"], np.array([0, 1, 0]), False)
+        collector.collect(step, [0], [7], [8], 2, AGENT_TYPE_CODES["vessel"], NO_PHENOTYPE, [True])
+        collector.write()
+        assert collector.size == 0
+    # the buffer only grows to hold one snapshot
+    assert len(collector.buffer) == 4
+    data = load_cells_data(tmp_path)
+    assert data["Step"].tolist() == [10]*4 + [20]*4
+    assert data["AgentID"].tolist() == [0, 2, 3, 4]*2
+    assert data["X"].tolist() == [7, 2, 3, 1]*2
+    assert data["Phenotype"].isna().tolist() == [True, False, False, False]*2
+    assert data["Phenotype"].tolist()[1:4] == ["epithelial", "mesenchymal", "mesenchymal"]
+    assert data["Ruptured"].tolist() == [True, False, False, False]*2
+
+def test_iter_cells_data_steps(tmp_path) -> None:
+    history = pd.DataFrame({"Step": [10]*3 + [20]*2 + [40]*4, "AgentID": list(range(9)), "Position": [(i, i + 1) for i in range(9)],
+                            "Agent Type": ["cell"]*9, "Phenotype": ["epithelial"]*9, "Ruptured": [False]*9, "Grid": [1]*9})
+    history.to_csv(tmp_path / "CellsData.csv")
+    new_folder = tmp_path / "new"
+    new_folder.mkdir()
+    append_cells_data(new_folder, cells_data_records(history))
+    for folder in [tmp_path, new_folder]:
+        assert get_last_cells_data_step(folder) == 40
+        # chunks smaller than a step, and steps split between chunks
+        for chunk_size in [1, 2, 4, 100]:
+            steps = [(step, records["AgentID"].tolist()) for step, records in iter_cells_data_steps(folder, chunk_size=chunk_size)]
+            assert steps == [(10, [0, 1, 2]), (20, [3, 4]), (40, [5, 6, 7, 8])]
+            steps = [(step, records["X"].tolist()) for step, records in iter_cells_data_steps(folder, [20, 30, 40], chunk_size=chunk_size)]
+            assert steps == [(20, [3, 4]), (30, []), (40, [5, 6, 7, 8])]
+
+def test_legacy_cells_data_cache(tmp_path, mocker) -> None:
+    history = pd.DataFrame({"Step": [10, 10, 20], "AgentID": [0, 1, 0], "Position": [(3, 4), (5, 6), (3, 5)],
+                            "Agent Type": ["cell", "vessel", "cell"], "Phenotype": ["epithelial", False, "epithelial"],
+                            "Ruptured": [False, True, False], "Grid": [1, 2, 1]})
+    history.to_csv(tmp_path / "CellsData.csv")
+    data = load_cells_data(tmp_path)
+    assert os.path.isfile(tmp_path / CACHE_FILE) and os.path.isfile(tmp_path / CACHE_KEY_FILE)
+    # the next reads use the cache instead of parsing the csv
+    read_csv = mocker.spy(pd, "read_csv")
+    assert load_cells_data(tmp_path).equals(data)
+    assert get_last_cells_data_step(tmp_path) == 20
+    assert read_csv.call_count == 0
+    # a resumed simulation changes the csv, so it is parsed again
+    pd.concat([history, history.assign(Step=30)], ignore_index=True).to_csv(tmp_path / "CellsData.csv")
+    assert get_last_cells_data_step(tmp_path) == 30
+    assert load_cells_data(tmp_path)["Step"].tolist() == [10, 10, 20, 30, 30, 30]
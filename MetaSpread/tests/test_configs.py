@@ -20,9 +20,10 @@ def test_configs(tmp_path) -> None:
     temp_simulation_folder.mkdir()
     
     # Parameters for this simulation
-    number_of_initial_cells = configs.number_of_initial_cells # Number of cancer cells
-    gridsize     = configs.gridsize
-    grids_number = configs.grids_number
+    config = configs.SimulationConfig.from_csv('simulations_configs.csv')
+    number_of_initial_cells = config.number_of_initial_cells # Number of cancer cells
+    gridsize     = config.gridsize
+    grids_number = config.grids_number
     width        = gridsize
     height       = gridsize
     max_steps    = 1000
@@ -46,3 +47,33 @@ def test_configs(tmp_path) -> None:
     assert model.max_steps==max_steps
     assert model.data_collection_period == data_collection_period
     assert model.new_simulation_folder==temp_simulation_folder
+
+def test_simulation_config(tmp_path) -> None:
+    config = configs.SimulationConfig.from_csv('simulations_configs.csv')
+    assert config.extravasation_probs == tuple(config.to_dict()["extravasation_probs"])
+    assert configs.SimulationConfig.from_dict(config.to_dict()) == config
+    with pytest.raises(Exception):
+        config.carrying_capacity = 1
+    with pytest.raises(ValueError):
+        config.replace(mesenchymal_proportion=0.9)
+    with pytest.raises(ValueError):
+        configs.SimulationConfig.from_dict({**config.to_dict(), "unknown": 1})
+    with pytest.raises(ValueError):
+        configs.SimulationConfig.from_dict({"th": 0.001})
+
+    # two models with different parameters in the same process
+    models = [CancerModel(
+        number_of_initial_cells=30,
+        width=51,
+        height=51,
+        grids_number=3,
+        max_steps=1000,
+        data_collection_period=200000,
+        new_simulation_folder=tmp_path,
+        config=config.replace(carrying_capacity=capacity)) for capacity in [1, 8]]
+    for model in models:
+        for cell_type in ["mesenchymal", "epithelial", "mesenchymal"]:
+            model.proliferate(cell_type)
+    assert models[0].config.carrying_capacity == 1
+    assert (models[0].occupancy.sum(axis=1) <= 1).all()
+    assert (models[1].occupancy.sum(axis=1) > 1).any()
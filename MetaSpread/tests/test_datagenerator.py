@@ -0,0 +1,60 @@
+from metaspread.datagenerator import CellsDataAnalysis, get_cluster_centroid_radius_and_diameter, get_convex_hull, get_hull_diameter
+from metaspread.cellstore import cells_data_records, records_to_dataframe
+import numpy as np
+import pandas as pd
+
+def test_cells_data_analysis() -> None:
+    rng = np.random.default_rng(0)
+    rows = 300
+    dataframe = pd.DataFrame({
+        "Step": rng.choice([0, 10, 20, 30, 35], rows),
+        "AgentID": np.arange(rows),
+        "X": rng.integers(0, 5, rows),
+        "Y": rng.integers(0, 5, rows),
+        "Agent Type": rng.choice(["cell", "vessel"], rows),
+        "Ruptured": rng.choice([False, True], rows),
+        "Grid": rng.integers(1, 4, rows)})
+    dataframe["Phenotype"] = np.where(dataframe["Agent Type"] == "cell", rng.choice(["mesenchymal", "epithelial"], rows), False)
+    records = cells_data_records(dataframe)
+    steps = [10, 20, 30]
+    analysis = CellsDataAnalysis(records, steps, 2, 5)
+    data = records_to_dataframe(records)
+    growth = analysis.growth(1.0)
+    assert growth["Grid"].tolist() == [1, 1, 1, 2, 2, 2]
+    assert growth["Step"].tolist() == steps*2
+    for grid_id in [1, 2]:
+        for i, step in enumerate(steps):
+            # the same selections as filtering the whole dataframe for this grid and step
+            df = data.loc[(data["Step"] == step) & (data["Grid"] == grid_id)]
+            m = df[df["Phenotype"] == "mesenchymal"]
+            e = df[df["Phenotype"] == "epithelial"]
+            v = df[(df["Agent Type"] == "vessel") & ~df["Ruptured"]]
+            vr = df[(df["Agent Type"] == "vessel") & df["Ruptured"]]
+            expected = []
+            for points in [m, e, v, vr]:
+                expected += [points["X"].tolist(), points["Y"].tolist()]
+            assert analysis.coordinates(grid_id, step) == expected
+            assert growth["Number of Mesenchymal Cells"][(grid_id - 1)*3 + i] == len(m)
+            assert growth["Number of Epithelial Cells"][(grid_id - 1)*3 + i] == len(e)
+
+            cells = pd.concat([m, e])
+            occupancy = cells.groupby(["X", "Y"]).size()
+            histogram = analysis.histogram(grid_id, step)
+            assert dict(zip(histogram["Bins"], histogram["Frequency"])) == {0: 25 - len(occupancy), **occupancy.value_counts().to_dict()}
+            assert histogram["Bins"].iloc[-1] == 0
+            assert sorted(map(tuple, analysis.positions(grid_id, step).tolist())) == sorted(occupancy.index)
+
+def test_cluster_centroid_radius_and_diameter() -> None:
+    centroid, radius, diameter = get_cluster_centroid_radius_and_diameter(np.array([[0, 0], [2, 0], [0, 2], [2, 2]]), 1)
+    assert np.allclose(centroid, [1, 1])
+    assert np.isclose(radius, np.sqrt(2))
+    assert np.isclose(diameter, np.sqrt(8))
+    assert np.isnan(get_cluster_centroid_radius_and_diameter(np.zeros((0, 2)), 1)[1])
+
+def test_hull_diameter_matches_brute_force() -> None:
+    rng = np.random.default_rng(0)
+    point_sets = [rng.integers(0, size, (amount, 2)) for size in [2, 5, 50] for amount in [1, 2, 3, 10, 200]]
+    point_sets += [np.array([[i, 2*i] for i in range(5)]), np.array([[3, i] for i in range(5)]), np.array([[4, 4]]*3)]
+    for points in point_sets:
+        brute_force = np.sqrt(((points[:,None,:] - points[None,:,:])**2).sum(axis=2)).max()
+        assert np.isclose(get_hull_diameter(get_convex_hull(points)), brute_force)
@@ -0,0 +1,42 @@
+import pytest
+import json
+import os
+from metaspread import ensemble
+from metaspread.cellstore import load_cells_data
+
+def test_imports():
+    assert ensemble.np is not None
+    assert ensemble.simrunner is not None
+
+def test_spawn_seeds():
+    seeds = ensemble.spawn_seeds(42, 4)
+    assert seeds == ensemble.spawn_seeds(42, 4)
+    assert len(set(seeds)) == 4
+    assert seeds[:2] == ensemble.spawn_seeds(42, 2)
+    assert seeds != ensemble.spawn_seeds(43, 4)
+
+def test_failed_replicate_is_retried(tmp_path):
+    task = {"replicate": 0, "seed": 1, "folder": str(tmp_path / "Replicate-0"), "retries": 2, "ensemble_id": "test",
+            "max_steps": 2, "data_collection_period": 1, "engine": "unknown", "checkpoint_period": None, "config": None}
+    result = ensemble.run_replicate(task)
+    assert result["Status"] == "failed"
+    assert result["Attempts"] == 3
+    assert "Unknown engine" in result["Error"]
+
+def test_run_ensemble(tmp_path):
+    configs = {"gridsize": 31, "number_of_initial_cells": 20}
+    manifest = ensemble.run_ensemble(3, 4, 2, save_path=tmp_path, master_seed=7, workers=2, engine="arrays", configs=configs)
+    assert manifest["Finished"] == 3
+    assert manifest["Failed"] == 0
+    assert [result["Seed"] for result in manifest["Results"]] == ensemble.spawn_seeds(7, 3)
+    assert len(set(result["Simulation path"] for result in manifest["Results"])) == 3
+    ensemble_path = tmp_path / "Ensembles" / manifest["Ensemble"]
+    with open(ensemble_path / ensemble.MANIFEST_FILE) as f:
+        assert json.load(f)["Master seed"] == 7
+    for result in manifest["Results"]:
+        assert os.path.isfile(os.path.join(result["Simulation path"], "configs.csv"))
+        assert sum(result["Final cancer cells"]) > 0
+        # the cells alive in every site at the last step
+        cells_data = load_cells_data(result["Simulation path"])
+        last_step = cells_data[(cells_data["Step"] == 4) & (cells_data["Agent Type"] == "cell")]
+        assert result["Final cancer cells"] == [int((last_step["Grid"] == grid).sum()) for grid in range(1, len(result["Final cancer cells"]) + 1)]
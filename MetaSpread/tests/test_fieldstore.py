@@ -0,0 +1,23 @@
+from metaspread.fieldstore import save_field, load_field, list_field_files, convert_simulation_fields
+import numpy as np
+import pandas as pd
+import os
+
+def test_fieldstore(tmp_path) -> None:
+    mmp2_folder = os.path.join(tmp_path, "Mmp2")
+    os.makedirs(mmp2_folder)
+    concentration = np.random.rand(5, 5)
+    for step in [0, 10, 20]:
+        save_field(mmp2_folder, "Mmp2", 1, step, concentration * step)
+    save_field(mmp2_folder, "Mmp2", 2, 0, concentration)
+    # a csv file from an older version of the simulator, for a step without a .npy file
+    pd.DataFrame(concentration).to_csv(os.path.join(mmp2_folder, "Mmp2-1grid-100step.csv"))
+    files = list_field_files(mmp2_folder, "Mmp2", 1)
+    assert [os.path.basename(f) for f in files] == ["Mmp2-1grid-0step.npy", "Mmp2-1grid-10step.npy", "Mmp2-1grid-20step.npy", "Mmp2-1grid-100step.csv"]
+    assert len(list_field_files(mmp2_folder, "Mmp2")) == 5
+    assert np.allclose(load_field(files[2]), concentration * 20)
+    assert np.allclose(load_field(files[-1]), concentration)
+    assert convert_simulation_fields(tmp_path, remove_csv=True) == 1
+    files = list_field_files(mmp2_folder, "Mmp2", 1)
+    assert os.path.basename(files[-1]) == "Mmp2-1grid-100step.npy"
+    assert np.allclose(load_field(files[-1]), concentration)
@@ -2,14 +2,12 @@ import pytest
 from metaspread import graphgenerator
 
 def test_imports():
-    assert graphgenerator.ast is not None
     assert graphgenerator.pd is not None
     assert graphgenerator.plt is not None
     assert graphgenerator.np is not None
-    assert graphgenerator.re is not None
     assert graphgenerator.os is not None
     assert graphgenerator.sys is not None
-    assert graphgenerator.metaspread.configs is not None
+    assert graphgenerator.SimulationConfig is not None
 
 def test_generate_graph(mocker):
     mocker.patch('metaspread.graphgenerator.generate_graphs')
@@ -5,4 +5,8 @@ def test_imports():
     assert __main__.simrunner is not None
     assert __main__.datagenerator is not None
     assert __main__.graphgenerator is not None
-    assert __main__.videogenerator is not None
\ No newline at end of file
+    assert __main__.videogenerator is not None
+    assert __main__.fieldstore is not None
+    assert __main__.cellstore is not None
+    assert __main__.ensemble is not None
+    assert __main__.sweep is not None
\ No newline at end of file
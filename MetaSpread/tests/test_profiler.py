@@ -0,0 +1,49 @@
+import pytest
+import json
+import pandas as pd
+from metaspread import profiler
+from metaspread.profiler import StepProfiler
+from metaspread.cancermodel import CancerModel
+
+def test_imports():
+    assert profiler.pd is not None
+    assert profiler.json is not None
+
+def test_step_profiler(tmp_path):
+    step_profiler = StepProfiler()
+    for _ in range(3):
+        with step_profiler.phase("environment"):
+            pass
+    step_profiler.count("cells moved", 5)
+    step_profiler.count("cells moved")
+    step_profiler.progress(3, 3, 10)
+    report = step_profiler.write_report(tmp_path)
+    assert report["Phases"]["environment"]["Calls"] == 3
+    assert report["Counters"]["cells moved"] == 6
+    with open(tmp_path / (profiler.REPORT_FILE + ".json")) as f:
+        assert json.load(f)["Steps"] == 3
+    df = pd.read_csv(tmp_path / (profiler.REPORT_FILE + ".csv"))
+    assert df.set_index("Name").loc["cells moved", "Count"] == 6
+
+def test_model_performance_report(tmp_path):
+    for folder in ["Mmp2", "Ecm", "Vasculature", "Time when grids were populated"]:
+        (tmp_path / folder).mkdir()
+    model = CancerModel(
+        number_of_initial_cells=100,
+        width=51,
+        height=51,
+        grids_number=2,
+        max_steps=6,
+        data_collection_period=3,
+        new_simulation_folder=tmp_path,
+        engine="arrays")
+    for _ in range(6):
+        model.step()
+    with open(tmp_path / (profiler.REPORT_FILE + ".json")) as f:
+        report = json.load(f)
+    assert report["Steps"] == 6
+    assert report["Phases"]["environment"]["Calls"] == 6
+    assert report["Phases"]["movement"]["Calls"] == 6
+    assert report["Phases"]["cells data writer"]["Calls"] == 2
+    assert report["Counters"]["cells moved"] > 0
+    assert report["Counters"]["dormant site steps"] == 6
@@ -0,0 +1,60 @@
+import pytest
+import numpy as np
+import pandas as pd
+import json
+from metaspread import sweep
+from metaspread.configs import SimulationConfig
+from metaspread.cellstore import load_cells_data
+
+def test_imports():
+    assert sweep.np is not None
+    assert sweep.pd is not None
+    assert sweep.ensemble is not None
+
+def test_generate_design():
+    ranges = {"dM": (1e-4, 3e-4), "extravasation_probs": [[0.75, 0.25], [0.5, 0.5]]}
+    design = sweep.generate_design(ranges, "grid", levels=3)
+    assert len(design) == 6
+    assert sorted(set(point["dM"] for point in design)) == pytest.approx([1e-4, 2e-4, 3e-4])
+    design = sweep.generate_design(ranges, "latin_hypercube", points=10, seed=3)
+    assert design == sweep.generate_design(ranges, "latin_hypercube", points=10, seed=3)
+    # every tenth of the range is used by exactly one point
+    intervals = sorted(int((point["dM"] - 1e-4)/2e-5) for point in design)
+    assert intervals == list(range(10))
+    assert [point["extravasation_probs"] for point in design].count([0.5, 0.5]) == 5
+    design = sweep.generate_design(ranges, "random", points=7, seed=3)
+    assert len(design) == 7
+    assert all(1e-4 <= point["dM"] <= 3e-4 for point in design)
+    with pytest.raises(ValueError):
+        sweep.generate_design(ranges, "sobol")
+
+def test_make_config():
+    base_config = SimulationConfig.from_csv("simulations_configs.csv")
+    config = sweep.make_config(base_config, {"carrying_capacity": 5.6, "mesenchymal_proportion": 0.7})
+    assert config.carrying_capacity == 6
+    assert config.mesenchymal_proportion + config.epithelial_proportion == 1
+    with pytest.raises(ValueError):
+        sweep.make_config(base_config, {"extravasation_probs": [0.5, 0.6]})
+    with pytest.raises(ValueError):
+        sweep.make_config(base_config, {"unknown": 1})
+
+def test_run_sweep(tmp_path):
+    ranges = {"carrying_capacity": [2, 6], "extravasation_probs": [[0.75, 0.25], [0.5, 0.6]]}
+    configs = {"gridsize": 31, "number_of_initial_cells": 20}
+    results = sweep.run_sweep(ranges, 4, 2, method="grid", master_seed=1, workers=2, save_path=tmp_path, engine="arrays", configs=configs)
+    assert len(results) == 4
+    assert (results["Status"] == "invalid").sum() == 2
+    assert (results["Status"] == "finished").sum() == 2
+    finished = results[results["Status"] == "finished"]
+    assert (finished["Cancer cells in grid 1"] > 0).all()
+    # the final counts are the cells alive in every site at the last step
+    for _, row in finished.iterrows():
+        cells_data = load_cells_data(row["Simulation path"])
+        last_step = cells_data[(cells_data["Step"] == 4) & (cells_data["Agent Type"] == "cell")]
+        for grid in range(1, 4):
+            assert row[f"Cancer cells in grid {grid}"] == (last_step["Grid"] == grid).sum()
+    assert (finished["Time when grid 1 was first populated"] >= 0).all()
+    assert len(set(results["Seed"])) == 4
+    saved_results = pd.read_csv(next((tmp_path / "Sweeps").iterdir()) / sweep.RESULTS_FILE)
+    assert saved_results["Status"].tolist() == results["Status"].tolist()
+    assert json.loads(saved_results["extravasation_probs"][0]) == [0.75, 0.25]
@@ -0,0 +1,19 @@
+from metaspread.vasculature import Vasculature
+import numpy as np
+import json
+
+def test_vasculature() -> None:
+    vasculature = Vasculature({180: [(2, 3)]})
+    vasculature.add_cluster(180, 1, 0)
+    vasculature.add_cluster(181, 0, 4)
+    assert 180 in vasculature and 181 in vasculature
+    assert vasculature[180].tolist() == [[2, 3], [1, 0]]
+    assert vasculature.count_cells() == 10
+    assert vasculature == {180: [(2, 3), (1, 0)], 181: [(0, 4)]}
+    saved = json.loads(json.dumps(vasculature.to_dict()))
+    assert Vasculature({int(k): v for k, v in saved.items()}) == vasculature
+    assert vasculature.pop(181).tolist() == [[0, 4]]
+    assert 181 not in vasculature
+    del vasculature[180]
+    assert len(vasculature) == 0
+    assert vasculature.count_cells() == 0